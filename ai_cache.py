@@ -0,0 +1,122 @@
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ==========================================
+# AI 解碼結果快取 (Content-addressed, 磁碟持久化)
+# ==========================================
+# 同一主題在同一組 primary_cat / aux_cats 下重新解碼，結果理應相同；
+# 常見情境是 Sheet 寫入失敗後使用者按重試，舊版會再付一次完整的 Gemini 呼叫。
+# 這裡以 (Prompt 模板, 輸入, 分類, 模型, generation_config) 的雜湊為鍵，
+# 把標準化後的 JSON 存進 SQLite，跨 Session / 重啟都能命中。
+# 淘汰策略：LRU (依最後存取時間)，同時限制筆數與總位元組數。
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "ai_decode.sqlite3")
+
+
+def make_cache_key(template, input_text, categories, model_name, generation_config=None):
+    """把所有會影響輸出的參數序列化後做 SHA-256"""
+    payload = json.dumps(
+        {
+            "template": template,
+            "input": str(input_text).strip(),
+            "categories": list(categories),
+            "model": model_name,
+            "config": generation_config or {},
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DecodeCache:
+    """
+    SQLite 實作的 LRU 快取：
+    - get()/put() 皆為執行緒安全 (批量解碼池會從多個執行緒呼叫)。
+    - max_entries / max_bytes 任一超標即從最久未使用的開始淘汰。
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=5000, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS decode_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_decode_cache_accessed ON decode_cache(accessed_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    def get(self, key):
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT value FROM decode_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            db.execute("UPDATE decode_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO decode_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(db)
+
+    def delete(self, key):
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM decode_cache WHERE key = ?", (key,))
+
+    def _evict(self, db):
+        count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM decode_cache").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # 由最久未使用開始刪，直到兩個上限都滿足
+        for key, size in db.execute("SELECT key, size FROM decode_cache ORDER BY accessed_at ASC").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM decode_cache WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+
+    def stats(self):
+        with self._lock, self._connect() as db:
+            count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM decode_cache").fetchone()
+        return {"entries": count, "bytes": total, "hits": self.hits, "misses": self.misses}
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_decode_cache(path=DEFAULT_CACHE_PATH):
+    """取得行程內共用的解碼快取"""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None or _CACHE.path != path:
+            _CACHE = DecodeCache(path)
+        return _CACHE
@@ -4,6 +4,8 @@ import random
 import time
 from streamlit_gsheets import GSheetsConnection
 import streamlit.components.v1 as components
+from kb_snapshot import get_snapshot
+from sampler import DrawHistory, get_sampler
 
 # ==========================================
 # 0. 基礎設定與強制白底 CSS (含手機版優化)
@@ -111,16 +113,20 @@ def get_spreadsheet_url():
     try: return st.secrets["connections"]["gsheets"]["spreadsheet"]
     except: return st.secrets.get("gsheets", {}).get("spreadsheet", "")
 
-@st.cache_data(ttl=60) 
+BUBBLE_COLS = ['word', 'definition', 'roots', 'breakdown']
+
+def fetch_bubbles(conn, url):
+    df = conn.read(spreadsheet=url, ttl=0)
+    for col in BUBBLE_COLS:
+        if col not in df.columns: df[col] = "???"
+    return df.fillna("???")
+
 def load_bubbles():
+    # 本地快照：過期 (60 秒) 時先回傳舊資料，背景再更新，冷啟動不用等 Google
     try:
         conn = st.connection("gsheets", type=GSheetsConnection)
         url = get_spreadsheet_url()
-        df = conn.read(spreadsheet=url, ttl=0)
-        cols = ['word', 'definition', 'roots', 'breakdown']
-        for col in cols:
-            if col not in df.columns: df[col] = "???"
-        return df.fillna("???")
+        return get_snapshot("bubbles", lambda: fetch_bubbles(conn, url), columns=BUBBLE_COLS, max_age=60).get()
     except:
         return pd.DataFrame([
             {"word": "Serendipity", "definition": "意外發現的美好", "roots": "serendip-", "breakdown": "童話故事來的"},
@@ -168,9 +174,19 @@ def render_sarcastic_sponsor():
 # ==========================================
 # 3. 核心功能：泡泡與評分
 # ==========================================
+def get_draw_history():
+    """本 Session 的抽卡紀錄：換一批在抽完整輪之前不重複，也不會連續出現同一個泡泡"""
+    if 'draw_history' not in st.session_state:
+        st.session_state.draw_history = DrawHistory()
+    return st.session_state.draw_history
+
+def draw_bubbles(df):
+    # 只在列位置上抽樣，只有抽中的 3 列才轉成 dict
+    return df.iloc[get_sampler("bubbles", df).draw(3, history=get_draw_history())].to_dict('records')
+
 def render_game_area(df):
     if 'current_bubbles' not in st.session_state:
-        st.session_state.current_bubbles = df.sample(min(3, len(df))).to_dict('records')
+        st.session_state.current_bubbles = draw_bubbles(df)
     if 'selected_bubble_idx' not in st.session_state:
         st.session_state.selected_bubble_idx = None
 
@@ -178,7 +194,7 @@ def render_game_area(df):
     col_head_1, col_head_2, col_head_3 = st.columns([1, 2, 1])
     with col_head_2:
         if st.button("🔄 這些太醜了，換一批！", use_container_width=True):
-            st.session_state.current_bubbles = df.sample(min(3, len(df))).to_dict('records')
+            st.session_state.current_bubbles = draw_bubbles(df)
             st.session_state.selected_bubble_idx = None
             st.rerun()
 
@@ -8,11 +8,24 @@ import random
 import os
 from io import BytesIO
 from PIL import Image, ImageOps
-from gtts import gTTS
 import google.generativeai as genai
 from streamlit_gsheets import GSheetsConnection
 import streamlit.components.v1 as components
 import markdown
+from audio_cache import get_audio_src
+from sheet_store import GSheetsBackend, SheetStore
+from kb_backend import backend_name, get_sqlite_store
+from master_pack import get_master_pack
+from write_behind import MetricsSheetSink, RowAppendSink, get_metrics_buffer, get_report_queue
+from kb_snapshot import describe_staleness, get_snapshot
+from search_index import get_fuzzy_index, get_search_index
+from facets import get_facet_index
+from sampler import DrawHistory, get_sampler
+from pagination import render_pager
+from user_store import SheetUserStore, SQLiteUserStore, update_with_retry
+from credit_ledger import UserStoreCreditSink, get_credit_ledger
+from json_repair import RepairError, loads as repair_loads
+from render_cache import memoize_text
 # ==========================================
 # 0. 用戶系統核心工具 (移植自 Kadowsella)
 # ==========================================
@@ -20,39 +33,98 @@ def hash_password(password):
     import hashlib
     return hashlib.sha256(str.encode(password)).hexdigest()
 
-def load_user_db():
-    """讀取用戶資料表"""
+@st.cache_resource
+def get_user_repo():
+    """
+    用戶資料庫 (列級讀寫，見 user_store.py)：
+    設定環境變數 USER_STORE_SQLITE 時改用本地 SQLite (離線測試)，否則使用 users 工作表
+    """
+    sqlite_path = os.environ.get("USER_STORE_SQLITE")
+    if sqlite_path:
+        return SQLiteUserStore(sqlite_path)
+    backend = GSheetsBackend.from_service_account(
+        st.secrets["connections"]["gsheets"], get_spreadsheet_url(), worksheet="users"
+    )
+    return SheetUserStore(backend)
+
+def load_user(username):
+    """只讀取單一用戶那一列；找不到或連線失敗回傳 None"""
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df = conn.read(worksheet="users", ttl=0)
-        # 確保必要欄位存在
-        cols = ['username', 'password', 'role', 'membership', 'ai_usage', 'is_online', 'last_seen']
-        for col in cols:
-            if col not in df.columns: 
-                df[col] = "free" if col=="membership" else (0 if col=="ai_usage" else "無")
-        return df.fillna("無")
-    except: 
-        return pd.DataFrame(columns=['username', 'password', 'role', 'membership', 'ai_usage', 'is_online', 'last_seen'])
+        return get_user_repo().get(username)
+    except Exception as e:
+        print(f"⚠️ 讀取用戶失敗: {e}")
+        return None
 
 def save_user_to_db(new_data):
-    """註冊新用戶"""
+    """註冊新用戶 (帳號已存在時回傳 False)"""
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df = conn.read(worksheet="users", ttl=0)
-        new_data['created_at'] = time.strftime("%Y-%m-%d")
-        updated_df = pd.concat([df, pd.DataFrame([new_data])], ignore_index=True)
-        conn.update(worksheet="users", data=updated_df)
-        return True
-    except: return False
+        return get_user_repo().create(new_data)
+    except Exception as e:
+        print(f"⚠️ 註冊失敗: {e}")
+        return False
 
 def update_user_status(username, column, value):
-    """更新用戶特定狀態 (如在線時間、餘額)"""
+    """更新用戶特定狀態 (如在線時間、餘額)：只寫那一列的那幾格"""
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        df = conn.read(worksheet="users", ttl=0)
-        df.loc[df['username'] == username, column] = value
-        conn.update(worksheet="users", data=df)
-    except: pass
+        update_with_retry(get_user_repo(), username, {column: value, "last_seen": time.strftime("%Y-%m-%d %H:%M:%S")})
+    except Exception as e:
+        print(f"⚠️ 更新用戶狀態失敗: {e}")
+
+def get_ai_credit_cost(action):
+    """
+    每次 AI 呼叫扣除的點數，由 Secrets 設定 (例如 AI_CREDIT_COST = { decode = 1, handout = 5 })。
+    原版從未扣點：未設定時一律為 0，不預扣、也不會因餘額不足擋下 AI 呼叫；設定後才啟用計費。
+    """
+    try:
+        costs = st.secrets.get("AI_CREDIT_COST") or {}
+        return max(0, int(costs.get(action, 0)))
+    except Exception:
+        # 沒有 secrets.toml 或設定值不是整數
+        return 0
+
+def get_app_credit_ledger():
+    """點數帳本 (見 credit_ledger.py)：扣款先記在本地帳本，背景批次寫回 users.ai_usage"""
+    repo = get_user_repo()
+    return get_credit_ledger(os.path.splitext(os.path.basename(__file__))[0], UserStoreCreditSink(lambda: repo))
+
+def reserve_ai_credits(action):
+    """
+    AI 呼叫前預扣點數 (不經過 Sheets)：
+    回傳預扣編號；不需計費 (未設定點數或未登入的管理員模式) 回傳 ""；餘額不足時顯示錯誤並回傳 None
+    """
+    cost = get_ai_credit_cost(action)
+    username = st.session_state.get("username")
+    if cost <= 0 or not st.session_state.get("logged_in") or not username:
+        return ""
+    if username == "訪客":
+        # 訪客額度只存在本次 Session
+        if st.session_state.get("user_balance", 0) < cost:
+            st.error(f"❌ 試用額度不足 (需要 {cost} 點)，請註冊帳號。")
+            return None
+        return "guest"
+    try:
+        hold = get_app_credit_ledger().reserve(username, cost)
+    except Exception as e:
+        print(f"⚠️ 點數帳本無法使用: {e}")
+        return ""
+    if hold is None:
+        st.error(f"❌ AI 點數不足 (需要 {cost} 點，剩餘 {st.session_state.get('user_balance', 0)} 點)。")
+    return hold
+
+def settle_ai_credits(action, hold, success):
+    """AI 呼叫結束：成功則確認扣款，失敗則退回預扣，並更新畫面上的餘額"""
+    if not hold:
+        return
+    if hold == "guest":
+        if success:
+            st.session_state.user_balance -= get_ai_credit_cost(action)
+        return
+    ledger = get_app_credit_ledger()
+    if success:
+        ledger.commit(hold)
+    else:
+        ledger.release(hold)
+    st.session_state.user_balance = ledger.balance(st.session_state.username)
 # ==========================================
 # 2. 登入頁面 UI (移植自 Kadowsella)
 # ==========================================
@@ -84,31 +156,29 @@ def login_page():
                 submit_button = st.form_submit_button("進入戰情室", use_container_width=True)
 
                 if submit_button:
-                    # 讀取用戶資料庫
-                    users_db = load_user_db()
+                    # 只讀取這個帳號的那一列
+                    user_data = load_user(username_input)
                     hashed_password_input = hash_password(password_input)
                     
                     # 驗證用戶
-                    user_record = users_db[
-                        (users_db['username'] == username_input) & 
-                        (users_db['password'] == hashed_password_input)
-                    ]
-                    
-                    if not user_record.empty:
-                        user_data = user_record.iloc[0]
-                        
+                    if user_data is not None and user_data['password'] == hashed_password_input:
                         # A. 設定 Session State
                         st.session_state.logged_in = True
                         st.session_state.username = username_input
                         st.session_state.role = user_data['role']
                         
-                        # B.【關鍵修正】：從資料庫讀取真實餘額
+                        # B.【關鍵修正】：從資料庫讀取真實餘額 (加上本行程尚未寫回的扣款)
                         try:
-                            # 嘗試將資料庫中的餘額 (ai_usage) 轉為整數
-                            st.session_state.user_balance = int(user_data['ai_usage'])
-                        except (ValueError, TypeError):
-                            # 如果儲存格是空的或格式錯誤，給一個預設值 0
-                            st.session_state.user_balance = 0
+                            ledger = get_app_credit_ledger()
+                            ledger.load(username_input, user_data['ai_usage'])
+                            st.session_state.user_balance = ledger.balance(username_input)
+                        except Exception:
+                            try:
+                                # 嘗試將資料庫中的餘額 (ai_usage) 轉為整數
+                                st.session_state.user_balance = int(float(user_data['ai_usage']))
+                            except (ValueError, TypeError):
+                                # 如果儲存格是空的或格式錯誤，給一個預設值 0
+                                st.session_state.user_balance = 0
                             
                         # C. 更新在線狀態
                         update_user_status(username_input, "is_online", "TRUE")
@@ -260,8 +330,9 @@ def get_gemini_keys():
     random.shuffle(shuffled_keys)
     return shuffled_keys
 
+@memoize_text
 def fix_content(text):
-    """全域字串清洗 (v3.0 邏輯)"""
+    """全域字串清洗 (v3.0 邏輯)；結果依原始值快取，同一欄位內容跨 rerun 只清洗一次"""
     if text is None or str(text).strip() in ["無", "nan", ""]: return ""
     text = str(text)
     text = text.replace('\\n', '  \n').replace('\n', '  \n')
@@ -269,6 +340,11 @@ def fix_content(text):
     text = text.strip('"').strip("'")
     return text
 
+@memoize_text
+def render_roots(roots):
+    """字根欄位的 LaTeX 版本 ($ 轉成 $$ 區塊)"""
+    return fix_content(roots).replace('$', '$$')
+
 def speak(text, key_suffix=""):
     """TTS 發音生成 (v3.0 HTML 按鈕版)"""
     if not text: return
@@ -277,11 +353,9 @@ def speak(text, key_suffix=""):
     if not english_only: return
 
     try:
-        tts = gTTS(text=english_only, lang='en')
-        fp = BytesIO()
-        tts.write_to_fp(fp)
-        audio_base64 = base64.b64encode(fp.getvalue()).decode()
-        unique_id = f"audio_{int(time.time()*1000)}_{key_suffix}"
+        audio_src = get_audio_src(english_only)
+        if not audio_src: return
+        unique_id = f"audio_{abs(hash(english_only))}_{key_suffix}"
         
         html_code = f"""
         <html>
@@ -292,7 +366,7 @@ def speak(text, key_suffix=""):
         </style>
         <body>
             <button class="btn" onclick="document.getElementById('{unique_id}').play()">🔊 聽發音</button>
-            <audio id="{unique_id}" style="display:none" src="data:audio/mp3;base64,{audio_base64}"></audio>
+            <audio id="{unique_id}" style="display:none" preload="none" src="{audio_src}"></audio>
         </body>
         </html>
         """
@@ -304,58 +378,149 @@ def get_spreadsheet_url():
     try: return st.secrets["connections"]["gsheets"]["spreadsheet"]
     except: return st.secrets["gsheets"]["spreadsheet"]
 def log_user_intent(label):
-    """靜默紀錄用戶意願"""
+    """
+    靜默紀錄用戶意願 (Metrics)
+    只在記憶體累加並寫入本地 journal 後立即返回，由背景執行緒批次把增量寫回 metrics 工作表
+    (見 write_behind.py)，Sheets 延遲不再落在使用者的請求上。
+    """
+    if not label: return
+
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
+        creds = st.secrets["connections"]["gsheets"]
         url = get_spreadsheet_url()
-        try: 
-            m_df = conn.read(spreadsheet=url, worksheet="metrics", ttl=0)
-            m_df['count'] = pd.to_numeric(m_df['count'], errors='coerce').fillna(0).astype(int)
-        except: 
-            m_df = pd.DataFrame(columns=['label', 'count'])
-        
-        if label in m_df['label'].values:
-            m_df.loc[m_df['label'] == label, 'count'] += 1
-        else:
-            new_record = pd.DataFrame([{'label': label, 'count': 1}])
-            m_df = pd.concat([m_df, new_record], ignore_index=True)
-            
-        conn.update(spreadsheet=url, worksheet="metrics", data=m_df)
-    except:
-        pass # 發生錯誤也不要打擾用戶
-
-@st.cache_data(ttl=360) 
-def load_db(source_type="Google Sheets"):
-    COL_NAMES = ['category', 'roots', 'meaning', 'word', 'breakdown', 'definition', 'phonetic', 'example', 'translation', 'native_vibe', 'synonym_nuance', 'visual_prompt', 'social_status', 'emotional_tone', 'street_usage', 'collocation', 'etymon_story', 'usage_warning', 'memory_hook', 'audio_tag', 'term']
-    df = pd.DataFrame(columns=COL_NAMES)
+        if not url: return
+        # 連線在背景執行緒第一次送出時才建立
+        sink = MetricsSheetSink(lambda: GSheetsBackend.from_service_account(creds, url, worksheet="metrics"))
+        # 每個 App 一份 journal (以檔名區分)
+        get_metrics_buffer(os.path.splitext(os.path.basename(__file__))[0], sink).incr(label)
+    except Exception as e:
+        # 在 Console 輸出錯誤以便除錯，但不中斷前端顯示
+        print(f"⚠️ Metrics logging failed for '{label}': {e}")
+
+DB_COLS = ['category', 'roots', 'meaning', 'word', 'breakdown', 'definition', 'phonetic', 'example', 'translation', 'native_vibe', 'synonym_nuance', 'visual_prompt', 'social_status', 'emotional_tone', 'street_usage', 'collocation', 'etymon_story', 'usage_warning', 'memory_hook', 'audio_tag', 'term']
+
+def normalize_db(df):
+    for col in DB_COLS:
+        if col not in df.columns: df[col] = 0 if col == 'term' else "無"
+    return df.dropna(subset=['word']).fillna("無")[DB_COLS].reset_index(drop=True)
+
+MASTER_DB_PATH = "master_db.json"
+# Local JSON 模式的目錄欄位：首頁儀表板、分面索引、列表與拼字建議只需要這幾欄
+CATALOG_COLS = ['word', 'category', 'roots', 'definition']
+
+def get_local_pack():
+    """KB_BACKEND=json 時回傳 master_db.pack (來源變動時自動重建)；其他後端或檔案不存在時回傳 None"""
+    if backend_name(st.secrets) != "json" or not os.path.exists(MASTER_DB_PATH):
+        return None
+    return get_master_pack(MASTER_DB_PATH)
+
+def pack_records(pack, positions):
+    """只解碼 .pack 中指定編號的紀錄 (缺少 word 欄時以主鍵補上)，回傳與其他後端相同欄位的 DataFrame"""
+    rows = []
+    for i in positions:
+        rec = pack.record(i)
+        rec = rec if isinstance(rec, dict) else {}
+        if not rec.get('word'): rec['word'] = pack.key(i)
+        rows.append(rec)
+    return normalize_db(pd.DataFrame(rows))
+
+@st.cache_resource(max_entries=1)
+def load_pack_catalog(source_stamp, _pack):
+    """
+    Local JSON 模式的輕量目錄：逐筆掃過 .pack，只保留 CATALOG_COLS 四欄；列位置 = .pack 紀錄編號。
+    以來源 JSON 的 (修改時間, 大小) 為快取鍵；cache_resource 每次 rerun 回傳同一個物件，
+    分面 / 抽樣 / 搜尋索引用 is 判斷即可略過，不必每次重算內容指紋。
+    """
+    rows = []
+    for i in range(len(_pack)):
+        rec = _pack.record(i)
+        rec = rec if isinstance(rec, dict) else {}
+        rows.append([rec.get('word') or _pack.key(i)] + [rec.get(c) for c in CATALOG_COLS[1:]])
+    return pd.DataFrame(rows, columns=CATALOG_COLS).fillna("無")
+
+@st.cache_resource(max_entries=1)
+def load_local_db(source_stamp, _pack):
+    """Local JSON 模式的完整 DataFrame：只有「關鍵字包含」全文檢索需要，第一次搜尋時才解碼全部紀錄"""
+    return pack_records(_pack, range(len(_pack)))
+
+def load_full_db(df):
+    """Local JSON 模式下 df 只是目錄，需要全部欄位時換成完整資料；其他後端直接回傳 df"""
+    pack = get_local_pack()
+    return df if pack is None else load_local_db(pack.source_stamp, pack)
+
+def get_draw_history():
+    """本 Session 的抽卡紀錄：換一批 / 抽下一個在抽完整輪之前不重複，也不會連續抽到同一張"""
+    if 'draw_history' not in st.session_state:
+        st.session_state.draw_history = DrawHistory()
+    return st.session_state.draw_history
+
+def sample_cards(df, n, domain=None):
+    """
+    隨機抽卡：在分面索引的列位置上抽樣 (同一 Session 整輪抽完前不重複)，只取出抽中的列；
+    Local JSON 模式的 df 是目錄，列位置即 .pack 紀錄編號，只解碼抽中的這幾筆。
+    """
+    positions = get_sampler("sheet1_full", df).draw(n, domain=domain, history=get_draw_history())
+    pack = get_local_pack()
+    if pack is not None:
+        return pack_records(pack, positions)
+    return df.iloc[positions]
+
+def get_kb_snapshot():
+    """Google Sheets 的本地快照：過期 (360 秒) 時回傳舊資料並在背景更新"""
+    conn = st.connection("gsheets", type=GSheetsConnection)
+    url = get_spreadsheet_url()
+    return get_snapshot("sheet1_full", lambda: normalize_db(conn.read(spreadsheet=url, ttl=0)), columns=DB_COLS, max_age=360)
+
+@st.cache_resource
+def get_sheet1_store():
+    """Sheet1 列級儲存 (跨 Session 共用)：實驗室只讀 word 欄建索引、只追加 / 刪除受影響的列"""
+    creds = st.secrets["connections"]["gsheets"]
+    backend = GSheetsBackend.from_service_account(creds, get_spreadsheet_url())
+    return SheetStore(backend, DB_COLS, key="word")
+
+def get_kb_store():
+    """
+    知識庫讀寫端 (介面見 kb_backend.py)：
+    KB_BACKEND=sqlite 時為本地 SQLite (首次使用從 master_db.json 匯入)，否則為 Sheet1 列級儲存。
+    """
+    if backend_name(st.secrets) == "sqlite":
+        return get_sqlite_store("sheet1_full", DB_COLS, seed_json="master_db.json")
+    return get_sheet1_store()
+
+def load_db(source_type=None):
     try:
-        if source_type == "Google Sheets":
-            conn = st.connection("gsheets", type=GSheetsConnection)
-            url = get_spreadsheet_url()
-            df = conn.read(spreadsheet=url, ttl=0)
-        elif source_type == "Local JSON":
-            if os.path.exists("master_db.json"):
-                with open("master_db.json", "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                if data: df = pd.DataFrame(data)
-        for col in COL_NAMES:
-            if col not in df.columns: df[col] = 0 if col == 'term' else "無"
-        return df.dropna(subset=['word']).fillna("無")[COL_NAMES].reset_index(drop=True)
+        if source_type is None:
+            source_type = {"sqlite": "SQLite", "json": "Local JSON"}.get(backend_name(st.secrets), "Google Sheets")
+        if source_type == "Local JSON":
+            # 只回傳輕量目錄；完整紀錄在抽卡 / 查詢時才從 .pack 解碼 (見 sample_cards / load_full_db)
+            if not os.path.exists(MASTER_DB_PATH):
+                return pd.DataFrame(columns=CATALOG_COLS)
+            pack = get_master_pack(MASTER_DB_PATH)
+            return load_pack_catalog(pack.source_stamp, pack)
+        if source_type == "SQLite":
+            # 本地 SQLite：直接查詢，資料未變動時回傳同一個 DataFrame
+            return get_kb_store().frame()
+        snap = get_kb_snapshot()
+        df = snap.get()
+        status = snap.status()
+        if status["stale"] or status["last_error"]:
+            st.caption(f"📦 資料快照：{describe_staleness(status)}")
+        return df
     except Exception as e:
         st.error(f"❌ 資料庫載入失敗: {e}")
-        return pd.DataFrame(columns=COL_NAMES)
+        return pd.DataFrame(columns=DB_COLS)
 
 def submit_report(row_data):
+    # 回報先寫入本地佇列後立即返回，由背景執行緒批次追加到回報試算表 (見 write_behind.ReportQueue)
     try:
         FEEDBACK_URL = "https://docs.google.com/spreadsheets/d/1NNfKPadacJ6SDDLw9c23fmjq-26wGEeinTbWcg7-gFg/edit?gid=0#gid=0"
-        conn = st.connection("gsheets", type=GSheetsConnection)
+        creds = st.secrets["connections"]["gsheets"]
         report_row = row_data.copy()
         report_row['term'] = 1
-        try: existing = conn.read(spreadsheet=FEEDBACK_URL, ttl=0)
-        except: existing = pd.DataFrame()
-        updated = pd.concat([existing, pd.DataFrame([report_row])], ignore_index=True)
-        conn.update(spreadsheet=FEEDBACK_URL, data=updated)
-        st.toast(f"✅ 已回報「{row_data.get('word')}」", icon="🛠️")
+        sink = RowAppendSink(lambda: GSheetsBackend.from_service_account(creds, FEEDBACK_URL))
+        queue = get_report_queue(os.path.splitext(os.path.basename(__file__))[0], sink)
+        if queue.enqueue(report_row): st.toast(f"✅ 已回報「{row_data.get('word')}」", icon="🛠️")
+        else: st.toast(f"👌「{row_data.get('word')}」剛剛已回報過", icon="ℹ️")
         return True
     except Exception as e:
         st.error(f"回報失敗: {e}")
@@ -412,6 +577,10 @@ def ai_decode_and_save(input_text, fixed_category):
     """
     final_prompt = f"{SYSTEM_PROMPT}\n\n解碼目標：「{input_text}」"
 
+    hold = reserve_ai_credits("decode")
+    if hold is None:
+        return None
+
     last_error = None
     for key in keys:
         try:
@@ -420,18 +589,21 @@ def ai_decode_and_save(input_text, fixed_category):
             model = genai.GenerativeModel('gemini-2.0-flash')
             response = model.generate_content(final_prompt)
             if response and response.text:
+                settle_ai_credits("decode", hold, True)
                 return response.text
         except Exception as e:
             last_error = e
             print(f"⚠️ Etymon Key failed: {e}")
             continue
     
+    settle_ai_credits("decode", hold, False)
     st.error(f"❌ 所有 Key 皆失敗: {last_error}")
     return None
-def show_encyclopedia_card(row):
-    # 1. 變數定義與清洗
+def show_encyclopedia_card(row, key_suffix=None):
+    # 1. 變數定義與清洗 (key_suffix：同一頁有多張卡片時用來區分按鈕 key，預設為主題名稱)
     r_word = str(row.get('word', '未命名主題'))
-    r_roots = fix_content(row.get('roots', "")).replace('$', '$$')
+    if key_suffix is None: key_suffix = r_word
+    r_roots = render_roots(row.get('roots', ""))
     r_phonetic = fix_content(row.get('phonetic', "")) 
     r_breakdown = fix_content(row.get('breakdown', ""))
     r_def = fix_content(row.get('definition', ""))
@@ -494,14 +666,14 @@ def show_encyclopedia_card(row):
     op1, op2, op3 = st.columns([1, 1, 1.5])
     
     with op1:
-        speak(r_word, f"card_{r_word}")
+        speak(r_word, f"card_{key_suffix}")
         
     with op2:
-        if st.button("🚩 有誤回報", key=f"rep_{r_word}", use_container_width=True):
+        if st.button("🚩 有誤回報", key=f"rep_{key_suffix}", use_container_width=True):
             submit_report(row.to_dict() if hasattr(row, 'to_dict') else row)
             
     with op3:
-        if st.button("📄 生成講義 (預覽)", key=f"jump_ho_{r_word}", type="primary", use_container_width=True):
+        if st.button("📄 生成講義 (預覽)", key=f"jump_ho_{key_suffix}", type="primary", use_container_width=True):
             # 🔥 修改重點：使用 f-string 把 r_word (單字變數) 塞進去
             log_user_intent(f"jump_{r_word}") 
             
@@ -553,18 +725,18 @@ def page_etymon_lab():
             st.warning("請先輸入內容。")
             return
 
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        url = get_spreadsheet_url()
-        existing_data = conn.read(spreadsheet=url, ttl=0)
-        
-        is_exist = False
-        if not existing_data.empty:
-            match_mask = existing_data['word'].astype(str).str.lower() == new_word.lower()
-            is_exist = match_mask.any()
+        # 只以主鍵查詢這一個單字 (Sheets 讀 word 欄索引 + 單列；SQLite 走主鍵索引)，不下載整張表
+        try:
+            store = get_kb_store()
+            existing = store.get(new_word)
+        except Exception as e:
+            st.error(f"❌ 無法連線至知識庫: {e}")
+            return
+        is_exist = existing is not None
 
         if is_exist and not force_refresh:
             st.warning(f"⚠️ 「{new_word}」已在書架上。")
-            show_encyclopedia_card(existing_data[match_mask].iloc[0].to_dict())
+            show_encyclopedia_card(existing)
             return
 
         with st.spinner(f'正在以【{final_category}】視角進行三位一體解碼...'):
@@ -575,31 +747,24 @@ def page_etymon_lab():
                 return
 
             try:
-                # 1. 提取 JSON
-                match = re.search(r'\{.*\}', raw_res, re.DOTALL)
-                if not match:
+                # 1. 提取並修復 JSON (單次掃描：前後雜訊、LaTeX 反斜線、原始換行、截斷，見 json_repair.py)
+                try:
+                    res_data = repair_loads(raw_res)
+                except RepairError:
+                    res_data = None
+                if not isinstance(res_data, dict):
                     st.error("解析失敗：找不到 JSON 結構。")
                     st.code(raw_res)
                     return
-                
-                json_str = match.group(0)
 
-                # 2. 解析 JSON
-                try:
-                    res_data = json.loads(json_str, strict=False)
-                except json.JSONDecodeError:
-                    fixed_json = json_str.replace('\n', '\\n').replace('\r', '\\r')
-                    res_data = json.loads(fixed_json, strict=False)
-
-                # 3. 寫回資料庫
-                if is_exist and force_refresh:
-                    existing_data = existing_data[~match_mask]
-                
-                new_row = pd.DataFrame([res_data])
-                updated_df = pd.concat([existing_data, new_row], ignore_index=True)
-                
-                conn.update(spreadsheet=url, data=updated_df)
-                st.success(f"🎉 「{new_word}」解碼完成並已存入雲端！")
+                # 2. 寫回資料庫 (強制刷新時取代舊版本；SQLite 為單一交易)
+                res_data.setdefault('word', new_word)
+                store.sync([res_data], replace=force_refresh)
+                if isinstance(store, SheetStore):
+                    get_kb_snapshot().invalidate()
+                    st.success(f"🎉 「{new_word}」解碼完成並已存入雲端！")
+                else:
+                    st.success(f"🎉 「{new_word}」解碼完成並已存入本地知識庫！")
                 st.balloons()
                 show_encyclopedia_card(res_data)
 
@@ -613,10 +778,12 @@ def page_etymon_home(df):
     st.write("---")
     
     # 1. 數據儀表板
+    # 分面索引每份資料只建一次，計數都是預先算好的常數
+    facets = get_facet_index("sheet1_full", df)
     c1, c2, c3 = st.columns(3)
     c1.metric("📚 總單字量", len(df))
-    c2.metric("🏷️ 分類主題", df['category'].nunique() if not df.empty else 0)
-    c3.metric("🧩 獨特字根", df['roots'].nunique() if not df.empty else 0)
+    c2.metric("🏷️ 分類主題", len(facets.domains))
+    c3.metric("🧩 獨特字根", facets.nunique("roots"))
     
     st.write("---")
 
@@ -630,7 +797,7 @@ def page_etymon_home(df):
     
     if not df.empty:
         if 'home_sample' not in st.session_state:
-            st.session_state.home_sample = df.sample(min(3, len(df)))
+            st.session_state.home_sample = sample_cards(df, 3)
         
         sample = st.session_state.home_sample
         cols = st.columns(3)
@@ -660,19 +827,23 @@ def page_etymon_learn(df):
     
     # --- Tab 1: 隨機探索 ---
     with tab_card:
-        cats = ["全部"] + sorted(df['category'].unique().tolist())
+        facets = get_facet_index("sheet1_full", df)
+        cats = ["全部"] + facets.domains
         sel_cat = st.selectbox("選擇學習分類", cats, key="learn_cat_select")
-        f_df = df if sel_cat == "全部" else df[df['category'] == sel_cat]
+        domain = None if sel_cat == "全部" else sel_cat
         
         if 'curr_w' not in st.session_state: st.session_state.curr_w = None
         
         if st.button("🎲 隨機探索下一字 (Next Word)", use_container_width=True, type="primary"):
-            if not f_df.empty:
-                st.session_state.curr_w = f_df.sample(1).iloc[0].to_dict()
+            picked = sample_cards(df, 1, domain)
+            if not picked.empty:
+                st.session_state.curr_w = picked.iloc[0].to_dict()
                 st.rerun()
         
-        if st.session_state.curr_w is None and not f_df.empty:
-            st.session_state.curr_w = f_df.sample(1).iloc[0].to_dict()
+        if st.session_state.curr_w is None:
+            picked = sample_cards(df, 1, domain)
+            if not picked.empty:
+                st.session_state.curr_w = picked.iloc[0].to_dict()
             
         if st.session_state.curr_w:
             show_encyclopedia_card(st.session_state.curr_w)
@@ -687,23 +858,54 @@ def page_etymon_learn(df):
 
         if search_query:
             query_clean = search_query.strip().lower()
-            if search_mode == "精確匹配":
+            pack = get_local_pack()
+            if search_mode == "精確匹配" and pack is not None:
+                # Local JSON：雜湊表 O(1) 查詢，只解碼命中的那一筆
+                hit = pack.find(query_clean)
+                display_df = pack_records(pack, [] if hit is None else [hit])
+            elif search_mode == "精確匹配":
                 mask = df['word'].str.strip().str.lower() == query_clean
+                display_df = df[mask]
             else:
-                mask = df.astype(str).apply(lambda x: x.str.contains(query_clean, case=False)).any(axis=1)
-            
-            display_df = df[mask]
+                # 倒排索引檢索全部欄位 (中文雙字 n-gram + 英文子字串)，依相關度排序；
+                # substring=True 保留舊版「包含」語意 (tion 也找得到 gravitation)
+                full_df = load_full_db(df)
+                search_idx = get_search_index("sheet1_full", full_df, exclude=("term", "updated_at"))
+                display_df = full_df.iloc[search_idx.search(query_clean, substring=True)]
             
             if not display_df.empty:
                 st.info(f"💡 找到 {len(display_df)} 筆結果：")
-                for index, row in display_df.iterrows():
-                    with st.container(border=True): show_encyclopedia_card(row)
+                # 分頁 + 延遲展開：只有按下「展開」的結果才渲染完整卡片 (含 TTS)，
+                # 每次 rerun 的元件與發音請求數量以頁面大小為上限
+                start, end = render_pager("list_hits", len(display_df), reset_token=(query_clean, search_mode))
+                # 展開狀態與按鈕 key 以列索引標籤區分 (同名主題可能重複出現)；換查詢時清空
+                if st.session_state.get('expanded_hits_token') != (query_clean, search_mode):
+                    st.session_state.expanded_hits = set()
+                    st.session_state.expanded_hits_token = (query_clean, search_mode)
+                for hit_id, row in display_df.iloc[start:end].iterrows():
+                    r_word = str(row['word'])
+                    with st.container(border=True):
+                        if hit_id in st.session_state.expanded_hits:
+                            if st.button("▲ 收合", key=f"hit_fold_{hit_id}"):
+                                st.session_state.expanded_hits.discard(hit_id)
+                                st.rerun()
+                            show_encyclopedia_card(row, f"hit_{hit_id}")
+                        else:
+                            c_w, c_btn = st.columns([4, 1])
+                            with c_w:
+                                st.markdown(f"**{r_word}** ( {row['category']} )")
+                                st.caption(f"{fix_content(row['definition'])[:80]}...")
+                            with c_btn:
+                                if st.button("展開", key=f"hit_open_{hit_id}", use_container_width=True):
+                                    st.session_state.expanded_hits.add(hit_id)
+                                    st.rerun()
             else:
                 st.warning(f"❌ 找不到與「{search_query}」匹配的內容。")
                 if search_mode == "精確匹配":
-                    fuzzy_mask = df['word'].str.contains(query_clean, case=False)
-                    suggestions = df[fuzzy_mask]['word'].tolist()
-                    if suggestions: st.caption(f"你是不是在找：{', '.join(suggestions[:5])}？")
+                    # 拼字容錯：trigram 索引挑候選 + 編輯距離排序 (每份快照只建一次索引)
+                    fuzzy_idx = get_fuzzy_index("sheet1_full", df, fields=("word", "roots"))
+                    suggestions = list(dict.fromkeys(str(df.iloc[pos]['word']) for pos, _, _ in fuzzy_idx.suggest(query_clean, k=5)))
+                    if suggestions: st.caption(f"你是不是在找：{', '.join(suggestions)}？")
         else:
             st.caption("請在上方輸入框輸入單字。")
             st.dataframe(df[['word', 'definition', 'category']], use_container_width=True, hide_index=True)
@@ -712,14 +914,14 @@ def page_etymon_quiz(df):
     st.title("🧠 字根記憶挑戰")
     if df.empty: return
     
-    cat = st.selectbox("選擇測驗範圍", df['category'].unique())
-    pool = df[df['category'] == cat]
+    facets = get_facet_index("sheet1_full", df)
+    cat = st.selectbox("選擇測驗範圍", facets.domains)
     
     if 'q' not in st.session_state: st.session_state.q = None
     if 'show_ans' not in st.session_state: st.session_state.show_ans = False
 
-    if st.button("🎲 抽一題", use_container_width=True):
-        st.session_state.q = pool.sample(1).iloc[0].to_dict()
+    if st.button("🎲 抽一題", use_container_width=True) and facets.count(cat):
+        st.session_state.q = sample_cards(df, 1, cat).iloc[0].to_dict()
         st.session_state.show_ans = False
         st.rerun()
 
@@ -763,18 +965,25 @@ def handout_ai_generate(image, manual_input, instruction):
     if instruction: parts.append(f"【要求】：{instruction}")
     if image: parts.append(image)
 
+    hold = reserve_ai_credits("handout")
+    if hold is None:
+        return "❌ AI 點數不足，無法生成講義。"
+
     last_error = None
     for key in keys:
         try:
             genai.configure(api_key=key)
             model = genai.GenerativeModel('gemini-2.0-flash')
             response = model.generate_content(parts)
-            return response.text
+            text = response.text
+            settle_ai_credits("handout", hold, True)
+            return text
         except Exception as e:
             last_error = e
             print(f"⚠️ Handout Key failed: {e}")
             continue
     
+    settle_ai_credits("handout", hold, False)
     return f"AI 異常 (所有 Key 皆失敗): {str(last_error)}"
 def generate_printable_html(title, text_content, img_b64, img_width_percent, auto_download=False):
     text_content = text_content.strip()
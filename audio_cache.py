@@ -0,0 +1,179 @@
+import base64
+import hashlib
+import os
+import re
+import threading
+from io import BytesIO
+
+# ==========================================
+# TTS 音訊磁碟快取 (所有 App 共用)
+# ==========================================
+# app.py 的 generate_audio_base64 沒有快取，self_use.py 的 st.cache_data 只活在單一行程內，
+# app4/app5 的 speak 更是每次重跑都重新呼叫 gTTS。
+# 這裡把 MP3 以「正規化文字 + 語言」的雜湊為檔名存到磁碟：
+#   - 重啟後依然有效，多個 App 共用同一份檔案
+#   - 總容量超過上限時，依最後存取時間 (mtime) 淘汰
+#   - 合成器可替換 (測試時用 tests/stubs.py 的 StubSynthesizer，不需連網)
+#   - URL 模式：檔案放在 App 旁的 static/ 目錄，由 Streamlit 靜態服務提供，
+#     speak() 只嵌入 /app/static/tts/<hash>.mp3 網址，瀏覽器按下播放才下載，重跑時沿用 HTTP 快取
+
+# Streamlit 只服務「主程式同層」的 static/ 目錄，因此以本模組位置為基準，而不是工作目錄
+DEFAULT_AUDIO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "tts")
+STATIC_AUDIO_URL = "app/static/tts"
+
+
+def normalize_tts_text(text):
+    """只保留英文、數字、基本標點，避免 TTS 唸出亂碼 (與舊版 speak 的清洗規則相同)"""
+    if not text:
+        return ""
+    clean_text = re.sub(r"[^a-zA-Z0-9\s\-\']", " ", str(text))
+    return " ".join(clean_text.split()).strip()
+
+
+def audio_key(text, lang="en"):
+    """快取鍵：正規化文字 (不分大小寫) + 語言"""
+    return hashlib.sha256(f"{lang}|{normalize_tts_text(text).lower()}".encode("utf-8")).hexdigest()
+
+
+class GTTSSynthesizer:
+    """預設合成器：呼叫 Google gTTS 取得 MP3 位元組"""
+
+    def __call__(self, text, lang="en"):
+        from gtts import gTTS
+
+        fp = BytesIO()
+        gTTS(text=text, lang=lang).write_to_fp(fp)
+        return fp.getvalue()
+
+
+class AudioStore:
+    """
+    以檔案系統保存的 MP3 快取：
+    - get_bytes() 命中時直接讀檔，未命中才呼叫合成器並原子寫入。
+    - max_bytes 為目錄總容量上限，超過時從最久未讀取的檔案開始刪。
+    """
+
+    def __init__(self, directory=DEFAULT_AUDIO_DIR, max_bytes=200 * 1024 * 1024, synthesizer=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.synthesizer = synthesizer or GTTSSynthesizer()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total = sum(e.stat().st_size for e in os.scandir(directory) if e.name.endswith(".mp3"))
+
+    def path_for(self, text, lang="en"):
+        return os.path.join(self.directory, f"{audio_key(text, lang)}.mp3")
+
+    def contains(self, text, lang="en"):
+        return os.path.exists(self.path_for(text, lang))
+
+    def ensure(self, text, lang="en"):
+        """確保音檔存在並回傳路徑；文字無效或合成失敗時回傳 None (失敗會拋出例外)"""
+        clean_text = normalize_tts_text(text)
+        if not clean_text:
+            return None
+        path = self.path_for(clean_text, lang)
+        if os.path.exists(path):
+            try:
+                os.utime(path)  # 更新存取時間，供 LRU 淘汰使用
+            except OSError:
+                pass
+            return path
+
+        data = self.synthesizer(clean_text, lang)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+        return path
+
+    def get_bytes(self, text, lang="en"):
+        """取得 MP3 位元組；失敗時回傳 None 並在 Console 印出原因"""
+        try:
+            path = self.ensure(text, lang)
+        except Exception as e:
+            print(f"TTS 生成失敗 ({text}): {e}")
+            return None
+        if not path:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def get_base64(self, text, lang="en"):
+        data = self.get_bytes(text, lang)
+        return base64.b64encode(data).decode() if data else None
+
+    def audio_src(self, text, lang="en", base_url=None):
+        """
+        給 <audio> 使用的 src：
+        - base_url 有值 (靜態服務已開啟) → 回傳 {base_url}/{hash}.mp3，檔名即內容鍵，可被瀏覽器長期快取
+        - 否則退回 data:audio/mp3;base64 內嵌
+        """
+        if base_url is None:
+            b64 = self.get_base64(text, lang)
+            return f"data:audio/mp3;base64,{b64}" if b64 else None
+        try:
+            path = self.ensure(text, lang)
+        except Exception as e:
+            print(f"TTS 生成失敗 ({text}): {e}")
+            return None
+        return f"{base_url}/{os.path.basename(path)}" if path else None
+
+    def _evict(self):
+        entries = [e for e in os.scandir(self.directory) if e.name.endswith(".mp3")]
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+        # 清到上限的 90%，避免每寫一檔就觸發一次淘汰
+        target = self.max_bytes * 0.9
+        for e in entries:
+            if total <= target:
+                break
+            try:
+                size = e.stat().st_size
+                os.remove(e.path)
+                total -= size
+            except OSError:
+                pass
+        self._total = total
+
+
+def static_audio_base_url():
+    """
+    若 .streamlit/config.toml 開啟了 server.enableStaticServing，回傳音檔的絕對 URL 前綴
+    (含 server.baseUrlPath)；否則回傳 None，呼叫端會改用 base64 內嵌。
+    """
+    try:
+        import streamlit as st
+
+        if not st.get_option("server.enableStaticServing"):
+            return None
+        prefix = (st.get_option("server.baseUrlPath") or "").strip("/")
+    except Exception:
+        return None
+    return "/" + "/".join(p for p in (prefix, STATIC_AUDIO_URL) if p)
+
+
+def get_audio_src(text, lang="en"):
+    """App 端的 speak() 使用：自動選擇 URL 模式或 base64 內嵌模式"""
+    if not text:
+        return None
+    return get_audio_store().audio_src(text, lang, base_url=static_audio_base_url())
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_audio_store(directory=DEFAULT_AUDIO_DIR, synthesizer=None):
+    """取得行程內共用的音訊快取；傳入 synthesizer 可替換合成器 (例如測試用 Stub)"""
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None or _STORE.directory != directory:
+            _STORE = AudioStore(directory, synthesizer=synthesizer)
+        elif synthesizer is not None:
+            _STORE.synthesizer = synthesizer
+        return _STORE
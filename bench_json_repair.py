@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+from json_repair import loads
+
+# ==========================================
+# JSON 修復引擎的損壞語料與效能測試 (命令列)
+# ==========================================
+# 以 master_db.json 的紀錄模擬 AI 常見的壞輸出 (單反斜線 LaTeX、原始換行、未轉義引號、
+# ```json 標籤、開場白、多餘逗號、截斷)，量測 json_repair.loads 的吞吐量：
+#   python bench_json_repair.py [--db master_db.json] [--seed 0] [--rounds 3]
+# 同一份語料的正確性驗證在 tests/test_json_repair.py，由 pytest 執行。
+
+LATEX_SAMPLES = [r"\frac{a}{b}", r"\beta", r"\theta", r"\nabla f", r"\left( x \right)", r"\sum_{i=1}^{n}",
+                 r"\alpha + \times", r"\text{ATP}", r"\sqrt{2}", r"e^{i\pi}"]
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "master_db.json")
+
+
+def load_corpus(path=DEFAULT_DB):
+    """從 master_db.json 取出所有紀錄 (支援 [{word: record}] 與 {word: record} 兩種格式)"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    blocks = data if isinstance(data, list) else [data]
+    return [rec for block in blocks for rec in block.values() if isinstance(rec, dict)]
+
+
+def corrupt_record(record, rng):
+    """
+    模擬 AI 常見的壞輸出，回傳 (損壞後的文字, 修復後應得到的紀錄, 是否截斷)：
+    單反斜線 LaTeX、字串內原始換行、未轉義引號、```json 標籤、開場白、多餘逗號、截斷。
+    """
+    expected = dict(record)
+    keys = [k for k, v in expected.items() if isinstance(v, str)]
+    latex_key = rng.choice(keys) if keys else None
+    if latex_key:
+        expected[latex_key] = expected[latex_key] + " " + rng.choice(LATEX_SAMPLES)
+    quote_key = rng.choice(keys) if keys else None
+    if quote_key and quote_key != latex_key:
+        expected[quote_key] = f'他說"{expected[quote_key][:10]}"是關鍵'
+
+    text = json.dumps(expected, ensure_ascii=False, indent=2)
+    # 字串內的換行改成原始換行 (不動 LaTeX 的 \\nabla)
+    text = re.sub(r'(?<!\\)\\n', "\n", text)
+    # 單反斜線 LaTeX：把 json.dumps 產生的 \\ 還原成 \ (模型最常見的錯誤)
+    text = text.replace("\\\\", "\\")
+    # 未轉義的引號
+    text = text.replace('\\"', '"')
+    if rng.random() < 0.3:
+        text = text.replace('",\n', '",,\n', 1)
+    if rng.random() < 0.5:
+        text = "```json\n" + text + "\n```"
+    if rng.random() < 0.3:
+        text = "好的，以下是解碼結果：\n" + text
+    truncated = rng.random() < 0.2
+    if truncated:
+        text = text[: int(len(text) * rng.uniform(0.3, 0.95))]
+    return text, expected, truncated
+
+
+def build_corpus(records, seed=0):
+    rng = random.Random(seed)
+    return [corrupt_record(rec, rng) for rec in records]
+
+
+def run_bench(corpus, rounds=3):
+    """修復引擎的吞吐量；並以 json.loads 解析同一批紀錄的合法版本作為基準"""
+    texts = [text for text, _, _ in corpus]
+    clean = [json.dumps(expected, ensure_ascii=False, indent=2) for _, expected, _ in corpus]
+    size = sum(len(t) for t in texts)
+
+    def best_of(fn, items):
+        best = float("inf")
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for item in items:
+                fn(item)
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    repair_time = best_of(loads, texts)
+    baseline = best_of(json.loads, clean)
+    print(f"json_repair: {len(texts)} 筆 / {size / 1e6:.2f} MB，{repair_time * 1000:.1f} ms ({size / repair_time / 1e6:.1f} MB/s)")
+    print(f"json.loads (合法 JSON 基準): {baseline * 1000:.1f} ms，修復引擎約為 {repair_time / baseline:.1f} 倍")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON 修復引擎效能測試 (以 master_db.json 建立損壞語料)")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args(argv)
+    run_bench(build_corpus(load_corpus(args.db), seed=args.seed), rounds=args.rounds)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from user_store import VersionConflict
+
+# ==========================================
+# AI 點數帳本 (預扣 / 確認 / 批次寫回)
+# ==========================================
+# app4 的 user_balance 只存在 session_state：登入時從 users.ai_usage 讀入，之後沒有寫回的路徑；
+# 若每次 AI 呼叫都直接改試算表，Gemini 請求前後又會多出一次 Sheets 往返。
+# 這裡改成：
+#   - reserve()：在記憶體檢查餘額並預扣，餘額不足回傳 None (不呼叫 AI)
+#   - commit()：AI 成功後把預扣轉成一筆扣款，寫入本地 SQLite 帳本 (以預扣編號作為冪等鍵)
+#   - release()：AI 失敗時退回預扣，不產生扣款
+#   - 背景執行緒定期把未送出的扣款依用戶彙總成一個批次，交給 sink(batch_id, {username: delta})
+#     同一批次重試時沿用同一個 batch_id，sink 以此判斷某用戶是否已套用過 (冪等)
+
+DEFAULT_LEDGER_DIR = ".cache"
+
+
+class CreditLedger:
+    """
+    行程內共用的點數帳本：
+    - load(username, balance)：以資料庫中的餘額作為基準 (登入時呼叫)。
+    - balance(username)：基準 + 尚未寫回的扣款 - 進行中的預扣。
+    - sink(batch_id, deltas)：把 {username: delta} 套用到永久儲存，失敗時拋出例外 (整批稍後重試)。
+    """
+
+    def __init__(self, sink, path, interval=15.0, base_backoff=5.0, max_backoff=600.0):
+        self.sink = sink
+        self.path = path
+        self.interval = interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.last_error = ""
+        self._base = {}
+        self._unsent = {}
+        self._holds = {}
+        self._attempts = 0
+        self._next_attempt_at = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, username TEXT NOT NULL, delta INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, batch_id TEXT, sent_at REAL)"
+            )
+            rows = db.execute("SELECT username, SUM(delta) FROM entries WHERE sent_at IS NULL GROUP BY username").fetchall()
+        # 上次沒送出的扣款：重啟後仍計入餘額並繼續送出
+        self._unsent = {username: total for username, total in rows}
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    # --- 餘額 ---
+    def load(self, username, balance):
+        with self._lock:
+            try:
+                self._base[username] = int(float(balance))
+            except (TypeError, ValueError):
+                self._base[username] = 0
+
+    def balance(self, username):
+        with self._lock:
+            return self._balance(username)
+
+    def _balance(self, username):
+        held = sum(amount for user, amount in self._holds.values() if user == username)
+        return self._base.get(username, 0) + self._unsent.get(username, 0) - held
+
+    # --- 預扣 / 確認 ---
+    def reserve(self, username, amount):
+        """預扣 amount 點；餘額不足回傳 None，否則回傳預扣編號"""
+        with self._lock:
+            if self._balance(username) < amount:
+                return None
+            hold_id = uuid.uuid4().hex
+            self._holds[hold_id] = (username, amount)
+            return hold_id
+
+    def release(self, hold_id):
+        with self._lock:
+            self._holds.pop(hold_id, None)
+
+    def commit(self, hold_id, amount=None):
+        """把預扣轉成扣款 (amount 可改為實際用量)；同一編號重複 commit 只記一次"""
+        with self._lock:
+            hold = self._holds.pop(hold_id, None)
+            if hold is None:
+                return False
+            username, held = hold
+            delta = -(held if amount is None else amount)
+            with self._connect() as db:
+                cur = db.execute(
+                    "INSERT OR IGNORE INTO entries (key, username, delta, created_at) VALUES (?, ?, ?, ?)",
+                    (hold_id, username, delta, time.time()),
+                )
+            if cur.rowcount:
+                self._unsent[username] = self._unsent.get(username, 0) + delta
+        self.start()
+        return True
+
+    def pending(self):
+        with self._lock:
+            return {user: delta for user, delta in self._unsent.items() if delta}
+
+    # --- 寫回 ---
+    def flush(self, force=False):
+        """送出一個批次；回傳套用的用戶數 (沒有待送或仍在退避中回傳 0)"""
+        with self._flush_lock:
+            now = time.time()
+            if not force and now < self._next_attempt_at:
+                return 0
+            with self._lock, self._connect() as db:
+                # 先完成上次失敗的批次 (沿用原本的 batch_id)，再把新的扣款編成新批次
+                row = db.execute("SELECT batch_id FROM entries WHERE sent_at IS NULL AND batch_id IS NOT NULL LIMIT 1").fetchone()
+                batch_id = row[0] if row else uuid.uuid4().hex
+                if not row:
+                    db.execute("UPDATE entries SET batch_id = ? WHERE sent_at IS NULL", (batch_id,))
+                rows = db.execute(
+                    "SELECT username, SUM(delta) FROM entries WHERE batch_id = ? AND sent_at IS NULL GROUP BY username",
+                    (batch_id,),
+                ).fetchall()
+            deltas = {username: total for username, total in rows if total}
+            if not rows:
+                return 0
+
+            try:
+                if deltas:
+                    self.sink(batch_id, deltas)
+            except Exception as e:
+                self.last_error = str(e)
+                self._next_attempt_at = now + min(self.base_backoff * (2 ** self._attempts), self.max_backoff)
+                self._attempts += 1
+                print(f"⚠️ Credit flush failed ({len(deltas)} users): {e}")
+                return 0
+
+            with self._lock, self._connect() as db:
+                db.execute("UPDATE entries SET sent_at = ? WHERE batch_id = ?", (now, batch_id))
+                for username, delta in deltas.items():
+                    # 已寫入資料庫的扣款併入基準
+                    self._unsent[username] = self._unsent.get(username, 0) - delta
+                    if username in self._base:
+                        self._base[username] += delta
+            self._attempts = 0
+            self._next_attempt_at = 0.0
+            self.last_error = ""
+            return len(deltas)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            while self.flush():
+                pass
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="credit-ledger", daemon=True)
+                self._thread.start()
+
+
+class UserStoreCreditSink:
+    """
+    把批次扣款寫回用戶庫 (user_store)：ai_usage 加上 delta，credit_batch 記錄最後套用的批次。
+    重試同一批次時，credit_batch 已等於 batch_id 的用戶直接略過，避免重複扣款。
+    repo_factory 在第一次送出時才建立連線。
+    """
+
+    def __init__(self, repo_factory, retries=3):
+        self.repo_factory = repo_factory
+        self.retries = retries
+        self._repo = None
+
+    @property
+    def repo(self):
+        if self._repo is None:
+            self._repo = self.repo_factory()
+        return self._repo
+
+    def __call__(self, batch_id, deltas):
+        for username, delta in deltas.items():
+            for attempt in range(self.retries):
+                record = self.repo.get(username)
+                if record is None or record.get("credit_batch") == batch_id:
+                    break
+                try:
+                    current = int(float(record.get("ai_usage") or 0))
+                except (TypeError, ValueError):
+                    current = 0
+                try:
+                    self.repo.update(
+                        username,
+                        {"ai_usage": current + delta, "credit_batch": batch_id},
+                        expected_version=record["version"],
+                    )
+                    break
+                except VersionConflict:
+                    # 同時有登入 / 其他行程改了這一列：重新讀取後再套用
+                    if attempt == self.retries - 1:
+                        raise
+
+
+_LEDGERS = {}
+_LEDGERS_LOCK = threading.Lock()
+
+
+def get_credit_ledger(name, sink, ledger_dir=DEFAULT_LEDGER_DIR, **kwargs):
+    """取得行程內共用的點數帳本；帳本裡還有上次沒送出的扣款時立即啟動背景送出"""
+    with _LEDGERS_LOCK:
+        ledger = _LEDGERS.get(name)
+        if ledger is None:
+            path = os.path.join(ledger_dir, f"credits_{name}.sqlite3")
+            ledger = _LEDGERS[name] = CreditLedger(sink, path, **kwargs)
+            if ledger.pending():
+                ledger.start()
+        return ledger
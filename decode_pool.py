@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# ==========================================
+# 批量解碼並行引擎 (Bounded Worker Pool)
+# ==========================================
+# 舊版實驗室逐一呼叫 ai_decode_and_save 再 time.sleep，
+# 就算 GEMINI_FREE_KEYS 有多把 Key 閒置，也只能一把一把慢慢跑。
+# 這裡用執行緒池把主題分散到所有 Key 上：
+#   - 每把 Key 同一時間只服務一個請求，並遵守各自的最小請求間隔
+#   - 失敗的主題自動換一把 Key 重試
+#   - 進度回呼在呼叫端 (Streamlit 主執行緒) 觸發，可直接更新 st.progress
+#   - 結果依輸入順序回傳
+#   - 傳入 KeyScheduler 時，依健康度挑 Key 並避開冷卻中的 Key
+
+
+class RateLimiter:
+    """單一 Key 的最小請求間隔 (執行緒安全)"""
+
+    def __init__(self, min_interval=1.0):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_for = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.min_interval
+        if wait_for > 0:
+            time.sleep(wait_for)
+
+
+class DecodePool:
+    """
+    有界並行解碼池：
+    - decode_fn(topic, key) 回傳結果字串，失敗回傳 None 或拋出例外 (離線測試用的假模型見 tests/stubs.py)。
+    - max_workers 預設等於 Key 數量 (每把 Key 最多一個進行中的請求)。
+    - min_interval 為每把 Key 兩次請求之間的最小間隔 (秒)。
+    - max_attempts 為單一主題最多嘗試幾把 Key。
+    - scheduler 為 KeyScheduler (可選)：decode_fn 內部自行回報 Key 健康度，
+      池只負責依健康度挑 Key，以及回報 decode_fn 拋出的例外。
+    """
+
+    def __init__(self, keys, decode_fn, max_workers=None, min_interval=1.0, max_attempts=None, scheduler=None):
+        self.keys = list(dict.fromkeys(keys))
+        if not self.keys:
+            raise ValueError("DecodePool 需要至少一把 API Key")
+        self.decode_fn = decode_fn
+        self.scheduler = scheduler
+        self.max_workers = max(1, min(max_workers or len(self.keys), len(self.keys)))
+        self.max_attempts = max_attempts or len(self.keys)
+        self.limiters = {k: RateLimiter(min_interval) for k in self.keys}
+        self._idle = list(self.keys)
+        self._cond = threading.Condition()
+
+    def _take_key(self, tried):
+        """
+        取一把閒置 Key：優先選此主題尚未嘗試過、且不在冷卻中的；
+        若這樣的 Key 都在忙，就等它們空下來，而不是重複使用失敗過的 Key。
+        """
+        with self._cond:
+            while True:
+                fresh = [k for k in self._idle if k not in tried]
+                if fresh and self.scheduler:
+                    ready = [k for k in fresh if not self.scheduler.is_cooling(k)]
+                    busy_ready = [
+                        k for k in self.keys
+                        if k not in tried and k not in self._idle and not self.scheduler.is_cooling(k)
+                    ]
+                    if ready or not busy_ready:
+                        key = self.scheduler.best(ready or fresh) or (ready or fresh)[0]
+                        break
+                elif fresh:
+                    key = fresh[0]
+                    break
+                elif self._idle and len(tried) >= len(self.keys):
+                    key = self._idle[0]
+                    break
+                # 冷卻可能隨時間結束，定期醒來重新評估
+                self._cond.wait(timeout=1.0)
+            self._idle.remove(key)
+            return key
+
+    def _release_key(self, key):
+        with self._cond:
+            self._idle.append(key)
+            self._cond.notify_all()
+
+    def _decode_one(self, topic):
+        tried = set()
+        for _ in range(self.max_attempts):
+            key = self._take_key(tried)
+            tried.add(key)
+            try:
+                self.limiters[key].wait()
+                result = self.decode_fn(topic, key)
+            except Exception as e:
+                print(f"⚠️ 解碼 `{topic}` 失敗 (Key ...{key[-4:]}): {e}")
+                if self.scheduler:
+                    self.scheduler.report_failure(key, e)
+                result = None
+            finally:
+                self._release_key(key)
+            if result:
+                return result
+        return None
+
+    def run(self, topics, on_progress=None):
+        """
+        並行解碼 topics，回傳與輸入同順序的結果列表 (失敗為 None)。
+        on_progress(done, total, topic, result) 在呼叫端執行緒觸發。
+        """
+        topics = list(topics)
+        results = [None] * len(topics)
+        if not topics:
+            return results
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._decode_one, t): i for i, t in enumerate(topics)}
+            for done, fut in enumerate(as_completed(futures), start=1):
+                i = futures[fut]
+                results[i] = fut.result()
+                if on_progress:
+                    on_progress(done, len(topics), topics[i], results[i])
+        return results
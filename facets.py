@@ -0,0 +1,147 @@
+import hashlib
+import re
+import threading
+
+# ==========================================
+# 領域分面索引 (Category Facets)
+# ==========================================
+# 舊版首頁每次 rerun 都做 df['category'].nunique() / df['roots'].nunique()，
+# 學習頁再兩次 sorted(df['category'].unique()) 加上 df[df['category'] == sel] 全表比對。
+# app.py 的分類又是「物理科學 + 人工智慧」這種組合字串，選單裡每種組合各佔一項，
+# 單選「物理科學」找不到跨界主題。
+# 這裡每份快照只建一次分面索引：
+#   - 組合分類拆成各個領域，每個領域保存命中的列位置 (可直接 df.iloc)
+#   - 領域筆數、獨特值數量 (roots 等) 都是預先算好的常數
+#   - 多個領域取交集時由最小的集合開始比對
+
+_SPLIT_RE = re.compile(r"\s*[+＋]\s*")
+_EMPTY = {"", "無", "nan", "none"}
+
+
+def split_domains(category):
+    """「物理科學 + 人工智慧」→ ['物理科學', '人工智慧']；空值 / 「無」回傳空串列"""
+    domains = []
+    for part in _SPLIT_RE.split(str(category).strip()):
+        if part.lower() not in _EMPTY and part not in domains:
+            domains.append(part)
+    return domains
+
+
+class FacetIndex:
+    """
+    field：分類欄位；distinct：要預先計算獨特值數量的欄位 (例如 roots)；key：主鍵欄位 (只用於內容指紋)。
+    rows() / intersect() 回傳依原本列順序排列的列位置。
+    """
+
+    def __init__(self, field="category", distinct=("roots",), key="word"):
+        self.field = field
+        self.key = key
+        self.distinct_fields = tuple(distinct)
+        self.total = 0
+        self.domains = []        # 依名稱排序的領域
+        self.categories = []     # 依名稱排序的原始分類字串 (含組合)
+        self._rows = {}          # 領域 → [列位置]
+        self._sets = {}          # 領域 → frozenset (交集 / 篩選用，延遲建立)
+        self._distinct = {}
+        self._source = None      # 上次同步的 DataFrame (保留參考，用 is 判斷快照是否換過)
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _signature_of(self, df):
+        """
+        內容指紋：st.cache_data 每次回傳複本時，用來判斷資料其實沒變。
+        逐列雜湊依列順序串起來再做摘要，列被重新排序 (強制刷新移到表尾、手動排序) 時指紋也會改變，
+        否則沿用舊的列位置會指到別的分類。
+        主鍵欄位也納入指紋：分類相同的兩列互換位置時，抽樣器 (sampler.py) 的紀錄同樣需要重設。
+        """
+        import pandas as pd
+
+        cols = [c for c in dict.fromkeys((self.key, self.field) + self.distinct_fields) if c and c in df.columns]
+        if not cols or df.empty:
+            return (len(df), "")
+        row_hashes = pd.util.hash_pandas_object(df[cols].astype(str), index=False).to_numpy()
+        return (len(df), hashlib.blake2b(row_hashes.tobytes(), digest_size=16).hexdigest())
+
+    def sync(self, df):
+        """df 與上次相同 (同一物件或內容指紋相同) 時直接略過，否則重建"""
+        if df is None or df is self._source:
+            return
+        signature = self._signature_of(df)
+        with self._lock:
+            if signature == self._signature:
+                self._source = df
+                return
+            rows, categories = {}, set()
+            values = df[self.field].tolist() if self.field in df.columns else []
+            for pos, category in enumerate(values):
+                categories.add(str(category).strip())
+                for domain in split_domains(category):
+                    rows.setdefault(domain, []).append(pos)
+            self._rows = rows
+            self._sets = {}
+            self.domains = sorted(rows)
+            self.categories = sorted(c for c in categories if c.lower() not in _EMPTY)
+            self._distinct = {f: int(df[f].nunique()) for f in self.distinct_fields if f in df.columns}
+            self._distinct[self.field] = len(self.categories)
+            self.total = len(df)
+            self._signature = signature
+            self._source = df
+
+    @property
+    def signature(self):
+        """目前索引對應的資料指紋 (列位置只在同一指紋下有效)"""
+        return self._signature
+
+    # --- 查詢 ---
+    def count(self, domain):
+        return len(self._rows.get(domain, ()))
+
+    def nunique(self, field):
+        """預先算好的獨特值數量 (field 為分類欄位時是原始分類字串的種類數)"""
+        return self._distinct.get(field, 0)
+
+    def rows(self, domain):
+        return self._rows.get(domain, [])
+
+    def _set(self, domain):
+        s = self._sets.get(domain)
+        if s is None:
+            s = self._sets[domain] = frozenset(self._rows.get(domain, ()))
+        return s
+
+    def intersect(self, domains):
+        """同時屬於所有領域的列位置；domains 為空時回傳全部列"""
+        domains = list(dict.fromkeys(domains))
+        if not domains:
+            return list(range(self.total))
+        ordered = sorted(domains, key=self.count)
+        base = self._rows.get(ordered[0], [])
+        others = [self._set(d) for d in ordered[1:]]
+        return [pos for pos in base if all(pos in s for s in others)]
+
+    def filter(self, positions, domains):
+        """保留 positions 中同時屬於所有領域的列 (維持 positions 原本的順序，例如搜尋排名)"""
+        domains = list(dict.fromkeys(domains))
+        if not domains:
+            return list(positions)
+        sets = [self._set(d) for d in sorted(domains, key=self.count)]
+        return [pos for pos in positions if all(pos in s for s in sets)]
+
+    def options(self):
+        """(領域, 筆數)，依領域名稱排序，給選單使用"""
+        return [(d, len(self._rows[d])) for d in self.domains]
+
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_facet_index(name, df=None, **kwargs):
+    """取得行程內共用的分面索引；傳入 df 時同步 (同一份快照只建一次)"""
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(name)
+        if index is None:
+            index = _INDEXES[name] = FacetIndex(**kwargs)
+    if df is not None:
+        index.sync(df)
+    return index
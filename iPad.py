@@ -5,6 +5,7 @@ import gspread
 import pandas as pd
 from datetime import datetime
 from PIL import Image
+from key_scheduler import get_scheduler
 
 st.set_page_config(
     page_title="智慧講義館藏系統",
@@ -88,8 +89,6 @@ if 'ai_generated_content' not in st.session_state:
     st.session_state.ai_generated_content = ""
 if 'current_image' not in st.session_state:
     st.session_state.current_image = None
-if 'api_key_index' not in st.session_state:
-    st.session_state.api_key_index = 0
 
 def process_image_with_gemini(image_file):
     img = Image.open(image_file)
@@ -104,24 +103,28 @@ def process_image_with_gemini(image_file):
     ## 💡 關鍵字與名詞解釋
     (萃取講義中的專有名詞，並以「**關鍵字**：解釋」的方式列出)
     """
-    total_keys = len(GEMINI_FREE_KEYS)
-    start_index = st.session_state.api_key_index
-    
-    for offset in range(total_keys):
-        current_index = (start_index + offset) % total_keys
-        current_key = GEMINI_FREE_KEYS[current_index]
-        try:
-            genai.configure(api_key=current_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            response = model.generate_content([prompt, img])
-            if current_index != start_index:
-                st.toast(f"✅ 成功切換至金鑰 {current_index + 1}", icon="🔑")
-            st.session_state.api_key_index = current_index
-            return response.text
-        except Exception as e:
-            st.toast(f"⚠️ 金鑰 {current_index + 1} 達到限制，嘗試下一把...", icon="🔄")
-            if offset == total_keys - 1:
-                raise Exception(f"所有 API 金鑰皆已達到限制。最後錯誤：{str(e)}")
+    # 依健康度挑 Key (取代舊的 api_key_index：冷卻中/額度用盡的 Key 會排到最後)
+    scheduler = get_scheduler(GEMINI_FREE_KEYS)
+    candidates = scheduler.candidates()
+    if not candidates:
+        raise Exception("未設定任何 API 金鑰。")
+    preferred = candidates[0]
+
+    def recognize(key):
+        response = scheduler.model(key, 'gemini-1.5-flash').generate_content([prompt, img])
+        return key, response.text
+
+    def on_error(key, e):
+        st.toast(f"⚠️ 金鑰 {GEMINI_FREE_KEYS.index(key) + 1} 達到限制，嘗試下一把...", icon="🔄")
+
+    # call() 依健康度輪詢並回報成功 / 失敗；全部失敗時回傳最後一個例外
+    result, last_error = scheduler.call(recognize, candidates, on_error=on_error)
+    if result is None:
+        raise Exception(f"所有 API 金鑰皆已達到限制。最後錯誤：{str(last_error)}")
+    used_key, text = result
+    if used_key != preferred:
+        st.toast(f"✅ 成功切換至金鑰 {GEMINI_FREE_KEYS.index(used_key) + 1}", icon="🔑")
+    return text
 
 def save_to_collection(title, content):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
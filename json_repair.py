@@ -0,0 +1,285 @@
+import argparse
+import json
+import re
+import sys
+
+# ==========================================
+# JSON 修復引擎 (單次線性掃描)
+# ==========================================
+# 過去有三套各自為政的修復方式：
+#   - merge.py 舊版 clean_json_string：全域把 \ 換成 \\ 再補括號 (會把合法的 \" \n 以外的逸出全部弄壞)
+#   - app.py ai_decode_and_save：json.loads 失敗後 replace('\n', '\\n') 再試一次
+#   - app4 page_etymon_lab：re.search(r'\{.*\}') 擷取後 json.loads，失敗再換行取代重來
+# 每種都可能把同一段文字重新解析好幾次，而且都會破壞 LaTeX (例如 "\frac" 裡的 \f 被當成換頁字元)。
+#
+# 這裡用一個 tokenizer 一次掃描完成修復：
+#   - 開頭的閒聊 / ```json 標籤、結尾多餘的文字：略過
+#   - 無效逸出 (\alpha、\sum、\{ …)：補成 \\ 保留原字元
+#   - LaTeX 指令撞上合法逸出 (\frac、\beta、\theta、\nabla、\right …)：同樣補成 \\，不被解成控制字元
+#   - 字串內未轉義的雙引號：依後面接的字元判斷是不是字串結尾，不是就補上 \"
+#   - 字串內的原始換行 / Tab 等控制字元：轉成 \n \t \uXXXX
+#   - 多餘逗號、缺少的逗號、Python 的 None/True/False
+#   - 截斷 (max_output_tokens 用完)：補上未結束的字串、缺少的值與所有括號
+#
+# json_stream.py 的串流解析器也使用這裡的字串規則，所以解碼器與 merge.py 的結果一致。
+#
+# 用法：
+#   python json_repair.py broken.json   修復檔案並輸出到 stdout
+# 語料驗證在 tests/test_json_repair.py (pytest)，效能測試為 python bench_json_repair.py。
+
+# \n \r \t 之後若接這些字母 (整個字母串相符) 視為 LaTeX 指令；\b \f 在講義內容中沒有合法用途，一律視為 LaTeX
+LATEX_NRT = {
+    "nabla", "ne", "neq", "neg", "newline", "ni", "nleq", "ngeq", "nmid", "nolimits", "not", "notin", "nu",
+    "rangle", "rbrace", "rceil", "rfloor", "rho", "right", "rightarrow", "rightleftharpoons", "rm", "rvert",
+    "tag", "tan", "tanh", "tau", "text", "textbf", "textit", "textrm", "textstyle", "tfrac", "therefore",
+    "theta", "tilde", "times", "to", "top", "triangle", "triangleq", "tt",
+}
+
+_STR_SPECIAL = re.compile(r'["\\\x00-\x1f]')
+_LETTERS = re.compile(r"[A-Za-z]+")
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+_SCALAR = re.compile(r'[^\s,:\[\]{}"]+')
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?$")
+_CONTROL = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_NEXT_KEY = re.compile(r'"[^"\\\n]{1,64}"\s*:')
+_WS = " \t\r\n"
+
+
+class RepairError(ValueError):
+    """輸入中找不到任何 JSON 物件或陣列"""
+
+
+def _escape(text, i, out):
+    """
+    處理 text[i] 的反斜線，把修正後的逸出寫入 out，回傳下一個位置。
+    合法逸出原樣保留；無效逸出與 LaTeX 指令補成雙反斜線。
+    """
+    n = len(text)
+    if i + 1 >= n:
+        return n  # 截斷在反斜線上：丟掉
+    c = text[i + 1]
+    if c in '"\\/':
+        out.append(text[i:i + 2])
+        return i + 2
+    if c == "u":
+        if _HEX4.match(text, i + 2):
+            out.append(text[i:i + 6])
+            return i + 6
+        out.append("\\\\")
+        return i + 1
+    if c in "bfnrt":
+        word = _LETTERS.match(text, i + 1).group(0)
+        if c in "bf" and len(word) > 1 or word in LATEX_NRT:
+            out.append("\\\\")
+            return i + 1
+        out.append(text[i:i + 2])
+        return i + 2
+    out.append("\\\\")
+    return i + 1
+
+
+def closes_string(text, q, is_key, container, at_eof=True):
+    """
+    判斷 text[q] 的雙引號是否為字串結尾：看它後面第一個非空白字元。
+    - 鍵：必須接 ':'。
+    - 值：接 '}' ']' 或文字結束；接 ',' 時，逗號後面也要像下一個鍵 / 值的開頭。
+    at_eof=False (串流中途) 且後文不足以判斷時回傳 None。
+    """
+    n = len(text)
+    j = q + 1
+    while j < n and text[j] in _WS:
+        j += 1
+    if j >= n:
+        return True if at_eof else None
+    ch = text[j]
+    if is_key:
+        return ch == ":"
+    if ch in "}]":
+        return True
+    if ch == '"' and container == "{":
+        # 缺少逗號："a": "x" "b": ... 後面緊接著一個完整的鍵
+        if _NEXT_KEY.match(text, j):
+            return True
+        return None if not at_eof and n - j < 80 else False
+    if ch != ",":
+        return False
+    j += 1
+    while j < n and (text[j] in _WS or text[j] == ","):  # 重複的逗號也一併略過
+        j += 1
+    if j >= n:
+        return True if at_eof else None
+    nxt = text[j]
+    if container == "{":
+        return nxt in '"}'
+    return nxt in '"{[]-0123456789tfnTFN'
+
+
+def read_string(text, i, out, is_key=False, container=None, at_eof=True):
+    """
+    從開頭引號之後的位置 i 讀取字串，把修復後的 JSON 字串 (含引號) 寫入 out。
+    回傳 (結束位置, 狀態)：狀態為 "closed" / "truncated" / "pending" (at_eof=False 且需要更多輸入)。
+    """
+    n = len(text)
+    out.append('"')
+    while True:
+        m = _STR_SPECIAL.search(text, i)
+        if m is None:
+            out.append(text[i:])
+            if not at_eof:
+                return n, "pending"
+            out.append('"')
+            return n, "truncated"
+        j = m.start()
+        if j > i:
+            out.append(text[i:j])
+        ch = text[j]
+        if ch == "\\":
+            if j + 1 >= n and not at_eof:
+                return j, "pending"
+            i = _escape(text, j, out)
+        elif ch == '"':
+            closes = closes_string(text, j, is_key, container, at_eof)
+            if closes is None:
+                return j, "pending"
+            if closes:
+                out.append('"')
+                return j + 1, "closed"
+            out.append('\\"')
+            i = j + 1
+        else:
+            out.append(_CONTROL.get(ch) or "\\u%04x" % ord(ch))
+            i = j + 1
+
+
+def decode_string(token):
+    """把一個完整的字串 token (含前後引號) 依本模組的逸出規則解成 Python 字串"""
+    out = []
+    _, _state = read_string(token[:-1], 1, out)
+    return json.loads("".join(out))
+
+
+def _scalar(token):
+    lit = _LITERALS.get(token)
+    if lit:
+        return lit
+    if _NUMBER.match(token):
+        return token
+    return None
+
+
+def repair_json(text):
+    """回傳修復後、可被 json.loads 解析的 JSON 文字 (只保留第一個頂層物件 / 陣列)"""
+    starts = [p for p in (text.find("{"), text.find("[")) if p != -1]
+    if not starts:
+        raise RepairError("找不到 JSON 物件或陣列")
+    i = min(starts)
+    n = len(text)
+    out = []
+    stack = []  # 每層 [容器種類, 狀態]；狀態：key / colon / value / comma
+
+    while i < n:
+        ch = text[i]
+        if ch in _WS:
+            i += 1
+            continue
+        top = stack[-1] if stack else None
+
+        if ch == '"':
+            if top is not None and top[1] == "comma":
+                # 缺少逗號："a": "x" "b": "y"
+                out.append(",")
+                top[1] = "key" if top[0] == "{" else "value"
+            is_key = top is not None and top[0] == "{" and top[1] == "key"
+            i, _state = read_string(text, i + 1, out, is_key, top[0] if top else None)
+            if top is not None:
+                top[1] = "colon" if is_key else "comma"
+            continue
+
+        if ch in "{[":
+            if top is not None:
+                if top[1] == "comma":
+                    out.append(",")
+                elif top[1] != "value" and top[0] == "{":
+                    i += 1  # 物件裡出現在鍵的位置：無法修復的雜訊，略過
+                    continue
+                top[1] = "comma"
+            out.append(ch)
+            stack.append([ch, "key" if ch == "{" else "value"])
+            i += 1
+            continue
+
+        if ch in "}]":
+            if top is None:
+                break
+            i += 1
+            _close(stack, out)
+            if not stack:
+                break
+            continue
+
+        if ch == ",":
+            if top is not None and top[1] == "comma":
+                out.append(",")
+                top[1] = "key" if top[0] == "{" else "value"
+            i += 1  # 其他位置的逗號 (重複 / 開頭) 直接略過
+            continue
+
+        if ch == ":":
+            if top is not None and top[1] == "colon":
+                out.append(":")
+                top[1] = "value"
+            i += 1
+            continue
+
+        m = _SCALAR.match(text, i)
+        token = m.group(0)
+        i = m.end()
+        if top is None:
+            continue
+        if top[1] == "key" and top[0] == "{":
+            # 沒有引號的鍵：{word: "x"}
+            out.append(json.dumps(token, ensure_ascii=False))
+            top[1] = "colon"
+        elif top[1] in ("value", "comma"):
+            value = _scalar(token)
+            if value is None:
+                continue
+            if top[1] == "comma":
+                out.append(",")
+            out.append(value)
+            top[1] = "comma"
+
+    # 截斷：補上缺少的值與所有括號
+    while stack:
+        _close(stack, out)
+    return "".join(out)
+
+
+def _close(stack, out):
+    kind, state = stack.pop()
+    if state == "colon":
+        out.append(":null")
+    elif state == "value" and kind == "{":
+        out.append("null")
+    elif out and out[-1] == ",":
+        out.pop()  # 多餘的結尾逗號
+    out.append("}" if kind == "{" else "]")
+
+
+def loads(text):
+    """修復後解析；輸入已經是合法 JSON 時結果與 json.loads 相同 (LaTeX 指令除外，見 LATEX_NRT)"""
+    return json.loads(repair_json(text))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON 修復引擎：修復檔案並輸出到 stdout")
+    parser.add_argument("path", help="要修復的檔案")
+    args = parser.parse_args(argv)
+    with open(args.path, "r", encoding="utf-8") as f:
+        print(repair_json(f.read()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
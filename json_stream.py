@@ -0,0 +1,327 @@
+import json
+
+from json_repair import loads as repair_loads, read_string
+
+# ==========================================
+# 串流 JSON 解析 (Incremental JSON Object Parser)
+# ==========================================
+# ai_decode_and_save 舊版等 Gemini 生成完整個回應，才做 regex 清理 + json.loads(strict=False)；
+# 格式壞掉的回應要等整段生成 (與計費) 結束後才發現。
+# 這裡逐段餵入串流的文字：
+#   - 每當一個頂層欄位的值完整收到，立即回傳 (key, value)，頁面可以先把該欄位顯示出來
+#   - 一旦出現不可能是合法 JSON 物件的字元 (開頭的閒聊文字、缺少冒號 / 逗號…)，立即拋出 StreamAbort，
+#     呼叫端可以中止串流、改用下一把 Key 重試
+# 與舊版行為保持一致：容許開頭的 ```json 代碼塊標籤與結尾的 ```，字串內允許未轉義的換行 (strict=False)；
+# 字串內容的修復 (LaTeX 反斜線、未轉義引號) 與 json_repair.py 共用同一套規則。
+
+_WS = " \t\r\n"
+
+
+class StreamAbort(ValueError):
+    """串流內容已確定不是合法的 JSON 物件"""
+
+
+class JSONObjectStream:
+    """
+    逐段解析單一頂層 JSON 物件：
+        parser = JSONObjectStream()
+        for chunk in response:
+            for key, value in parser.feed(chunk.text):
+                ...
+        data = parser.close()
+    頂層欄位的值若為物件 / 陣列 / 數字等，收齊後以 json.loads 解析。
+    """
+
+    def __init__(self, keep_fields=True):
+        self.keep_fields = keep_fields  # False：只逐一回傳欄位、不保留在 fields (大型檔案用)
+        self.fields = {}
+        self.done = False
+        self._buf = ""
+        self._pos = 0
+        self._state = "prefix"
+        self._key = None
+        self._start = 0      # 目前 token 在 _buf 中的起點
+        self._depth = 0      # 巢狀值的深度
+        self._in_str = False  # 巢狀值內是否位於字串中
+        self._escape = False
+
+    # --- 對外介面 ---
+    def feed(self, text):
+        """餵入一段文字，回傳這段文字完成的 [(key, value), ...]"""
+        if not text or self.done:
+            return []
+        self._buf += text
+        completed = []
+        while self._pos < len(self._buf) and not self.done:
+            if not self._step(completed):
+                break  # 需要更多輸入
+        self._compact()
+        return completed
+
+    def tail(self):
+        """物件結束後尚未使用的文字 (例如陣列中的下一個元素)"""
+        return self._buf[self._pos:]
+
+    def close(self):
+        """串流結束：物件完整時回傳 dict，否則拋出 StreamAbort (例如輸出被 max_output_tokens 截斷)"""
+        if not self.done:
+            raise StreamAbort(f"JSON 不完整 (停在 {self._state}，已收到 {len(self.fields)} 個欄位)")
+        return dict(self.fields)
+
+    # --- 內部 ---
+    def _compact(self):
+        """丟掉已處理完的前綴，避免長回應時重複掃描"""
+        cut = min(self._pos, self._start) if self._state in ("key_str", "string", "nested", "scalar", "fence") else self._pos
+        if cut > 4096:
+            self._buf = self._buf[cut:]
+            self._pos -= cut
+            self._start -= cut
+
+    def _skip_ws(self):
+        buf, pos = self._buf, self._pos
+        while pos < len(buf) and buf[pos] in _WS:
+            pos += 1
+        self._pos = pos
+        return pos < len(buf)
+
+    def _fail(self, expected):
+        snippet = self._buf[self._pos:self._pos + 20]
+        raise StreamAbort(f"預期 {expected}，卻收到 {snippet!r}")
+
+    def _step(self, completed):
+        state = self._state
+        buf = self._buf
+
+        if state == "prefix":
+            if not self._skip_ws():
+                return False
+            ch = buf[self._pos]
+            if ch == "{":
+                self._pos += 1
+                self._state = "key_or_end"
+            elif ch == "`":
+                self._start = self._pos
+                self._state = "fence"
+            else:
+                self._fail("'{'")
+            return True
+
+        if state == "fence":
+            # ```json 這一行整行略過
+            nl = buf.find("\n", self._pos)
+            if nl == -1:
+                if not "```".startswith(buf[self._start:self._start + 3]):
+                    self._fail("```")
+                self._pos = len(buf)
+                return False
+            if not buf[self._start:nl].startswith("```"):
+                self._fail("```")
+            self._pos = nl + 1
+            self._state = "prefix"
+            return True
+
+        if state in ("key_or_end", "key"):
+            if not self._skip_ws():
+                return False
+            ch = buf[self._pos]
+            if ch == '"':
+                self._start = self._pos
+                self._pos += 1
+                self._state = "key_str"
+            elif ch == "}":
+                # 空物件，或 json_repair 同樣容許的結尾多餘逗號
+                self._pos += 1
+                self.done = True
+            elif ch == "," and state == "key":
+                self._pos += 1  # 重複的逗號
+            else:
+                self._fail("欄位名稱")
+            return True
+
+        if state in ("key_str", "string"):
+            # 字串規則與 json_repair 相同：無效逸出 / LaTeX 指令補成 \\，未轉義的引號依後文判斷
+            out = []
+            end, status = read_string(buf, self._start + 1, out, is_key=state == "key_str", container="{", at_eof=False)
+            if status == "pending":
+                self._pos = len(buf)  # 下一段到達時從字串開頭重新掃描
+                return False
+            try:
+                value = json.loads("".join(out))
+            except json.JSONDecodeError as e:
+                raise StreamAbort(f"字串格式錯誤: {e}")
+            self._pos = end
+            if state == "key_str":
+                self._key = value
+                self._state = "colon"
+            else:
+                self._emit(value, completed)
+            return True
+
+        if state == "colon":
+            if not self._skip_ws():
+                return False
+            if buf[self._pos] != ":":
+                self._fail("':'")
+            self._pos += 1
+            self._state = "value"
+            return True
+
+        if state == "value":
+            if not self._skip_ws():
+                return False
+            ch = buf[self._pos]
+            self._start = self._pos
+            self._pos += 1
+            if ch == '"':
+                self._state = "string"
+            elif ch in "{[":
+                self._depth, self._in_str, self._escape = 1, False, False
+                self._state = "nested"
+            elif ch in "-0123456789tfn":
+                self._state = "scalar"
+            else:
+                self._pos -= 1
+                self._fail("欄位值")
+            return True
+
+        if state == "nested":
+            pos = self._pos
+            while pos < len(buf):
+                ch = buf[pos]
+                pos += 1
+                if self._in_str:
+                    if self._escape:
+                        self._escape = False
+                    elif ch == "\\":
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_str = False
+                elif ch == '"':
+                    self._in_str = True
+                elif ch in "{[":
+                    self._depth += 1
+                elif ch in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._pos = pos
+                        self._emit(self._parse_nested(self._start, pos), completed)
+                        return True
+            self._pos = pos
+            return False
+
+        if state == "scalar":
+            pos = self._pos
+            while pos < len(buf) and buf[pos] not in ",}" + _WS:
+                pos += 1
+            self._pos = pos
+            if pos >= len(buf):
+                return False
+            self._emit(self._parse_raw(self._start, pos), completed)
+            return True
+
+        if state == "comma_or_end":
+            if not self._skip_ws():
+                return False
+            ch = buf[self._pos]
+            self._pos += 1
+            if ch == ",":
+                self._state = "key"
+            elif ch == "}":
+                self.done = True
+            else:
+                self._pos -= 1
+                self._fail("',' 或 '}'")
+            return True
+
+        raise StreamAbort(f"未知狀態 {state}")
+
+    def _parse_raw(self, start, end):
+        try:
+            return json.loads(self._buf[start:end], strict=False)
+        except json.JSONDecodeError as e:
+            raise StreamAbort(f"欄位值格式錯誤: {e}")
+
+    def _parse_nested(self, start, end):
+        """巢狀物件 / 陣列：與頂層字串使用同一套修復規則 (LaTeX 反斜線、未轉義引號)"""
+        try:
+            return repair_loads(self._buf[start:end])
+        except ValueError as e:
+            raise StreamAbort(f"欄位值格式錯誤: {e}")
+
+    def _emit(self, value, completed):
+        if self.keep_fields:
+            self.fields[self._key] = value
+        completed.append((self._key, value))
+        self._key = None
+        self._state = "comma_or_end"
+
+
+# ==========================================
+# 大型檔案的逐筆讀取 (merge.py 使用)
+# ==========================================
+def iter_json_events(fp, chunk_size=1 << 16, keep_fields=True):
+    """
+    逐段讀取檔案，不把整個檔案載入記憶體：
+    - 頂層是物件：{...}；頂層是陣列：[{...}, {...}]；開頭的 ```json 等雜訊略過。
+    - 每個物件的欄位收齊即 yield ("field", key, value)；物件結束時 yield ("object", fields)
+      (keep_fields=False 時 fields 為 None，記憶體只保留目前這一個欄位)。
+    陣列元素不是物件、或檔案在物件中途結束時拋出 StreamAbort。
+    """
+    text = ""
+    mode = None  # None：尚未找到開頭 / array / object / done
+    parser = None
+    while True:
+        chunk = fp.read(chunk_size)
+        text += chunk
+        while text:
+            if parser is None:
+                if mode is None:
+                    starts = [p for p in (text.find("["), text.find("{")) if p != -1]
+                    if not starts:
+                        text = ""
+                        break
+                    start = min(starts)
+                    mode = "array" if text[start] == "[" else "object"
+                    text = text[start + 1:] if mode == "array" else text[start:]
+                    continue
+                if mode == "done":
+                    text = ""
+                    break
+                text = text.lstrip(" \t\r\n,")
+                if not text:
+                    break
+                if mode == "array":
+                    if text[0] == "]":
+                        mode, text = "done", ""
+                        break
+                    if text[0] != "{":
+                        raise StreamAbort(f"陣列元素不是物件: {text[:20]!r}")
+                parser = JSONObjectStream(keep_fields=keep_fields)
+            for key, value in parser.feed(text):
+                yield ("field", key, value)
+            if not parser.done:
+                text = ""
+                break
+            yield ("object", parser.fields if keep_fields else None)
+            text = parser.tail()
+            parser = None
+            if mode == "object":
+                mode = "done"
+        if not chunk:
+            if parser is not None:
+                parser.close()  # 拋出 StreamAbort (檔案被截斷)
+            return
+
+
+def iter_array_objects(fp, chunk_size=1 << 16):
+    """逐一 yield 頂層陣列中的物件 (頂層是單一物件時 yield 它本身)"""
+    for event in iter_json_events(fp, chunk_size):
+        if event[0] == "object":
+            yield event[1]
+
+
+def iter_object_members(fp, chunk_size=1 << 16):
+    """逐一 yield 頂層物件的 (key, value)；[{...}, {...}] 會依序展開每個物件的成員"""
+    for event in iter_json_events(fp, chunk_size, keep_fields=False):
+        if event[0] == "field":
+            yield event[1], event[2]
@@ -0,0 +1,283 @@
+import contextlib
+import os
+import sqlite3
+import threading
+
+from sheet_store import cell_value, make_stamp, normalize_key
+
+# ==========================================
+# 知識庫儲存後端 (Google Sheets / 本地 SQLite)
+# ==========================================
+# 舊版只有 Google Sheets 一種寫入路徑；app4 的 "Local JSON" 只能讀 master_db.json，離線時實驗室無法寫入。
+# 這裡把知識庫的讀寫整理成一組鴨子型別介面，sheet_store.SheetStore 與 SQLiteKnowledgeStore 都實作：
+#   refresh() / contains(word) / get(word) / sync(records, replace=False) -> {'appended', 'deleted', 'skipped'}
+# SQLiteKnowledgeStore 另外提供 frame() / query()，讀取直接走索引查詢，不需要快照與網路：
+#   - WAL 模式：讀取不會被寫入阻塞，多個 Streamlit Session (執行緒) 各自持有連線同時讀取
+#   - sync() 在單一 BEGIN IMMEDIATE 交易內完成 upsert，中途失敗整批回滾
+#   - word (不分大小寫) 與 category 欄位建有索引
+#   - 每次寫入 revision +1；frame() 以 revision 快取 DataFrame，未變動時回傳同一個物件 (下游索引不必重建)
+# 以環境變數或 Secrets 的 KB_BACKEND=sqlite 切換；資料庫為空時可從 master_db.json 匯入。
+# (app4 另有 KB_BACKEND=json：唯讀，直接讀取 master_db.json 的 .pack，見 master_pack.py)
+
+DEFAULT_KB_DIR = os.path.join(".cache", "kb")
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class SQLiteKnowledgeStore:
+    """
+    以主鍵 (預設 word，正規化後) 為 PRIMARY KEY 的本地知識庫：
+    1. 欄位一律以 TEXT 保存，列表 / 字典與 Sheets 相同轉成 JSON 字串 (cell_value)。
+    2. seq 記錄寫入順序，frame() 依此排序，與試算表「覆蓋 = 刪除舊列 + 追加到表尾」的順序一致。
+    3. stamp_col：寫入時自動填入修改時間 (與 SheetStore 相同)。
+    """
+
+    def __init__(self, path, columns, key="word", category="category", stamp_col=None, empty="無"):
+        self.path = path
+        self.columns = list(columns)
+        self.key = key
+        self.category = category
+        self.stamp_col = stamp_col
+        if stamp_col and stamp_col not in self.columns:
+            self.columns.append(stamp_col)
+        self.empty = empty
+        self._local = threading.local()
+        self._frame_lock = threading.Lock()
+        self._frame = (None, None)  # (revision, DataFrame)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        db = self._conn()
+        # WAL 模式寫入資料庫檔頭，之後所有連線 (包括其他行程) 都沿用
+        db.execute("PRAGMA journal_mode=WAL")
+        with self._write() as db:
+            cols = "".join(f", {_quote(c)} TEXT" for c in self.columns)
+            db.execute(f"CREATE TABLE IF NOT EXISTS entries (word_key TEXT PRIMARY KEY, seq INTEGER NOT NULL{cols})")
+            # 舊版資料庫缺少的欄位自動補上
+            existing = {row[1] for row in db.execute("PRAGMA table_info(entries)")}
+            for c in self.columns:
+                if c not in existing:
+                    db.execute(f"ALTER TABLE entries ADD COLUMN {_quote(c)} TEXT")
+            db.execute(f"CREATE INDEX IF NOT EXISTS idx_entries_word ON entries ({_quote(key)} COLLATE NOCASE)")
+            if category in self.columns:
+                db.execute(f"CREATE INDEX IF NOT EXISTS idx_entries_category ON entries ({_quote(category)})")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_entries_seq ON entries (seq)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            db.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('revision', 0)")
+
+    # --- 連線 ---
+    def _conn(self):
+        """每個執行緒一條連線 (sqlite3 連線不能跨執行緒共用)；autocommit，交易由呼叫端明確開啟"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _write(self):
+        """寫入交易：BEGIN IMMEDIATE 一開始就取得寫入鎖，其他寫入者在 timeout 內排隊"""
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    @contextlib.contextmanager
+    def _read(self):
+        """讀取交易：同一交易內的多次查詢看到同一個版本 (WAL 快照)"""
+        db = self._conn()
+        db.execute("BEGIN")
+        try:
+            yield db
+        finally:
+            db.execute("COMMIT")
+
+    def _revision(self, db):
+        return db.execute("SELECT value FROM meta WHERE name = 'revision'").fetchone()[0]
+
+    def _record(self, row):
+        return {c: (v if v is not None else self.empty) for c, v in zip(self.columns, row)}
+
+    @property
+    def _select(self):
+        return f"SELECT {', '.join(_quote(c) for c in self.columns)} FROM entries"
+
+    # --- 讀取 ---
+    def refresh(self):
+        """與 SheetStore 介面一致；本地資料庫沒有需要重建的索引"""
+
+    def revision(self):
+        return self._revision(self._conn())
+
+    def contains(self, key):
+        row = self._conn().execute("SELECT 1 FROM entries WHERE word_key = ?", (normalize_key(key),)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, key):
+        """回傳單筆紀錄 (dict)；不存在回傳 None"""
+        row = self._conn().execute(f"{self._select} WHERE word_key = ?", (normalize_key(key),)).fetchone()
+        return self._record(row) if row else None
+
+    def query(self, category=None, prefix=None, limit=None):
+        """以索引查詢：category 精確比對、prefix 為 word 開頭 (不分大小寫)，依寫入順序回傳 list[dict]"""
+        where, args = [], []
+        if category is not None:
+            where.append(f"{_quote(self.category)} = ?")
+            args.append(category)
+        if prefix:
+            # word_key 已正規化為小寫，範圍查詢可直接使用主鍵索引
+            low = normalize_key(prefix)
+            where.append("word_key >= ? AND word_key < ?")
+            args += [low, low + "\U0010ffff"]
+        sql = self._select + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY seq"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        return [self._record(row) for row in self._conn().execute(sql, args)]
+
+    def frame(self):
+        """整個知識庫的 DataFrame；revision 未變時回傳同一個物件"""
+        import pandas as pd
+
+        with self._read() as db:
+            revision = self._revision(db)
+            cached_rev, cached = self._frame
+            if cached is not None and cached_rev == revision:
+                return cached
+            rows = db.execute(self._select + " ORDER BY seq").fetchall()
+        df = pd.DataFrame([self._record(row) for row in rows], columns=self.columns)
+        with self._frame_lock:
+            if self._frame[0] is None or self._frame[0] < revision:
+                self._frame = (revision, df)
+            return self._frame[1]
+
+    # --- 寫入 ---
+    def sync(self, records, replace=False):
+        """
+        在單一交易內同步一個批次：
+        1. 不存在的主鍵 → 新增。
+        2. 已存在且 replace=True → 以新版本取代 (移到最後)；replace=False → 略過。
+        回傳 {'appended', 'deleted', 'skipped'} 計數 (與 SheetStore.sync 相同)。
+        """
+        appended = deleted = skipped = 0
+        seen = set()
+        placeholders = ", ".join("?" for _ in self.columns)
+        insert = (
+            f"INSERT OR REPLACE INTO entries (word_key, seq, {', '.join(_quote(c) for c in self.columns)}) "
+            f"VALUES (?, ?, {placeholders})"
+        )
+        stamp = make_stamp()
+        with self._write() as db:
+            seq = db.execute("SELECT COALESCE(MAX(seq), 0) FROM entries").fetchone()[0]
+            for rec in records:
+                k = normalize_key(rec.get(self.key, ""))
+                if not k or k in seen:
+                    continue
+                seen.add(k)
+                exists = db.execute("SELECT 1 FROM entries WHERE word_key = ?", (k,)).fetchone() is not None
+                if exists and not replace:
+                    skipped += 1
+                    continue
+                values = [cell_value(rec.get(c, self.empty)) for c in self.columns]
+                if self.stamp_col:
+                    values[self.columns.index(self.stamp_col)] = stamp
+                seq += 1
+                db.execute(insert, [k, seq] + values)
+                appended += 1
+                deleted += exists
+            if appended:
+                db.execute("UPDATE meta SET value = value + 1 WHERE name = 'revision'")
+        return {"appended": appended, "deleted": deleted, "skipped": skipped}
+
+    def import_json(self, path, replace=False, batch_size=500):
+        """
+        逐筆匯入 master_db.json 格式 ({word: record} 或 [{word: record}, ...])，不把整個檔案載入記憶體。
+        回傳累計的 sync() 計數。
+        """
+        from json_stream import iter_object_members
+
+        total = {"appended": 0, "deleted": 0, "skipped": 0}
+        batch = []
+
+        def flush():
+            for name, n in self.sync(batch, replace=replace).items():
+                total[name] += n
+            batch.clear()
+
+        with open(path, "r", encoding="utf-8") as f:
+            for word, rec in iter_object_members(f):
+                if not isinstance(rec, dict):
+                    continue
+                batch.append(dict({self.key: word}, **rec))
+                if len(batch) >= batch_size:
+                    flush()
+        if batch:
+            flush()
+        return total
+
+
+def backend_name(secrets=None):
+    """目前選用的知識庫後端：環境變數 KB_BACKEND 優先，其次 Secrets，預設 sheets"""
+    name = os.environ.get("KB_BACKEND")
+    if not name and secrets is not None:
+        try:
+            name = secrets.get("KB_BACKEND")
+        except Exception:
+            # 沒有 secrets.toml (純本地執行)
+            name = None
+    return str(name or "sheets").strip().lower()
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_sqlite_store(name, columns, seed_json=None, kb_dir=None, **kwargs):
+    """
+    取得行程內共用的 SQLite 知識庫 (路徑為 KB_SQLITE_DIR 或 .cache/kb 下的 {name}.sqlite3)。
+    資料庫為空且 seed_json 存在時，先從該檔匯入。
+    """
+    with _STORES_LOCK:
+        store = _STORES.get(name)
+        if store is None:
+            directory = kb_dir or os.environ.get("KB_SQLITE_DIR") or DEFAULT_KB_DIR
+            store = SQLiteKnowledgeStore(os.path.join(directory, f"{name}.sqlite3"), columns, **kwargs)
+            if seed_json and os.path.exists(seed_json) and not len(store):
+                store.import_json(seed_json)
+            _STORES[name] = store
+        return store
+
+
+if __name__ == "__main__":
+    # 用法：python kb_backend.py --import master_db.json --db .cache/kb/sheet1_full.sqlite3 [--replace]
+    import argparse
+
+    parser = argparse.ArgumentParser(description="匯入 master_db.json 到本地 SQLite 知識庫")
+    parser.add_argument("--import", dest="source", required=True, help="master_db.json 路徑")
+    parser.add_argument("--db", required=True, help="SQLite 資料庫路徑")
+    parser.add_argument("--replace", action="store_true", help="覆蓋已存在的單字")
+    args = parser.parse_args()
+
+    from json_stream import iter_object_members
+
+    # 欄位依來源檔出現的順序收集
+    columns = []
+    with open(args.source, "r", encoding="utf-8") as f:
+        for _, rec in iter_object_members(f):
+            if isinstance(rec, dict):
+                columns += [c for c in rec if c not in columns]
+    if "word" not in columns:
+        columns.insert(0, "word")
+    store = SQLiteKnowledgeStore(args.db, columns)
+    result = store.import_json(args.source, replace=args.replace)
+    print(f"✅ 新增 {result['appended']} 筆 (覆蓋 {result['deleted']} 筆，略過 {result['skipped']} 筆)，共 {len(store)} 筆")
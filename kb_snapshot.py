@@ -0,0 +1,248 @@
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+# ==========================================
+# 知識庫本地快照 (Stale-While-Revalidate)
+# ==========================================
+# 舊版 load_db / load_bubbles 在 st.cache_data 過期時 (600s / 360s / 60s) 會在請求路徑上
+# 同步 conn.read 整張表，冷啟動與過期後的第一個使用者都得等 Google 回應。
+# 這裡改成：
+#   - 每次抓到的資料寫成本地快照 (有 pyarrow 用 Parquet，否則用 pickle)
+#   - get() 立即回傳記憶體 / 磁碟上的快照，過期時在背景執行緒刷新
+#   - 只有「從來沒有快照」時才會同步抓一次
+#   - version 每次刷新成功 +1，下游索引可依版本決定是否重建
+#   - status() 回報快照年齡、來源與最後一次錯誤，讓頁面顯示資料新鮮度
+#   - 可選 delta_fn：平常只做增量同步 (成本隨修改量而非表格大小成長)，
+#     每隔 full_every 秒才做一次完整比對，補上增量偵測不到的手動修改
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(".cache", "kb")
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class KBSnapshot:
+    """
+    單一資料來源的本地快照：
+    - fetch_fn() 回傳已標準化 (欄位齊全、無 NaN) 的 DataFrame，在背景執行緒執行。
+    - max_age：快照超過幾秒視為過期並觸發背景刷新。
+    - columns：只保存這些欄位 (None 表示全部)。
+    - delta_fn(current_df)：回傳合併後的新 DataFrame；回傳 current_df 本身表示沒有變動，
+      回傳 None 表示無法增量 (改做完整抓取)。
+    - full_every：距離上次完整抓取超過幾秒，就不走增量而改做完整抓取。
+    """
+
+    def __init__(self, name, fetch_fn, columns=None, max_age=600, directory=DEFAULT_SNAPSHOT_DIR,
+                 delta_fn=None, full_every=3600):
+        self.name = name
+        self.fetch_fn = fetch_fn
+        self.delta_fn = delta_fn
+        self.full_every = full_every
+        self.full_at = 0.0
+        self.columns = list(columns) if columns else None
+        self.max_age = max_age
+        self.directory = directory
+        self.fmt = "parquet" if _has_pyarrow() else "pickle"
+        self.version = 0
+        self.fetched_at = 0.0
+        self.source = "none"  # none / disk / network / delta
+        self.last_error = ""
+        self._df = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        os.makedirs(directory, exist_ok=True)
+
+    # --- 路徑 ---
+    def data_path(self, fmt=None):
+        return os.path.join(self.directory, f"{self.name}.{fmt or self.fmt}")
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.directory, f"{self.name}.meta.json")
+
+    # --- 磁碟讀寫 ---
+    def _load_disk(self):
+        if not os.path.exists(self.meta_path):
+            return False
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            fmt = meta.get("format", self.fmt)
+            if fmt == "parquet":
+                df = pd.read_parquet(self.data_path(fmt))
+            else:
+                df = pd.read_pickle(self.data_path(fmt))
+        except Exception as e:
+            self.last_error = f"快照讀取失敗: {e}"
+            return False
+        if self.columns and any(c not in df.columns for c in self.columns):
+            # 欄位定義改過，舊快照作廢
+            return False
+        self._df = df[self.columns] if self.columns else df
+        self.fetched_at = meta.get("fetched_at", 0.0)
+        self.full_at = meta.get("full_at", self.fetched_at)
+        self.version += 1
+        self.source = "disk"
+        return True
+
+    def _write_data(self, df, fmt):
+        tmp_path = f"{self.data_path(fmt)}.tmp"
+        if fmt == "parquet":
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, self.data_path(fmt))
+
+    def _save_disk(self, df):
+        fmt = self.fmt
+        try:
+            self._write_data(df, fmt)
+        except Exception:
+            if fmt != "parquet":
+                raise
+            # 試算表欄位常混雜數字與文字 (例如 term 欄)，Arrow 無法推斷型別時改存 pickle
+            fmt = "pickle"
+            self._write_data(df, fmt)
+        tmp_meta = f"{self.meta_path}.tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": self.fetched_at, "full_at": self.full_at, "rows": len(df), "format": fmt}, f)
+        os.replace(tmp_meta, self.meta_path)
+
+    # --- 刷新 ---
+    def _fetch(self, full=False):
+        now = time.time()
+        use_delta = (
+            not full and self.delta_fn is not None and self._df is not None
+            and now - self.full_at < self.full_every
+        )
+        df = self.delta_fn(self._df) if use_delta else None
+        if use_delta and df is self._df:
+            # 增量檢查後沒有變動：只更新時間，不動版本 (下游索引不必重建)
+            self.fetched_at = now
+            self.source = "delta"
+            self.last_error = ""
+            return
+        if df is None:
+            use_delta = False
+            df = self.fetch_fn()
+        if self.columns:
+            df = df[self.columns]
+        df = df.reset_index(drop=True)
+        with self._lock:
+            self._df = df
+            self.fetched_at = now
+            if not use_delta:
+                self.full_at = now
+            self.version += 1
+            self.source = "delta" if use_delta else "network"
+            self.last_error = ""
+        try:
+            self._save_disk(df)
+        except Exception as e:
+            # 寫不進磁碟不影響本次服務，只是下次冷啟動拿不到快照
+            print(f"⚠️ 快照 {self.name} 寫入失敗: {e}")
+
+    def _background_refresh(self, full=False):
+        try:
+            self._fetch(full=full)
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"⚠️ 快照 {self.name} 背景刷新失敗: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh(self, block=False, full=False):
+        """觸發刷新；block=True 時同步抓取 (失敗會拋出例外)，full=True 時略過增量直接完整抓取"""
+        if block:
+            self._fetch(full=full)
+            return True
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+        threading.Thread(
+            target=self._background_refresh, args=(full,), name=f"kb-snapshot-{self.name}", daemon=True
+        ).start()
+        return True
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at if self.fetched_at else None
+
+    def is_stale(self):
+        return self.age is None or self.age > self.max_age
+
+    def get(self):
+        """
+        立即回傳快照：
+        1. 記憶體沒有 → 先讀磁碟；磁碟也沒有 → 同步抓取 (只會發生在第一次部署)。
+        2. 快照過期 → 照樣回傳舊資料，同時在背景刷新。
+        """
+        if self._df is None and not self._load_disk():
+            self.refresh(block=True)
+        if self.is_stale():
+            self.refresh()
+        return self._df
+
+    def invalidate(self):
+        """資料剛被寫入 (例如實驗室同步) 時呼叫：立即在背景重新抓取"""
+        self.refresh()
+
+    def status(self):
+        return {
+            "name": self.name,
+            "version": self.version,
+            "rows": 0 if self._df is None else len(self._df),
+            "age": self.age,
+            "stale": self.is_stale(),
+            "refreshing": self._refreshing,
+            "source": self.source,
+            "full_age": time.time() - self.full_at if self.full_at else None,
+            "format": self.fmt,
+            "last_error": self.last_error,
+        }
+
+
+def describe_staleness(status):
+    """把 status() 轉成給使用者看的一行說明"""
+    age = status.get("age")
+    if age is None:
+        text = "尚未載入"
+    elif age < 60:
+        text = f"{int(age)} 秒前更新"
+    elif age < 3600:
+        text = f"{int(age // 60)} 分鐘前更新"
+    else:
+        text = f"{age / 3600:.1f} 小時前更新"
+    if status.get("refreshing"):
+        text += "，背景更新中…"
+    if status.get("last_error"):
+        text += f" (上次更新失敗：{status['last_error'][:60]})"
+    return text
+
+
+_SNAPSHOTS = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+
+
+def get_snapshot(name, fetch_fn, columns=None, max_age=600, delta_fn=None, full_every=3600):
+    """取得行程內共用的快照 (同名只建立一次；fetch_fn / delta_fn 以最新傳入者為準)"""
+    with _SNAPSHOTS_LOCK:
+        snap = _SNAPSHOTS.get(name)
+        if snap is None:
+            snap = KBSnapshot(name, fetch_fn, columns=columns, max_age=max_age, delta_fn=delta_fn, full_every=full_every)
+            _SNAPSHOTS[name] = snap
+        else:
+            snap.fetch_fn = fetch_fn
+            snap.delta_fn = delta_fn
+        return snap
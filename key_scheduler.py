@@ -0,0 +1,250 @@
+import contextlib
+import threading
+import time
+
+# ==========================================
+# API Key 健康度排程器 (Process-wide)
+# ==========================================
+# 舊版 get_gemini_keys 每次都 random.shuffle，呼叫端再逐把 genai.configure 重試，
+# 已經額度用盡或被限流的 Key 每個請求都會被重新打一次。
+# iPad.py 的 api_key_index 只記得「上一把成功的 Key」，這裡把它一般化：
+#   - 紀錄每把 Key 的成功/失敗次數、連續失敗、額度錯誤與延遲 (EWMA)
+#   - 失敗後進入冷卻期 (指數退避；額度錯誤冷卻更久)
+#   - candidates() 依健康度排序，冷卻中的 Key 排最後
+#   - model() 快取綁定 Key 的模型物件，不再每次呼叫都 configure
+#   - call() / attempt() 包辦 begin → report_success / report_failure，呼叫端不必自己記帳
+
+
+QUOTA_MARKERS = ("429", "quota", "resourceexhausted", "resource_exhausted", "rate limit", "too many requests")
+INVALID_MARKERS = ("api_key_invalid", "api key not valid", "permissiondenied", "permission_denied", "403")
+
+
+def make_gemini_model(api_key, model_name):
+    """
+    建立綁定單一 API Key 的 Gemini 模型：
+    genai.configure 是全域設定，多執行緒輪流 configure 會互相覆蓋 Key，
+    因此直接替模型掛上專屬的 GenerativeServiceClient。
+    google-generativeai 沒有公開的「每個模型各自的 Key」介面，這裡依賴 0.8.x 的
+    GenerativeModel._client (建構時為 None，第一次呼叫才取全域 client)；
+    requirements.txt 因此固定在 0.8.x，版本不符時直接報錯，而不是默默改用全域 Key。
+    """
+    import google.generativeai as genai
+    from google.ai import generativelanguage as glm
+
+    model = genai.GenerativeModel(model_name)
+    if getattr(model, "_client", False) is not None:
+        raise RuntimeError(
+            f"google-generativeai {getattr(genai, '__version__', '?')} 的 GenerativeModel 不支援綁定專屬 client，"
+            "請安裝 requirements.txt 固定的 0.8.x 版本"
+        )
+    model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+    return model
+
+
+def classify_error(error):
+    """把例外分類為 quota / invalid / error 三種"""
+    text = f"{type(error).__name__} {error}".lower()
+    if any(m in text for m in QUOTA_MARKERS):
+        return "quota"
+    if any(m in text for m in INVALID_MARKERS):
+        return "invalid"
+    return "error"
+
+
+class KeyHealth:
+    """單一 Key 的健康紀錄"""
+
+    def __init__(self, key):
+        self.key = key
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.quota_errors = 0
+        self.cooldown_until = 0.0
+        self.latency = None  # 成功請求延遲的 EWMA (秒)
+        self.in_flight = 0
+        self.last_error = ""
+
+    def cooling(self, now=None):
+        return (now or time.monotonic()) < self.cooldown_until
+
+    def as_dict(self):
+        return {
+            "key": f"...{self.key[-4:]}",
+            "successes": self.successes,
+            "failures": self.failures,
+            "quota_errors": self.quota_errors,
+            "cooldown_left": max(0.0, round(self.cooldown_until - time.monotonic(), 1)),
+            "latency": round(self.latency, 2) if self.latency is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class KeyScheduler:
+    """
+    健康度導向的 Key 排程：
+    - base_cooldown：一般錯誤的起始冷卻秒數，連續失敗時倍增。
+    - quota_cooldown：額度/限流錯誤的起始冷卻秒數。
+    - max_cooldown：冷卻上限 (無效 Key 直接套用上限)。
+    - alpha：延遲 EWMA 的平滑係數。
+    """
+
+    def __init__(self, keys=(), base_cooldown=5.0, quota_cooldown=60.0, max_cooldown=900.0, alpha=0.3):
+        self.base_cooldown = base_cooldown
+        self.quota_cooldown = quota_cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._health = {}
+        self._models = {}
+        self.set_keys(keys)
+
+    def set_keys(self, keys):
+        """同步 Key 清單 (Secrets 變更時)，保留既有 Key 的健康紀錄"""
+        keys = [k for k in dict.fromkeys(keys) if k]
+        with self._lock:
+            self._health = {k: self._health.get(k) or KeyHealth(k) for k in keys}
+
+    @property
+    def keys(self):
+        return list(self._health)
+
+    def _score(self, h, now):
+        # 排序鍵：冷卻中排最後 → 進行中請求少 → 連續失敗少 → 延遲低 → 失敗率低
+        latency = h.latency if h.latency is not None else 0.0
+        fail_rate = h.failures / (h.successes + h.failures + 1)
+        return (h.cooling(now), h.in_flight, h.consecutive_failures, latency, fail_rate)
+
+    def candidates(self, keys=None, exclude=()):
+        """
+        依健康度排序的 Key 清單：
+        健康的 Key 全部列出；若全部都在冷卻中，只回傳最快恢復的那一把 (避免白打)。
+        """
+        now = time.monotonic()
+        with self._lock:
+            pool = [self._health[k] for k in (keys or self._health) if k in self._health and k not in exclude]
+            if not pool:
+                return []
+            ready = [h for h in pool if not h.cooling(now)]
+            if not ready:
+                return [min(pool, key=lambda h: h.cooldown_until).key]
+            return [h.key for h in sorted(ready, key=lambda h: self._score(h, now))]
+
+    def is_cooling(self, key):
+        h = self._health.get(key)
+        return bool(h and h.cooling())
+
+    def best(self, keys=None, exclude=()):
+        ranked = self.candidates(keys, exclude)
+        return ranked[0] if ranked else None
+
+    # --- 狀態回報 ---
+    def begin(self, key):
+        with self._lock:
+            if key in self._health:
+                self._health[key].in_flight += 1
+
+    def report_success(self, key, latency=None):
+        with self._lock:
+            h = self._health.get(key)
+            if not h:
+                return
+            h.in_flight = max(0, h.in_flight - 1)
+            h.successes += 1
+            h.consecutive_failures = 0
+            h.cooldown_until = 0.0
+            if latency is not None:
+                h.latency = latency if h.latency is None else (1 - self.alpha) * h.latency + self.alpha * latency
+
+    def report_failure(self, key, error=None):
+        kind = classify_error(error) if error is not None else "error"
+        with self._lock:
+            h = self._health.get(key)
+            if not h:
+                return kind
+            h.in_flight = max(0, h.in_flight - 1)
+            h.failures += 1
+            h.consecutive_failures += 1
+            h.last_error = str(error)[:120] if error is not None else ""
+            if kind == "quota":
+                h.quota_errors += 1
+                cooldown = self.quota_cooldown * (2 ** (h.quota_errors - 1))
+            elif kind == "invalid":
+                cooldown = self.max_cooldown
+            else:
+                cooldown = self.base_cooldown * (2 ** (h.consecutive_failures - 1))
+            h.cooldown_until = time.monotonic() + min(cooldown, self.max_cooldown)
+        return kind
+
+    # --- 模型快取 ---
+    def model(self, key, model_name):
+        """取得 (並快取) 綁定該 Key 的模型物件"""
+        cache_key = (key, model_name)
+        model = self._models.get(cache_key)
+        if model is None:
+            model = make_gemini_model(key, model_name)
+            self._models[cache_key] = model
+        return model
+
+    @contextlib.contextmanager
+    def attempt(self, key):
+        """
+        單次嘗試的記帳：進入時 begin；區塊正常結束回報成功，拋出例外時回報失敗後照常往外拋。
+        串流 generator 在區塊內被呼叫端關閉 (GeneratorExit) 時，Key 本身沒有問題，視為成功。
+        """
+        self.begin(key)
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.report_failure(key, e)
+            raise
+        except BaseException:
+            self.report_success(key, time.monotonic() - started)
+            raise
+        self.report_success(key, time.monotonic() - started)
+
+    def call(self, fn, keys=None, max_attempts=None, on_error=None):
+        """
+        依健康度輪詢執行 fn(key)：成功即回傳，失敗自動回報並換下一把。
+        fn 回傳 None 視為「Key 正常但結果無效」，不計入 Key 失敗。
+        on_error(key, error)：每把 Key 失敗後呼叫 (例如在畫面上提示換 Key)。
+        回傳 (結果, None)；全部失敗時回傳 (None, 最後一個例外)。
+        """
+        last_error = None
+        ranked = self.candidates(keys)
+        # 未登錄到排程器的 Key (例如呼叫端指定的單一 Key) 排在最後照樣嘗試
+        ranked += [k for k in dict.fromkeys(keys or ()) if k and k not in self._health]
+        for attempt, key in enumerate(ranked):
+            if max_attempts and attempt >= max_attempts:
+                break
+            try:
+                with self.attempt(key):
+                    result = fn(key)
+            except Exception as e:
+                last_error = e
+                if on_error:
+                    on_error(key, e)
+                continue
+            if result is not None:
+                return result, None
+        return None, last_error
+
+    def snapshot(self):
+        with self._lock:
+            return [h.as_dict() for h in self._health.values()]
+
+
+_SCHEDULER = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def get_scheduler(keys=None):
+    """取得行程內共用的排程器；傳入 keys 時同步 Key 清單"""
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = KeyScheduler()
+        if keys is not None and list(dict.fromkeys(k for k in keys if k)) != _SCHEDULER.keys:
+            _SCHEDULER.set_keys(keys)
+        return _SCHEDULER
@@ -0,0 +1,238 @@
+import json
+import mmap
+import os
+import random
+import struct
+import threading
+import zlib
+
+from sheet_store import normalize_key
+
+# ==========================================
+# master_db.json 的唯讀打包格式 (記憶體映射 + 延遲解碼)
+# ==========================================
+# app4 的 load_db("Local JSON") 每次都 json.load 整個 master_db.json 再組成 21 欄 DataFrame，
+# 首頁其實只顯示 3 張卡片。這裡把主資料庫轉成一個 .pack 檔：
+#   - 資料區：每筆紀錄存「小寫主鍵 + 原始 JSON」，不預先解碼
+#   - 位移表：第 i 筆紀錄的 (offset, 主鍵長度, JSON 長度)，隨機抽樣直接依編號取
+#   - 雜湊表：小寫主鍵 → 紀錄編號 (開放定址)，單字查詢 O(1)
+# 讀取端以 mmap 映射整個檔案，只有被取用的紀錄才會 json.loads；常駐記憶體與語料大小無關。
+# 檔頭記錄來源 JSON 的大小與修改時間，來源變動後 get_master_pack() 會自動重建。
+#
+# 檔案結構 (little-endian)：
+#   HEADER | 資料區 | ENTRY × count | uint32 × slots
+
+MAGIC = b"ETYMPACK"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIIQqQ")  # magic, version, count, slots, index_offset, source_mtime_ns, source_size
+ENTRY = struct.Struct("<QII")        # offset, key_len, body_len
+SLOT = struct.Struct("<I")           # 紀錄編號 + 1 (0 表示空槽)
+
+DEFAULT_PACK_DIR = os.path.join(".cache", "kb")
+
+
+class PackError(ValueError):
+    """不是有效的 .pack 檔 (格式或版本不符)"""
+
+
+def pack_path(json_path, pack_dir=DEFAULT_PACK_DIR):
+    """master_db.json → .cache/kb/master_db.pack"""
+    return os.path.join(pack_dir, os.path.splitext(os.path.basename(json_path))[0] + ".pack")
+
+
+def _slot_of(key_bytes, mask):
+    return zlib.crc32(key_bytes) & mask
+
+
+def _source_stamp(source_path):
+    if not source_path or not os.path.exists(source_path):
+        return 0, 0
+    st = os.stat(source_path)
+    return st.st_mtime_ns, st.st_size
+
+
+def write_pack(path, items, source_path=None):
+    """
+    把 (key, record) 逐筆寫成 .pack；record 可為 dict 或已序列化的 JSON 字串。
+    主鍵重複時保留第一次出現的位置、內容以最後一筆為準 (與 json 物件載入後的結果一致)。
+    先寫暫存檔、fsync，再 os.replace 原子替換；回傳紀錄筆數。
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    entries = {}  # 小寫主鍵 bytes → (offset, key_len, body_len)
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        pos = HEADER.size
+        for key, record in items:
+            key_bytes = normalize_key(key).encode("utf-8")
+            if not key_bytes:
+                continue
+            if not isinstance(record, str):
+                record = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+            body = record.encode("utf-8")
+            f.write(key_bytes)
+            f.write(body)
+            entries[key_bytes] = (pos, len(key_bytes), len(body))
+            pos += len(key_bytes) + len(body)
+
+        # 槽數取 2 的次方且至少為筆數兩倍，線性探測平均 1~2 次即命中
+        slots = 8
+        while slots < len(entries) * 2:
+            slots *= 2
+        table = [0] * slots
+        for i, (key_bytes, entry) in enumerate(entries.items()):
+            f.write(ENTRY.pack(*entry))
+            h = _slot_of(key_bytes, slots - 1)
+            while table[h]:
+                h = (h + 1) & (slots - 1)
+            table[h] = i + 1
+        f.write(struct.pack(f"<{slots}I", *table))
+
+        mtime_ns, size = _source_stamp(source_path)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(entries), slots, pos, mtime_ns, size))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+def build_pack(json_path, path=None):
+    """從 master_db.json 逐筆串流建立 .pack (不把整個 JSON 載入記憶體)"""
+    from json_stream import iter_object_members
+
+    path = path or pack_path(json_path)
+    with open(json_path, "r", encoding="utf-8") as f:
+        count = write_pack(path, iter_object_members(f), source_path=json_path)
+    return path, count
+
+
+class MasterPack:
+    """
+    唯讀的 .pack 讀取器 (可跨執行緒共用；mmap 切片與 json.loads 都不修改狀態)：
+        pack = MasterPack(".cache/kb/master_db.pack")
+        pack.get("Entropy")   # 單筆查詢，只解碼這一筆
+        pack.sample(3)        # 隨機抽 3 筆，只解碼這 3 筆
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(self._mm) < HEADER.size:
+                raise PackError(f"{path}: 檔案過短")
+            magic, version, count, slots, index_offset, mtime_ns, size = HEADER.unpack_from(self._mm, 0)
+        except (ValueError, OSError):
+            self._file.close()
+            raise
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise PackError(f"{path}: 格式不符 (magic={magic!r}, version={version})")
+        self.count = count
+        self.slots = slots
+        self.source_stamp = (mtime_ns, size)
+        self._index_offset = index_offset
+        self._table_offset = index_offset + count * ENTRY.size
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.count
+
+    def is_fresh(self, source_path):
+        """來源 JSON 的大小與修改時間是否與建檔時相同"""
+        return self.source_stamp == _source_stamp(source_path)
+
+    # --- 單筆存取 ---
+    def _entry(self, i):
+        return ENTRY.unpack_from(self._mm, self._index_offset + i * ENTRY.size)
+
+    def key(self, i):
+        offset, key_len, _ = self._entry(i)
+        return self._mm[offset:offset + key_len].decode("utf-8")
+
+    def record(self, i):
+        """第 i 筆紀錄 (依原檔順序)，此時才解碼"""
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        offset, key_len, body_len = self._entry(i)
+        start = offset + key_len
+        return json.loads(self._mm[start:start + body_len])
+
+    def find(self, word):
+        """小寫主鍵 → 紀錄編號；不存在回傳 None"""
+        key_bytes = normalize_key(word).encode("utf-8")
+        if not key_bytes or not self.count:
+            return None
+        mask = self.slots - 1
+        h = _slot_of(key_bytes, mask)
+        while True:
+            (slot,) = SLOT.unpack_from(self._mm, self._table_offset + h * SLOT.size)
+            if not slot:
+                return None
+            offset, key_len, _ = self._entry(slot - 1)
+            if key_len == len(key_bytes) and self._mm[offset:offset + key_len] == key_bytes:
+                return slot - 1
+            h = (h + 1) & mask
+
+    def get(self, word):
+        i = self.find(word)
+        return None if i is None else self.record(i)
+
+    def __contains__(self, word):
+        return self.find(word) is not None
+
+    # --- 批次存取 ---
+    def sample(self, k, rng=random):
+        """隨機抽 k 筆 (不重複)；random.sample 作用在 range 上，不會產生長度為 count 的串列"""
+        return [self.record(i) for i in rng.sample(range(self.count), min(k, self.count))]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.record(i)
+
+
+_PACKS = {}
+_PACKS_LOCK = threading.Lock()
+
+
+def get_master_pack(json_path, path=None):
+    """
+    取得行程內共用的 MasterPack：.pack 不存在、格式不符或來源 JSON 已變動時重新建立。
+    舊的映射不主動關閉 (其他 Session 可能仍在讀取)，由 GC 回收。
+    """
+    path = path or pack_path(json_path)
+    with _PACKS_LOCK:
+        pack = _PACKS.get(path)
+        if pack is not None and pack.is_fresh(json_path):
+            return pack
+        pack = None
+        if os.path.exists(path):
+            try:
+                pack = MasterPack(path)
+            except (ValueError, OSError):
+                pack = None
+        if pack is None or not pack.is_fresh(json_path):
+            build_pack(json_path, path)
+            pack = MasterPack(path)
+        _PACKS[path] = pack
+        return pack
+
+
+if __name__ == "__main__":
+    # 用法：python master_pack.py [master_db.json] [--out .cache/kb/master_db.pack]
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="把 master_db.json 打包成記憶體映射格式")
+    parser.add_argument("source", nargs="?", default="master_db.json")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    out, count = build_pack(args.source, args.out)
+    print(f"✅ {count} 筆 → {out} ({os.path.getsize(out) / 1024:.0f} KB，{time.perf_counter() - t0:.2f}s)")
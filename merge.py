@@ -1,81 +1,166 @@
+import hashlib
 import json
 import os
-import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from json_repair import loads as repair_loads
+from json_stream import iter_array_objects, iter_object_members
+from master_pack import pack_path, write_pack
 
 # 檔案路徑設定
 STUDIO_OUTPUT_FILE = "studio_output.json"
 MASTER_DB_FILE = "master_db.json"
 
-def clean_json_string(raw_str):
-    """處理無效逸出字元與 AI 斷頭問題"""
-    # 1. 移除 Markdown 標籤 (```json ... ```)
-    clean_str = re.sub(r'```json\s*|```', '', raw_str).strip()
-    
-    # 2. 修復無效的反斜線 (關鍵！)
-    # 將單個反斜線替換為雙斜線，除非它已經是合法的逸出字元
-    # 這裡用一個簡單的替換來處理大多數 LaTeX 和路徑問題
-    clean_str = clean_str.replace('\\', '\\\\')
-    # 還原已經被雙重轉義的換行符號
-    clean_str = clean_str.replace('\\\\n', '\\n').replace('\\\\"', '\\"')
-
-    # 3. 自動補齊斷頭的括號
-    if not clean_str.endswith(']'):
-        last_brace = clean_str.rfind('}')
-        if last_brace != -1:
-            clean_str = clean_str[:last_brace+1] + ']'
-            print("⚠️ 偵測到 JSON 截斷，已自動補齊結尾括號")
-            
-    return clean_str
-
-def merge_data():
-    # 1. 讀取/初始化主資料庫
-    master_db = {}
-    if os.path.exists(MASTER_DB_FILE):
-        with open(MASTER_DB_FILE, "r", encoding="utf-8") as f:
-            try:
-                master_db = json.load(f)
-            except json.JSONDecodeError:
-                print("⚠️ 主資料庫損壞，備份後重新建立")
-                
-    # 2. 讀取並清洗 Studio 輸出
-    if not os.path.exists(STUDIO_OUTPUT_FILE):
-        print(f"❌ 找不到 {STUDIO_OUTPUT_FILE}")
+MERGE_WORK_DIR = ".cache"
+
+
+def _master_shape(path):
+    """master_db.json 的外層格式：'[' 表示 [{word: record}]，'{' 表示 {word: record}"""
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(64).lstrip("\ufeff \t\r\n")
+    return "[" if head.startswith("[") else "{"
+
+
+def _digest(record):
+    """與欄位順序無關的內容摘要，用來判斷 unchanged / updated"""
+    return hashlib.sha1(json.dumps(record, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _write_master(db, path, shape):
+    """依原本順序把暫存庫逐筆寫成 master_db.json：先寫暫存檔、fsync，再 os.replace 原子替換"""
+    tmp_path = f"{path}.tmp"
+    pad = "    " if shape == "[" else "  "
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("[\n  {" if shape == "[" else "{")
+        first = True
+        for key, body in db.execute("SELECT key, body FROM records ORDER BY seq"):
+            record = json.dumps(json.loads(body), ensure_ascii=False, indent=2).replace("\n", "\n" + pad)
+            f.write(("\n" if first else ",\n") + pad + json.dumps(key, ensure_ascii=False) + ": " + record)
+            first = False
+        f.write(("\n  }\n]" if shape == "[" else "\n}") if not first else ("}\n]" if shape == "[" else "}"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _apply_item(db, item, stats, merged_words):
+    word_key = item.get("word") if isinstance(item, dict) else None
+    if not word_key:
+        stats["skipped"] += 1
         return
+    clean_key = str(word_key).strip().lower()
+    digest = _digest(item)
+    row = db.execute("SELECT digest FROM records WHERE key = ?", (clean_key,)).fetchone()
+    body = json.dumps(item, ensure_ascii=False)
+    if row is None:
+        db.execute(
+            "INSERT INTO records (key, body, digest, seq) VALUES (?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM records))",
+            (clean_key, body, digest),
+        )
+        stats["inserted"] += 1
+    elif row[0] == digest:
+        stats["unchanged"] += 1
+    else:
+        db.execute("UPDATE records SET body = ?, digest = ? WHERE key = ?", (body, digest, clean_key))
+        stats["updated"] += 1
+    merged_words.append(word_key)
 
-    with open(STUDIO_OUTPUT_FILE, "r", encoding="utf-8") as f:
-        raw_content = f.read()
-        if not raw_content.strip():
-            print("❌ studio_output.json 是空的")
-            return
-            
+
+def merge_data(master_path=MASTER_DB_FILE, studio_path=STUDIO_OUTPUT_FILE, work_dir=MERGE_WORK_DIR):
+    """
+    串流合併 (記憶體只保留目前處理的那一筆)：
+    1. 逐筆讀取 master_db.json 放進暫存的 SQLite 鍵值庫 (保留原順序)。
+    2. 逐筆讀取 studio_output.json 的陣列元素，依小寫 word 新增 / 更新 / 判定未變動。
+    3. 從暫存庫逐筆寫出新的 master_db.json (暫存檔 + rename，中途當機不會弄壞原檔)。
+    回傳本次合併的單字清單 (給 --prewarm 使用)。
+    """
+    # 0. 檢查 Studio 輸出
+    if not os.path.exists(studio_path):
+        print(f"❌ 找不到 {studio_path}")
+        return
+    if os.path.getsize(studio_path) == 0:
+        print("❌ studio_output.json 是空的")
+        return
+
+    os.makedirs(work_dir, exist_ok=True)
+    fd, store_path = tempfile.mkstemp(prefix="merge_", suffix=".sqlite3", dir=work_dir)
+    os.close(fd)
+    db = sqlite3.connect(store_path)
+    try:
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")  # 暫存庫，結束就刪除
+        db.execute("CREATE TABLE records (key TEXT PRIMARY KEY, body TEXT NOT NULL, digest TEXT NOT NULL, seq INTEGER NOT NULL)")
+
+        # 1. 讀取主資料庫
+        shape = "["
+        if os.path.exists(master_path) and os.path.getsize(master_path) > 0:
+            shape = _master_shape(master_path)
+            try:
+                with open(master_path, "r", encoding="utf-8") as f:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO records (key, body, digest, seq) VALUES (?, ?, ?, ?)",
+                        (
+                            (key, json.dumps(record, ensure_ascii=False), _digest(record), seq)
+                            for seq, (key, record) in enumerate(iter_object_members(f), start=1)
+                        ),
+                    )
+            except ValueError as e:
+                backup = f"{master_path}.corrupt-{time.strftime('%Y%m%d-%H%M%S')}"
+                shutil.copy2(master_path, backup)
+                print(f"⚠️ 主資料庫損壞 ({e})，已備份至 {backup} 後重新建立")
+                db.execute("DELETE FROM records")
+        db.commit()
+
+        # 2. 逐筆合併 Studio 輸出
+        stats = {"inserted": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+        merged_words = []
         try:
-            # 嘗試直接讀取，若失敗則啟動清洗
+            with open(studio_path, "r", encoding="utf-8") as f:
+                for item in iter_array_objects(f):
+                    _apply_item(db, item, stats, merged_words)
+        except ValueError as e:
+            # 串流解析遇到壞掉的元素：退回整檔修復 (只有輸入損壞時才會把整個檔案載入記憶體)
+            db.rollback()
+            stats = dict.fromkeys(stats, 0)
+            merged_words = []
+            print(f"⚠️ 串流解析失敗 ({e})，改用整檔修復")
             try:
-                new_data_list = json.loads(raw_content)
-            except json.JSONDecodeError:
-                cleaned_content = clean_json_string(raw_content)
-                new_data_list = json.loads(cleaned_content)
-        except json.JSONDecodeError as e:
-            print(f"❌ 無法修復 JSON 格式：{e}")
-            print("💡 建議：檢查單字定義中是否有『未轉義的雙引號』，那是 AI 最常出錯的地方")
-            return
-
-    # 3. 轉換與合併 (Array to Dict)
-    success_count = 0
-    for item in new_data_list:
-        word_key = item.get("word")
-        if not word_key: continue
-        
-        clean_key = str(word_key).strip().lower()
-        master_db[clean_key] = item
-        success_count += 1
-
-    # 4. 寫回主資料庫
-    with open(MASTER_DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(master_db, f, ensure_ascii=False, indent=2)
-
-    print(f"✅ 成功處理！新增/更新：{success_count} 筆")
-    print(f"📚 目前總單字量：{len(master_db)}")
+                with open(studio_path, "r", encoding="utf-8") as f:
+                    new_data_list = repair_loads(f.read())
+            except ValueError as e:
+                print(f"❌ 無法修復 JSON 格式：{e}")
+                print("💡 建議：檢查單字定義中是否有『未轉義的雙引號』，那是 AI 最常出錯的地方")
+                return
+            for item in new_data_list if isinstance(new_data_list, list) else [new_data_list]:
+                _apply_item(db, item, stats, merged_words)
+        db.commit()
+
+        # 3. 寫回主資料庫 (沒有任何變動時不重寫)
+        total = db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        if stats["inserted"] or stats["updated"] or not os.path.exists(master_path):
+            _write_master(db, master_path, shape)
+            # 順便重建 app 讀取用的 .pack (失敗不影響合併結果，app 端發現過期時會自行重建)
+            try:
+                write_pack(pack_path(master_path), db.execute("SELECT key, body FROM records ORDER BY seq"), source_path=master_path)
+            except OSError as e:
+                print(f"⚠️ master_db.pack 重建失敗：{e}")
+    finally:
+        db.close()
+        os.remove(store_path)
+
+    print(f"✅ 成功處理！新增：{stats['inserted']} 筆 / 更新：{stats['updated']} 筆 / 未變動：{stats['unchanged']} 筆")
+    if stats["skipped"]:
+        print(f"⚠️ 略過缺少 word 欄位的項目：{stats['skipped']} 筆")
+    print(f"📚 目前總單字量：{total}")
+    return merged_words
 
 if __name__ == "__main__":
-    merge_data()
\ No newline at end of file
+    merged = merge_data()
+    # python merge.py --prewarm：合併後順便把新單字的發音合成進快取
+    if merged and "--prewarm" in sys.argv:
+        from tts_prewarm import prewarm
+        prewarm(merged)
\ No newline at end of file
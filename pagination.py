@@ -0,0 +1,60 @@
+# ==========================================
+# 搜尋結果分頁 (Paginated Result List)
+# ==========================================
+# 廣泛查詢會命中數百筆，舊版每筆都建立 container + button (app4 甚至每筆都渲染完整卡片與 TTS iframe)。
+# 這裡把結果切頁：每次 rerun 只渲染目前這一頁，元件數量與 TTS 請求都以頁面大小為上限。
+#   - page_bounds()：純計算，方便離線驗證
+#   - render_pager()：Streamlit 分頁控制列；查詢條件 (reset_token) 改變時自動回到第 1 頁
+
+PAGE_SIZE_OPTIONS = (10, 20, 50)
+
+
+def page_bounds(total, page, page_size):
+    """
+    回傳 (start, end, page, n_pages)：
+    page 從 1 起算，超出範圍時夾到合法值；total 為 0 時回傳 (0, 0, 1, 1)。
+    """
+    page_size = max(1, int(page_size))
+    n_pages = max(1, -(-total // page_size))
+    page = min(max(1, int(page)), n_pages)
+    start = (page - 1) * page_size
+    return start, min(start + page_size, total), page, n_pages
+
+
+def render_pager(key, total, reset_token=None, page_size_options=PAGE_SIZE_OPTIONS, default_size=None):
+    """
+    繪製分頁控制列並回傳目前頁面的 (start, end)：
+    - key：此列表在 session_state 中的前綴 (同一頁面有多個列表時需不同)。
+    - reset_token：查詢字串 / 篩選條件等，改變時重設到第 1 頁。
+    """
+    import streamlit as st
+
+    page_key, size_key, token_key = f"{key}_page", f"{key}_page_size", f"{key}_token"
+    if st.session_state.get(token_key) != reset_token:
+        st.session_state[token_key] = reset_token
+        st.session_state[page_key] = 1
+    st.session_state.setdefault(page_key, 1)
+    st.session_state.setdefault(size_key, default_size or page_size_options[0])
+
+    start, end, page, n_pages = page_bounds(total, st.session_state[page_key], st.session_state[size_key])
+    st.session_state[page_key] = page
+    if total <= min(page_size_options):
+        return start, end
+
+    c_prev, c_info, c_next, c_size = st.columns([1, 2, 1, 1])
+    with c_prev:
+        if st.button("◀ 上一頁", key=f"{key}_prev", disabled=page <= 1, use_container_width=True):
+            st.session_state[page_key] = page - 1
+            st.rerun()
+    with c_info:
+        st.markdown(
+            f"<div style='text-align:center; padding-top:6px;'>第 {page} / {n_pages} 頁 · 共 {total} 筆</div>",
+            unsafe_allow_html=True,
+        )
+    with c_next:
+        if st.button("下一頁 ▶", key=f"{key}_next", disabled=page >= n_pages, use_container_width=True):
+            st.session_state[page_key] = page + 1
+            st.rerun()
+    with c_size:
+        st.selectbox("每頁筆數", page_size_options, key=size_key, label_visibility="collapsed")
+    return start, end
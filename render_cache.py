@@ -0,0 +1,43 @@
+import functools
+import threading
+
+# ==========================================
+# 卡片文字渲染快取 (跨 rerun 的 LRU)
+# ==========================================
+# show_encyclopedia_card 每次 rerun 對每張卡呼叫 fix_content 十幾次 (取代、去引號、逐行切割)，
+# 首頁與搜尋列表的預覽又再做一次；欄位內容只有資料庫更新時才會變。
+# 直接在 app 腳本裡用 functools.lru_cache 沒有效果：Streamlit 每次 rerun 重新執行整個腳本，
+# 函式被重新定義，快取也跟著清空。這裡把快取放在只會載入一次的模組裡，
+# 以 (模組, 函式名, 程式碼) 為鍵共用，同一個函式在所有 rerun / Session 之間沿用同一份快取；
+# 修改函式內容後程式碼不同，自然換成新的快取。
+
+
+_MEMOS = {}
+_MEMOS_LOCK = threading.Lock()
+
+
+def memoize_text(fn=None, maxsize=8192):
+    """
+    回傳 fn 的 LRU 快取版本 (可當裝飾器：@memoize_text 或 @memoize_text(maxsize=...))。
+    第一個參數是欄位原始值：None 直接交給 fn，列表 / 字典等非字串先轉成 str 作為快取鍵
+    (與 fix_content 內部的 str(text) 結果一致)；其餘參數必須可雜湊。
+    """
+    if fn is None:
+        return lambda f: memoize_text(f, maxsize=maxsize)
+
+    key = (fn.__module__, fn.__qualname__, fn.__code__)
+    with _MEMOS_LOCK:
+        cached = _MEMOS.get(key)
+        if cached is None:
+            inner = functools.lru_cache(maxsize=maxsize)(fn)
+
+            @functools.wraps(fn)
+            def cached(text, *args):
+                if text is None:
+                    return fn(None, *args)
+                return inner(text if isinstance(text, str) else str(text), *args)
+
+            cached.cache_info = inner.cache_info
+            cached.cache_clear = inner.cache_clear
+            _MEMOS[key] = cached
+        return cached
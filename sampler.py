@@ -0,0 +1,171 @@
+import bisect
+import random
+import threading
+
+from facets import get_facet_index
+
+# ==========================================
+# 隨機抽卡服務 (不複製 DataFrame)
+# ==========================================
+# 舊版「換一批」「抽下一個」「抽一題」都是先 df[df['category'] == sel] 複製一份篩選結果，
+# 再 .sample()；連續抽也常抽到剛剛那張。
+# 這裡直接在分面索引 (facets.py) 的列位置上抽樣，只有抽中的幾列才 df.iloc：
+#   - 均勻抽樣：每個 Session、每個池子 (全部 / 單一領域) 各一個「洗牌袋」，
+#     以稀疏 Fisher-Yates 逐張抽出，整輪抽完之前不會重複，每次抽取 O(1)；
+#     一輪結束重新洗牌時，先排除上一批，避免同一張卡連續出現兩次
+#   - 加權抽樣：權重欄位的累積和每份快照只算一次，之後每張 O(log n)；只避開上一批
+# 資料快照換過 (列位置改變) 時，Session 的抽樣紀錄自動重設：
+# 抽樣器與 Session 紀錄都以分面索引的內容指紋為準，指紋依列順序計算 (含主鍵欄位)，
+# 列被重新排序時洗牌袋裡的舊位置不會沿用。
+
+
+class _Bag:
+    """對 0..n-1 做不放回抽樣的稀疏 Fisher-Yates：只記錄被交換過的位置"""
+
+    def __init__(self, n, exclude=()):
+        self.remaining = n
+        self._swaps = {}
+        where = {}  # 被移動過的值 → 目前所在位置
+        for value in exclude:
+            i = where.pop(value, value)
+            if i >= self.remaining or self._value(i) != value:
+                continue
+            self.remaining -= 1
+            moved = self._value(self.remaining)
+            self._swaps[i] = moved
+            self._swaps.pop(self.remaining, None)
+            where[moved] = i
+
+    def _value(self, i):
+        return self._swaps.get(i, i)
+
+    def draw(self, rng):
+        j = rng.randrange(self.remaining)
+        value = self._value(j)
+        self.remaining -= 1
+        self._swaps[j] = self._value(self.remaining)
+        self._swaps.pop(self.remaining, None)
+        return value
+
+
+class DrawHistory:
+    """單一 Session 的抽樣紀錄 (存在 st.session_state)：每個池子一個洗牌袋與上一批結果"""
+
+    def __init__(self):
+        self.signature = None
+        self._bags = {}
+        self._last = {}
+
+    def _check(self, signature):
+        if signature != self.signature:
+            self.signature = signature
+            self._bags = {}
+            self._last = {}
+
+    def last(self, pool):
+        return self._last.get(pool, ())
+
+
+class CardSampler:
+    """
+    建立在 FacetIndex 上的抽樣器 (跨 Session 共用，本身不保存 Session 狀態)：
+        positions = sampler.draw(3, history=st.session_state.draw_history)
+        cards = df.iloc[positions]
+    domain=None 表示全部資料；weights 為權重欄位名稱 (非數值或負值視為 0)。
+    """
+
+    def __init__(self, facets, df):
+        self.facets = facets
+        self.signature = facets.signature
+        self._df = df
+        self._cum = {}
+        self._lock = threading.Lock()
+
+    def pool(self, domain=None):
+        return self.facets.rows(domain) if domain else range(self.facets.total)
+
+    def _cumulative(self, domain, weights):
+        """(池子, 權重欄位) 的累積權重與正權重列數，每份快照只計算一次"""
+        key = (domain, weights)
+        cum = self._cum.get(key)
+        if cum is None:
+            import pandas as pd
+
+            with self._lock:
+                cum = self._cum.get(key)
+                if cum is None:
+                    values = pd.to_numeric(self._df[weights], errors="coerce").fillna(0).clip(lower=0)
+                    values = values.tolist()
+                    total, cum, positive = 0.0, [], 0
+                    for pos in self.pool(domain):
+                        total += values[pos]
+                        cum.append(total)
+                        positive += values[pos] > 0
+                    cum = self._cum[key] = (cum, positive)
+        return cum
+
+    def draw(self, k=1, domain=None, history=None, weights=None, rng=random):
+        """回傳 k 個不重複的列位置 (池子不足 k 個時回傳全部)"""
+        pool = self.pool(domain)
+        k = min(k, len(pool))
+        if k <= 0:
+            return []
+        if history is not None:
+            history._check(self.signature)
+        last = history.last(domain) if history is not None else ()
+        if weights:
+            picked = self._draw_weighted(pool, k, domain, weights, last, rng)
+        else:
+            picked = self._draw_uniform(pool, k, domain, history, last, rng)
+        if history is not None:
+            history._last[domain] = tuple(picked)
+        return picked
+
+    def _draw_uniform(self, pool, k, domain, history, last, rng):
+        if history is None:
+            return [pool[i] for i in rng.sample(range(len(pool)), k)]
+        picked = []
+        bag = history._bags.get(domain)
+        while len(picked) < k:
+            if bag is None or bag.remaining == 0:
+                # 新的一輪：池子夠大時排除上一批與本批已抽到的，避免立刻重複
+                avoid = set(last) | set(picked)
+                if len(pool) - len(avoid) < k - len(picked):
+                    avoid = set(picked)
+                # 洗牌袋記錄的是池子內的索引 (每輪只換算一次)
+                avoid = [pool.index(p) for p in avoid if p in pool] if isinstance(pool, list) else avoid
+                bag = history._bags[domain] = _Bag(len(pool), exclude=avoid)
+            picked.append(pool[bag.draw(rng)])
+        return picked
+
+    def _draw_weighted(self, pool, k, domain, weights, last, rng):
+        cum, positive = self._cumulative(domain, weights)
+        if positive < k:
+            # 正權重的列不夠 k 個：退回均勻抽樣
+            return [pool[i] for i in rng.sample(range(len(pool)), k)]
+        total = cum[-1]
+        avoid = set(last) if positive - len(last) >= k else set()
+        picked = []
+        for _ in range(k * 50):
+            pos = pool[min(bisect.bisect_right(cum, rng.random() * total), len(pool) - 1)]
+            if pos not in avoid and pos not in picked:
+                picked.append(pos)
+                if len(picked) == k:
+                    return picked
+        # 權重集中在少數幾列：從其餘正權重的列均勻補齊
+        rest = [p for i, p in enumerate(pool) if cum[i] > (cum[i - 1] if i else 0) and p not in avoid and p not in picked]
+        return picked + rng.sample(rest, min(k - len(picked), len(rest)))
+
+
+_SAMPLERS = {}
+_SAMPLERS_LOCK = threading.Lock()
+
+
+def get_sampler(name, df, **kwargs):
+    """取得行程內共用的抽樣器；資料快照 (分面索引的內容指紋，含列順序) 換過時重建"""
+    facets = get_facet_index(name, df, **kwargs)
+    with _SAMPLERS_LOCK:
+        sampler = _SAMPLERS.get(name)
+        if sampler is None or sampler.signature != facets.signature:
+            sampler = _SAMPLERS[name] = CardSampler(facets, df)
+        return sampler
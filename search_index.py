@@ -0,0 +1,357 @@
+import bisect
+import hashlib
+import heapq
+import re
+import threading
+
+# ==========================================
+# 知識庫全文檢索 (倒排索引)
+# ==========================================
+# 舊版搜尋每次 rerun 都對 word / definition / category / meaning 做四次 str.contains 全表掃描，
+# app4 更是 df.astype(str).apply(str.contains) 掃過全部欄位。
+# 這裡預先建立倒排索引：
+#   - 中文 (CJK)：單字 + 雙字 n-gram，查詢「重力場」會拆成「重力」「力場」並要求全部命中
+#   - 英文 / 數字：以單字為單位，每個查詢詞都做前綴比對 (輸入到一半也查得到)；
+#     search(..., substring=True) 改為子字串比對 (tion → gravitation / nation)，
+#     只掃描排序過的詞彙表而不是整張表，給 app4「關鍵字包含」模式保留舊版 str.contains 的語意
+#   - 依欄位權重排名 (word > category / definition / meaning > 其他)，主題完全相符排最前
+#   - sync(df) 只重新索引內容有變動的列，快照沒換時直接略過
+#
+# 拼字容錯 (FuzzyIndex)：
+#   以 word (可選 roots) 的字元三連 (trigram) 建索引，先用 trigram 重疊數挑出少量候選，
+#   再以編輯距離排序，取代「你是不是在找」的 str.contains 全表掃描，並能接住拼錯的字。
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[㐀-鿿豈-﫿]+")
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]")
+
+DEFAULT_WEIGHTS = {"word": 5.0, "category": 2.0, "definition": 2.0, "meaning": 2.0}
+
+
+def _normalize(value):
+    return str(value).strip().lower()
+
+
+def tokenize(text, query=False):
+    """
+    把文字切成索引詞：
+    - 英文 / 數字 → 整個單字
+    - 中文 → 索引時收單字與雙字 n-gram；查詢時長度 ≥ 2 只用雙字 (更精準)，長度 1 用單字
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(_normalize(text)):
+        if not _CJK_RE.match(run):
+            tokens.append(run)
+            continue
+        bigrams = list(map(str.__add__, run, run[1:]))
+        if query:
+            tokens.extend(bigrams or [run])
+        else:
+            tokens.extend(run)
+            tokens.extend(bigrams)
+    return tokens
+
+
+class SearchIndex:
+    """
+    以主鍵 (預設 word) 為文件 ID 的倒排索引：
+    - 文件 ID 為 (正規化主鍵, 第幾次出現)：同名主題的多列各自是一份文件，不會互相覆蓋。
+    - fields：要索引的欄位 (None 表示 DataFrame 中除 exclude 以外的全部欄位)。
+    - weights：各欄位命中時的分數，未列出的欄位為 1。
+    search() 回傳依分數排序的列位置 (可直接 df.iloc)。
+    """
+
+    def __init__(self, key="word", fields=None, weights=None, exclude=("updated_at",)):
+        self.key = key
+        self.fields = list(fields) if fields else None
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.exclude = set(exclude)
+        self._postings = {}     # 詞 → {文件 ID: 分數}
+        self._doc_terms = {}    # 文件 ID → {詞: 分數} (刪除 / 更新時用)
+        self._doc_sig = {}      # 文件 ID → 內容雜湊
+        self._pos = {}          # 文件 ID → 目前 DataFrame 中的列位置
+        self._vocab = []        # 排序過的英文詞彙 (前綴查詢用)
+        self._vocab_dirty = False
+        self._source = None     # 上次同步的 DataFrame (保留參考，用 is 判斷快照是否換過)
+        self._lock = threading.Lock()   # sync 原地修改 postings，search 也必須持有
+        self.last_sync = {}
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    # --- 建立 / 更新 ---
+    def _fields_for(self, df):
+        fields = self.fields or [c for c in df.columns if c not in self.exclude]
+        return [f for f in fields if f in df.columns]
+
+    def _index_doc(self, doc_id, values):
+        terms = {}
+        # 同一詞在多個欄位出現時取最高權重 (避免長文欄位灌分)：由低權重欄位往高權重覆蓋
+        for field, value in sorted(values.items(), key=lambda fv: self.weights.get(fv[0], 1.0)):
+            terms.update(dict.fromkeys(tokenize(value), self.weights.get(field, 1.0)))
+        postings = self._postings
+        before = len(postings)
+        for tok, score in terms.items():
+            try:
+                postings[tok][doc_id] = score
+            except KeyError:
+                postings[tok] = {doc_id: score}
+        if len(postings) != before:
+            self._vocab_dirty = True
+        self._doc_terms[doc_id] = terms
+
+    def _remove_doc(self, doc_id):
+        for tok in self._doc_terms.pop(doc_id, {}):
+            bucket = self._postings.get(tok)
+            if bucket is not None:
+                bucket.pop(doc_id, None)
+                if not bucket:
+                    del self._postings[tok]
+                    self._vocab_dirty = True
+        self._doc_sig.pop(doc_id, None)
+
+    def sync(self, df):
+        """
+        讓索引與 df 一致：df 與上次是同一個物件時直接略過；
+        否則只重新索引新增 / 內容有變動的列，並移除已不存在的主鍵。
+        """
+        if df is None or df is self._source:
+            return self.last_sync
+        with self._lock:
+            fields = self._fields_for(df)
+            seen = {}
+            occurrences = {}
+            added = updated = 0
+            columns = [self.key] + [f for f in fields if f != self.key]
+            for pos, row in enumerate(df[columns].itertuples(index=False, name=None)):
+                word = _normalize(row[0])
+                if not word:
+                    continue
+                # 同名主題依出現順序編號；列順序不變時每一列都對應到同一個文件 ID，不會每次同步都重新索引
+                n = occurrences[word] = occurrences.get(word, -1) + 1
+                doc_id = (word, n)
+                seen[doc_id] = pos
+                values = dict(zip(columns, row))
+                sig = hashlib.blake2b(
+                    "\x1f".join(str(values[f]) for f in fields).encode("utf-8"), digest_size=16
+                ).digest()
+                if self._doc_sig.get(doc_id) == sig:
+                    continue
+                if doc_id in self._doc_terms:
+                    self._remove_doc(doc_id)
+                    updated += 1
+                else:
+                    added += 1
+                self._index_doc(doc_id, {f: values[f] for f in fields})
+                self._doc_sig[doc_id] = sig
+            removed = [d for d in self._doc_terms if d not in seen]
+            for doc_id in removed:
+                self._remove_doc(doc_id)
+            self._pos = seen
+            self._source = df
+            if self._vocab_dirty:
+                self._vocab = sorted(t for t in self._postings if not _CJK_RE.match(t))
+                self._vocab_dirty = False
+            self.last_sync = {"added": added, "updated": updated, "removed": len(removed), "docs": len(seen)}
+            return self.last_sync
+
+    # --- 查詢 ---
+    def _expand(self, token, substring=False):
+        """英文詞做前綴展開 (grav → gravity, gravitation ...)，substring=True 時改為包含比對；中文 n-gram 直接查"""
+        if _CJK_RE.match(token):
+            return [token] if token in self._postings else []
+        if substring:
+            return [term for term in self._vocab if token in term]
+        lo = bisect.bisect_left(self._vocab, token)
+        hi = bisect.bisect_left(self._vocab, token + "￿")
+        return self._vocab[lo:hi]
+
+    def search(self, query, limit=None, substring=False):
+        """
+        回傳依分數排序的列位置：
+        所有查詢詞都必須命中 (AND)，分數為各詞最高欄位權重的總和，
+        主題完全相符 +100、主題以查詢開頭 +20。
+        英文詞預設做前綴比對；substring=True 時詞中任何位置出現即算命中。
+        """
+        q = _normalize(query)
+        tokens = list(dict.fromkeys(tokenize(q, query=True)))
+        if not tokens:
+            return []
+        # Streamlit 每個 Session 一條執行緒：另一個 Session 的 sync 正在修改索引時不能讀
+        with self._lock:
+            return self._search(q, tokens, limit, substring)
+
+    def _search(self, q, tokens, limit, substring):
+        scores = None
+        for tok in tokens:
+            matched = {}
+            for term in self._expand(tok, substring):
+                for doc_id, score in self._postings[term].items():
+                    if matched.get(doc_id, 0) < score:
+                        matched[doc_id] = score
+            if not matched:
+                return []
+            if scores is None:
+                scores = matched
+            else:
+                scores = {d: s + matched[d] for d, s in scores.items() if d in matched}
+                if not scores:
+                    return []
+
+        ranked = []
+        for doc_id, score in scores.items():
+            pos = self._pos.get(doc_id)
+            if pos is None:
+                continue
+            # 文件 ID 的第一個元素即正規化後的主題
+            if doc_id[0] == q:
+                score += 100
+            elif doc_id[0].startswith(q):
+                score += 20
+            ranked.append((-score, pos))
+        # 只要前 limit 筆時用堆積取前幾名，不必排序全部命中結果
+        ranked = heapq.nsmallest(limit, ranked) if limit else sorted(ranked)
+        return [pos for _, pos in ranked]
+
+
+def edit_distance(a, b, limit=None):
+    """Levenshtein 距離；超過 limit 時提早結束並回傳 limit + 1"""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        cur = [i]
+        for j, cb in enumerate(b, start=1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if limit is not None and min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+    """
+    拼字容錯索引：
+    - fields：建索引的欄位 (預設只有 word；加上 roots 可用字根反查主題)。
+    - suggest() 回傳 [(列位置, 命中詞, 編輯距離)]，依距離排序。
+    同一份 DataFrame 只建一次；st.cache_data 每次回傳複本時以內容指紋判斷，內容 (含列順序) 沒變就沿用，
+    真的換了新快照才整份重建。
+    """
+
+    def __init__(self, key="word", fields=("word",)):
+        self.key = key
+        self.fields = list(fields)
+        self._terms = []       # 詞 ID → 正規化後的詞
+        self._term_pos = []    # 詞 ID → 列位置
+        self._grams = {}       # trigram → [詞 ID]
+        self._source = None
+        self._signature = None
+
+    def __len__(self):
+        return len(self._terms)
+
+    def _signature_of(self, df, fields):
+        """索引欄位的內容指紋 (列雜湊依列順序串起來再摘要；列位置改變時指紋也會改變)"""
+        import pandas as pd
+
+        if not fields or df.empty:
+            return (len(df), "")
+        row_hashes = pd.util.hash_pandas_object(df[fields].astype(str), index=False).to_numpy()
+        return (len(df), hashlib.blake2b(row_hashes.tobytes(), digest_size=16).hexdigest())
+
+    def sync(self, df):
+        """df 與上次是同一個物件或內容指紋相同時略過，否則整份重建"""
+        if df is None or df is self._source:
+            return
+        fields = [f for f in self.fields if f in df.columns]
+        signature = self._signature_of(df, fields)
+        if signature == self._signature:
+            self._source = df
+            return
+        terms, term_pos, grams = [], [], {}
+        for pos, row in enumerate(df[fields].itertuples(index=False, name=None)):
+            for field, value in zip(fields, row):
+                if field == self.key:
+                    parts = [_normalize(value)]
+                else:
+                    # roots 這類欄位是「cogn- (知道) + -ition」的自由文字，只取其中的英文字根
+                    parts = [p.strip("-") for p in re.findall(r"[a-z][a-z\-]+", _normalize(value))]
+                for term in parts:
+                    if len(term) < 2 or term == "無":
+                        continue
+                    tid = len(terms)
+                    terms.append(term)
+                    term_pos.append(pos)
+                    for g in trigrams(term):
+                        grams.setdefault(g, []).append(tid)
+        self._terms, self._term_pos, self._grams = terms, term_pos, grams
+        self._signature = signature
+        self._source = df
+
+    def suggest(self, query, k=5, max_distance=None, candidates=50):
+        """
+        回傳最接近 query 的 k 筆：
+        1. trigram 重疊數最高的前 candidates 個詞進入候選
+        2. 以編輯距離排序 (包含 query 的詞視為距離 1，保留舊版「包含」提示的行為)
+        max_distance 預設依長度放寬：每 4 個字元容許 1 個錯字，至少 2。
+        """
+        q = _normalize(query)
+        if not q:
+            return []
+        if max_distance is None:
+            max_distance = max(2, len(q) // 4)
+
+        overlap = {}
+        for g in trigrams(q):
+            for tid in self._grams.get(g, ()):
+                overlap[tid] = overlap.get(tid, 0) + 1
+        shortlist = heapq.nlargest(candidates, overlap.items(), key=lambda item: item[1])
+
+        best = {}  # 列位置 → (距離, -重疊數, 詞)
+        for tid, hits in shortlist:
+            term = self._terms[tid]
+            dist = edit_distance(q, term, limit=max_distance)
+            if q in term:
+                dist = min(dist, 1)
+            if dist > max_distance:
+                continue
+            pos = self._term_pos[tid]
+            cand = (dist, -hits, term)
+            if pos not in best or cand < best[pos]:
+                best[pos] = cand
+        ranked = sorted(best.items(), key=lambda item: item[1])[:k]
+        return [(pos, term, dist) for pos, (dist, _, term) in ranked]
+
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_search_index(name, df=None, **kwargs):
+    """取得行程內共用的索引；傳入 df 時順便同步 (同一份快照只會索引一次)"""
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(name)
+        if index is None:
+            index = _INDEXES[name] = SearchIndex(**kwargs)
+    if df is not None:
+        index.sync(df)
+    return index
+
+
+def get_fuzzy_index(name, df=None, **kwargs):
+    """取得行程內共用的拼字容錯索引；傳入 df 時同步 (每份快照只建一次)"""
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(("fuzzy", name))
+        if index is None:
+            index = _INDEXES[("fuzzy", name)] = FuzzyIndex(**kwargs)
+    if df is not None:
+        index.sync(df)
+    return index
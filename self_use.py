@@ -8,11 +8,20 @@ import random
 import os
 from io import BytesIO
 from PIL import Image, ImageOps
-from gtts import gTTS
 import google.generativeai as genai
 from streamlit_gsheets import GSheetsConnection
 import streamlit.components.v1 as components
 import markdown
+from audio_cache import get_audio_src
+from sheet_store import GSheetsBackend
+from write_behind import MetricsSheetSink, RowAppendSink, get_metrics_buffer, get_report_queue
+from search_index import get_search_index
+from facets import get_facet_index
+from sampler import DrawHistory, get_sampler
+from pagination import render_pager
+from json_stream import JSONObjectStream, StreamAbort
+from json_repair import loads as repair_loads
+from render_cache import memoize_text
 st.set_page_config(page_title="AI 教育工作站 (Etymon + Handout)", page_icon="🏫", layout="wide")
 
 def inject_custom_css():
@@ -180,6 +189,7 @@ def get_gemini_keys():
     random.shuffle(valid_keys)
     
     return valid_keys
+@memoize_text
 def fix_content(text):
     """
     優化版內容修復：
@@ -187,6 +197,7 @@ def fix_content(text):
     2. 智慧修復換行：保留段落結構，同時支援 Markdown 換行。
     3. LaTeX 保護：避免破壞數學公式的倒斜線。
     4. 移除 JSON 殘留的轉義引號，但保留內容原本的引號。
+    結果依原始值快取 (render_cache.py)，同一欄位內容跨 rerun 只清洗一次。
     """
     # 1. 基礎清洗與空值檢查
     if text is None:
@@ -237,37 +248,21 @@ def fix_content(text):
              processed_lines.append(line + "  ") # 強制換行
     
     return "\n".join(processed_lines)
-@st.cache_data(show_spinner=False, ttl=3600)  # 快取 1 小時，避免重複打 API
-def generate_audio_base64(text):
-    """
-    將 gTTS 生成邏輯獨立出來並加上快取
-    這樣頁面重整時，相同的單字不用重新請求 Google API
-    """
-    if not text: return None
-    
-    # 清洗文字：只保留英文、數字、基本標點，避免 TTS 唸出亂碼
-    clean_text = re.sub(r"[^a-zA-Z0-9\s\-\']", " ", str(text))
-    clean_text = " ".join(clean_text.split()).strip()
-    
-    if not clean_text: return None
-
-    try:
-        tts = gTTS(text=clean_text, lang='en')
-        fp = BytesIO()
-        tts.write_to_fp(fp)
-        return base64.b64encode(fp.getvalue()).decode()
-    except Exception as e:
-        print(f"TTS 生成失敗 ({text}): {e}")
-        return None
+@memoize_text
+def render_roots(roots):
+    """核心原理欄位包成 LaTeX 區塊 (結果依原始值快取)"""
+    clean_roots = fix_content(roots).replace('$', '').strip()
+    return f"$${clean_roots}$$" if clean_roots and clean_roots != "無" else "*(無公式或原理資料)*"
 
 def speak(text, key_suffix=""):
     """
     TTS 發音生成 (優化版：含快取與錯誤處理)
     """
-    # 1. 嘗試生成或獲取快取的音訊 Base64
-    audio_base64 = generate_audio_base64(text)
+    # 1. 取得音訊來源：有開靜態服務時是 /app/static/tts/<hash>.mp3 網址 (按下播放才下載)，
+    #    否則退回 base64 內嵌
+    audio_src = get_audio_src(text)
     
-    if not audio_base64:
+    if not audio_src:
         # 如果生成失敗，顯示一個禁用的按鈕或不顯示
         return
 
@@ -329,7 +324,7 @@ def speak(text, key_suffix=""):
             <span>🔊</span> 聽發音
         </button>
         <audio id="{unique_id}" style="display:none" preload="none">
-            <source src="data:audio/mp3;base64,{audio_base64}" type="audio/mp3">
+            <source src="{audio_src}" type="audio/mpeg">
         </audio>
 
         <script>
@@ -379,49 +374,19 @@ def get_spreadsheet_url():
 def log_user_intent(label):
     """
     靜默紀錄用戶意願 (Metrics)
-    優化：加入簡單的時間戳記，並避免因讀取失敗導致程式中斷
+    只在記憶體累加並寫入本地 journal 後立即返回，由背景執行緒批次把增量寫回 metrics 工作表
+    (見 write_behind.py)，Sheets 延遲不再落在使用者的請求上。
     """
     if not label: return
 
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
+        creds = st.secrets["connections"]["gsheets"]
         url = get_spreadsheet_url()
         if not url: return
-
-        # 1. 嘗試讀取現有數據
-        try: 
-            # 設定 ttl=0 確保讀到最新數據，避免計數回溯
-            m_df = conn.read(spreadsheet=url, worksheet="metrics", ttl=0)
-            
-            # 確保 count 欄位是整數，處理可能存在的空值或錯誤格式
-            if 'count' not in m_df.columns:
-                m_df['count'] = 0
-            m_df['count'] = pd.to_numeric(m_df['count'], errors='coerce').fillna(0).astype(int)
-            
-        except Exception: 
-            # 如果工作表不存在或讀取失敗，初始化一個新的 DataFrame
-            m_df = pd.DataFrame(columns=['label', 'count', 'last_updated'])
-        
-        # 2. 更新計數邏輯
-        current_time = time.strftime("%Y-%m-%d %H:%M:%S")
-        
-        if label in m_df['label'].values:
-            # 更新現有標籤
-            idx = m_df[m_df['label'] == label].index
-            m_df.loc[idx, 'count'] += 1
-            m_df.loc[idx, 'last_updated'] = current_time
-        else:
-            # 新增標籤
-            new_record = pd.DataFrame([{
-                'label': label, 
-                'count': 1, 
-                'last_updated': current_time
-            }])
-            m_df = pd.concat([m_df, new_record], ignore_index=True)
-            
-        # 3. 寫回 Google Sheets
-        conn.update(spreadsheet=url, worksheet="metrics", data=m_df)
-        
+        # 連線在背景執行緒第一次送出時才建立
+        sink = MetricsSheetSink(lambda: GSheetsBackend.from_service_account(creds, url, worksheet="metrics"))
+        # 每個 App 一份 journal (以檔名區分)
+        get_metrics_buffer(os.path.splitext(os.path.basename(__file__))[0], sink).incr(label)
     except Exception as e:
         # 在 Console 輸出錯誤以便除錯，但不中斷前端顯示
         print(f"⚠️ Metrics logging failed for '{label}': {e}")
@@ -459,11 +424,13 @@ def load_db():
 def submit_report(row_data):
     """
     優化版回報系統：加入時間戳記與狀態標記
+    回報先寫入本地佇列 (write_behind.ReportQueue) 後立即返回，由背景執行緒批次追加到回報試算表；
+    同一單字 10 分鐘內重複回報只記一次。
     """
     try:
         # 請確認此 URL 具有寫入權限
         FEEDBACK_URL = "https://docs.google.com/spreadsheets/d/1NNfKPadacJ6SDDLw9c23fmjq-26wGEeinTbWcg7-gFg/edit?gid=0#gid=0"
-        conn = st.connection("gsheets", type=GSheetsConnection)
+        creds = st.secrets["connections"]["gsheets"]
         
         # 準備回報內容
         # 如果 row_data 是 Series 則轉為 dict
@@ -476,17 +443,12 @@ def submit_report(row_data):
         report_dict['report_time'] = time.strftime("%Y-%m-%d %H:%M:%S")
         report_dict['report_status'] = "待處理" # 初始化狀態
         
-        # 讀取現有回報
-        try: 
-            existing = conn.read(spreadsheet=FEEDBACK_URL, ttl=0)
-        except: 
-            existing = pd.DataFrame()
-            
-        # 合併並更新
-        updated = pd.concat([existing, pd.DataFrame([report_dict])], ignore_index=True)
-        conn.update(spreadsheet=FEEDBACK_URL, data=updated)
-        
-        st.toast(f"🛠️ 已收到「{report_dict.get('word')}」的回報，我們會盡快處理！", icon="✅")
+        sink = RowAppendSink(lambda: GSheetsBackend.from_service_account(creds, FEEDBACK_URL))
+        queue = get_report_queue(os.path.splitext(os.path.basename(__file__))[0], sink)
+        if queue.enqueue(report_dict):
+            st.toast(f"🛠️ 已收到「{report_dict.get('word')}」的回報，我們會盡快處理！", icon="✅")
+        else:
+            st.toast(f"👌「{report_dict.get('word')}」剛剛已經有人回報過了，感謝！", icon="ℹ️")
         return True
     except Exception as e:
         st.error(f"❌ 回報發送失敗：{e}")
@@ -530,7 +492,17 @@ def generate_random_topics(primary_cat, aux_cats=[], count=5):
         except:
             continue
     return ""
-def ai_decode_and_save(input_text, primary_cat, aux_cats=[]):
+def salvage_truncated_json(raw_text):
+    """輸出被 max_output_tokens 截斷時，以 json_repair 補齊並保留已完整收到的欄位 (至少要有 word)"""
+    try:
+        data = repair_loads(raw_text)
+    except ValueError:
+        return None
+    if isinstance(data, dict) and data.get("word"):
+        print(f"⚠️ 解碼輸出被截斷，已修復並保留 {len(data)} 個欄位")
+        return data
+    return None
+def ai_decode_and_save(input_text, primary_cat, aux_cats=[], on_field=None):
     """
     核心解碼函式 (Pro 整合版)：
     1. 跨領域交叉分析：主領域 + 輔助視角。
@@ -581,8 +553,16 @@ def ai_decode_and_save(input_text, primary_cat, aux_cats=[]):
 
     final_prompt = f"{SYSTEM_PROMPT}\n\n解碼目標：「{input_text}」"
 
-    # 嘗試使用 API Key 進行生成
+    CORE_COLS = [
+        'word', 'category', 'roots', 'breakdown', 'definition', 
+        'meaning', 'native_vibe', 'example', 'synonym_nuance', 
+        'usage_warning', 'memory_hook', 'phonetic'
+    ]
+
+    # 嘗試使用 API Key 進行生成 (串流解析：欄位收齊即呼叫 on_field，格式一壞立即換下一把 Key)
     for key in keys:
+        parser = JSONObjectStream()
+        raw_text = ""
         try:
             genai.configure(api_key=key)
             # 使用 1.5-flash 兼顧速度與邏輯穩定性
@@ -594,48 +574,44 @@ def ai_decode_and_save(input_text, primary_cat, aux_cats=[]):
                     "temperature": 0.2, # 降低隨機性，確保格式穩定
                     "top_p": 0.95,
                     "max_output_tokens": 2048,
-                }
+                },
+                stream=True,
             )
-            
-            if response and response.text:
-                raw_res = response.text
-                
-                # 1. 清洗 Markdown 標籤 (預防萬一 AI 還是加了)
-                clean_json = re.sub(r'^```json\s*|\s*```$', '', raw_res.strip(), flags=re.MULTILINE)
-                
-                # 2. 驗證 JSON 合法性並補齊欄位
+            for chunk in response:
                 try:
-                    parsed_data = json.loads(clean_json, strict=False)
-                    
-                    CORE_COLS = [
-                        'word', 'category', 'roots', 'breakdown', 'definition', 
-                        'meaning', 'native_vibe', 'example', 'synonym_nuance', 
-                        'usage_warning', 'memory_hook', 'phonetic'
-                    ]
-                    
-                    # 確保 12 欄位完整，缺失則補「無」
-                    for col in CORE_COLS:
-                        if col not in parsed_data:
-                            parsed_data[col] = "無"
-                    
-                    # 強制寫入正確的分類標籤
-                    parsed_data['category'] = combined_cats
-                    
-                    # 回傳標準化的 JSON 字串
-                    return json.dumps(parsed_data, ensure_ascii=False)
-                    
-                except json.JSONDecodeError as je:
-                    # 嘗試修復常見的換行符號導致的 JSON 錯誤
-                    try:
-                        fixed_json = clean_json.replace('\n', '\\n')
-                        return json.dumps(json.loads(fixed_json), ensure_ascii=False)
-                    except:
-                        print(f"JSON 解析失敗: {je}")
-                        continue
-                        
+                    piece = chunk.text
+                except ValueError:
+                    continue
+                raw_text += piece
+                # 逐段解析 (已容許 ```json 標籤與字串內的原始換行)
+                for field, value in parser.feed(piece):
+                    if on_field and field in CORE_COLS:
+                        on_field(field, value)
+                if parser.done:
+                    break
+            try:
+                parsed_data = parser.close()
+            except StreamAbort:
+                parsed_data = salvage_truncated_json(raw_text)
+                if parsed_data is None:
+                    raise
+        except StreamAbort as se:
+            print(f"JSON 解析失敗: {se}")
+            continue
         except Exception as e:
             print(f"⚠️ API Key 嘗試失敗: {e}")
             continue
+
+        # 確保 12 欄位完整，缺失則補「無」
+        for col in CORE_COLS:
+            if col not in parsed_data:
+                parsed_data[col] = "無"
+        
+        # 強制寫入正確的分類標籤
+        parsed_data['category'] = combined_cats
+        
+        # 回傳標準化的 JSON 字串
+        return json.dumps(parsed_data, ensure_ascii=False)
     
     return None
 def show_encyclopedia_card(row):
@@ -661,9 +637,7 @@ def show_encyclopedia_card(row):
     r_hook = fix_content(row.get('memory_hook', ""))
 
     # --- 2. LaTeX 核心原理處理 ---
-    raw_roots = fix_content(row.get('roots', ""))
-    clean_roots = raw_roots.replace('$', '').strip()
-    r_roots = f"$${clean_roots}$$" if clean_roots and clean_roots != "無" else "*(無公式或原理資料)*"
+    r_roots = render_roots(row.get('roots', ""))
 
     # --- 3. 標題與發音區 ---
     st.markdown(f"<div class='hero-word'>{r_word}</div>", unsafe_allow_html=True)
@@ -866,6 +840,7 @@ def page_etymon_lab():
         total = len(input_list)
         progress_bar = st.progress(0)
         status_text = st.empty()
+        live_card = st.empty()
 
         for i, word in enumerate(input_list):
             status_text.markdown(f"⏳ **正在處理 ({i+1}/{total}):** `{word}`")
@@ -878,8 +853,17 @@ def page_etymon_lab():
             if is_exist and not force_refresh:
                 status_text.markdown(f"⏩ **跳過已存在項目:** `{word}`")
             else:
-                # 呼叫 AI 解碼函式 (12 欄位 + 去 AI 腔調)
-                raw_res = ai_decode_and_save(word, primary_cat, aux_cats)
+                # 呼叫 AI 解碼函式 (12 欄位 + 去 AI 腔調)；欄位收齊就先顯示在預覽卡上
+                live_fields = {}
+
+                def on_field(field, value):
+                    live_fields[field] = value
+                    with live_card.container(border=True):
+                        for col in CORE_COLS:
+                            if col in live_fields:
+                                st.markdown(f"**{col}**：{fix_content(live_fields[col])}")
+
+                raw_res = ai_decode_and_save(word, primary_cat, aux_cats, on_field=on_field)
                 
                 if raw_res:
                     try:
@@ -928,6 +912,12 @@ def page_etymon_lab():
 # ==========================================
 # Etymon 模組: 頁面邏輯 (優化版)
 # ==========================================
+def get_draw_history():
+    """本 Session 的抽卡紀錄：換一批 / 抽下一個在抽完整輪之前不重複，也不會連續抽到同一張"""
+    if 'draw_history' not in st.session_state:
+        st.session_state.draw_history = DrawHistory()
+    return st.session_state.draw_history
+
 def page_etymon_home(df):
     """
     Etymon Decoder 門戶首頁
@@ -940,13 +930,15 @@ def page_etymon_home(df):
     
     # 2. 數據儀表板
     if not df.empty:
+        # 分面索引每份快照只建一次：組合分類拆成各領域計數，獨特字根數預先算好
+        facets = get_facet_index("sheet2_core", df)
         c1, c2, c3 = st.columns(3)
         with c1:
             st.metric("📚 知識庫總量", f"{len(df)} 筆")
         with c2:
-            st.metric("🏷️ 涵蓋領域", f"{df['category'].nunique()} 類")
+            st.metric("🏷️ 涵蓋領域", f"{len(facets.domains)} 類")
         with c3:
-            unique_roots = df['roots'].nunique()
+            unique_roots = facets.nunique("roots")
             st.metric("🧬 核心邏輯", f"{unique_roots} 組")
     else:
         st.info("目前資料庫尚無資料，請前往實驗室進行首次解碼。")
@@ -966,7 +958,7 @@ def page_etymon_home(df):
     
     # 保持隨機抽取穩定
     if 'home_sample' not in st.session_state:
-        st.session_state.home_sample = df.sample(min(3, len(df)))
+        st.session_state.home_sample = df.iloc[get_sampler("sheet2_core", df).draw(3, history=get_draw_history())]
     
     sample = st.session_state.home_sample
     cols = st.columns(3)
@@ -1053,22 +1045,27 @@ def page_etymon_learn(df):
             
     # --- 模式 B：顯示探索與搜尋列表 (curr_w 不存在) ---
     else:
+        # 領域選單與篩選都走分面索引 (組合分類「物理科學 + 人工智慧」會同時出現在兩個領域下)
+        facets = get_facet_index("sheet2_core", df)
         tab_explore, tab_search = st.tabs(["🎲 隨機探索", "🔍 搜尋與列表"])
         
         # --- Tab 1: 隨機探索 ---
         with tab_explore:
             col_cat, col_btn = st.columns([2, 1])
             with col_cat:
-                cats = ["全部領域"] + sorted(df['category'].unique().tolist())
+                cats = ["全部領域"] + facets.domains
                 sel_cat = st.selectbox("選擇學習領域", cats, key="explore_cat_sel")
             
             with col_btn:
                 st.write("") # 對齊
                 if st.button("🎲 抽下一個", use_container_width=True, type="primary"):
-                    f_df = df if sel_cat == "全部領域" else df[df['category'] == sel_cat]
-                    if not f_df.empty:
+                    # 直接在該領域的列位置上抽一個 (不複製篩選結果)
+                    picked = get_sampler("sheet2_core", df).draw(
+                        1, domain=None if sel_cat == "全部領域" else sel_cat, history=get_draw_history()
+                    )
+                    if picked:
                         # 將抽到的單字存入 curr_w，進入詳情模式
-                        st.session_state.curr_w = f_df.sample(1).iloc[0].to_dict()
+                        st.session_state.curr_w = df.iloc[picked[0]].to_dict()
                         # 隨機探索時，來源設為學習搜尋頁本身
                         st.session_state.back_to = "📖 學習搜尋" 
                     else:
@@ -1087,33 +1084,29 @@ def page_etymon_learn(df):
                 search_query = st.text_input("🔍 關鍵字搜尋", placeholder="輸入單字、定義或本質意義...", key="search_input")
             
             with col_cat_filter:
-                # 建立領域清單 (包含 "所有領域")
-                cats_for_search = ["所有領域"] + sorted(df['category'].unique().tolist())
-                sel_cat_search = st.selectbox("篩選領域", cats_for_search, key="search_cat_selector")
+                # 領域可複選，取交集 (例如同時屬於「物理科學」與「人工智慧」的跨界主題)
+                sel_domains = st.multiselect(
+                    "篩選領域", facets.domains, key="search_domain_selector",
+                    format_func=lambda d: f"{d} ({facets.count(d)})", placeholder="所有領域",
+                )
+                sel_cat_search = " + ".join(sel_domains) if sel_domains else "所有領域"
 
-            # --- 根據下拉選單的選擇，決定要操作的基礎 DataFrame ---
-            if sel_cat_search == "所有領域":
-                base_df_for_display = df
-            else:
-                base_df_for_display = df[df['category'] == sel_cat_search]
+            # --- 根據選擇的領域，決定要操作的基礎 DataFrame ---
+            base_df_for_display = df.iloc[facets.intersect(sel_domains)] if sel_domains else df
 
             # --- 搜尋邏輯應用在已篩選的 DataFrame 上 ---
             if search_query:
-                q = search_query.strip().lower()
-                # 全欄位檢索：在 word, definition, category, meaning 中搜尋
-                mask = (
-                    base_df_for_display['word'].str.contains(q, case=False, na=False) |
-                    base_df_for_display['definition'].str.contains(q, case=False, na=False) |
-                    base_df_for_display['category'].str.contains(q, case=False, na=False) |
-                    base_df_for_display['meaning'].str.contains(q, case=False, na=False)
-                )
-                
-                res_df = base_df_for_display[mask]
+                # 全欄位檢索：倒排索引 (中文雙字 n-gram + 英文單字前綴)，依相關度排序
+                # 索引跟著快照版本增量更新，同一份快照只會建立一次
+                index = get_search_index("sheet2_core", df)
+                res_df = df.iloc[facets.filter(index.search(search_query), sel_domains)]
                 
                 if not res_df.empty:
                     st.success(f"在「{sel_cat_search}」中找到 {len(res_df)} 筆結果：")
+                    # 分頁顯示：每次只渲染目前這一頁的結果，元件數量不隨命中數成長
+                    start, end = render_pager("search_hits", len(res_df), reset_token=(search_query, sel_cat_search))
                     # 顯示搜尋結果，每個結果都可點擊進入詳情
-                    for _, row in res_df.iterrows():
+                    for _, row in res_df.iloc[start:end].iterrows():
                         with st.container(border=True):
                             # 提供按鈕讓用戶點擊進入單字詳情模式
                             st.markdown(f"**{row['word']}** ( {row['category']} )")
@@ -1177,16 +1170,27 @@ def get_image_base64(image, max_dim=1200):
     except Exception as e:
         print(f"圖片處理失敗: {e}")
         return ""
-def handout_ai_generate(image, manual_input, instruction):
+def clean_handout_text(text, partial=False):
+    """移除 AI 可能包上的 Markdown 代碼塊標籤；partial=True 時也去掉串流中途尚未收完的結尾反引號"""
+    final_text = text.strip()
+    final_text = re.sub(r'^```markdown\s*|\s*```$', '', final_text, flags=re.MULTILINE)
+    if partial:
+        final_text = re.sub(r'`{1,2}$', '', final_text)
+    return final_text
+
+def handout_ai_stream(image, manual_input, instruction):
     """
-    Handout AI 核心 (Pro 專業版)：
+    Handout AI 核心 (Pro 專業版，串流)：
     1. 嚴格執行去 AI 腔調約束，直接輸出講義內容。
     2. 強化 LaTeX 與 Markdown 的排版安全性。
     3. 支援自動章節換頁標籤。
+    以 generator 形式逐段 yield「目前為止的完整內容」(已清理代碼塊標籤)，第一段通常不到一秒就會到達；
+    呼叫端停止迭代 (使用者按下停止 / Streamlit rerun) 時串流即中止。
     """
     keys = get_gemini_keys()
     if not keys: 
-        return "❌ 錯誤：未偵測到有效的 API Key。"
+        yield "❌ 錯誤：未偵測到有效的 API Key。"
+        return
 
     # --- 專業講義架構指令 (去 AI 腔調版) ---
     SYSTEM_PROMPT = """
@@ -1226,6 +1230,7 @@ def handout_ai_generate(image, manual_input, instruction):
 
     last_error = None
     for key in keys:
+        raw_text = ""
         try:
             genai.configure(api_key=key)
             model = genai.GenerativeModel('gemini-2.5-flash')
@@ -1239,21 +1244,41 @@ def handout_ai_generate(image, manual_input, instruction):
             
             response = model.generate_content(
                 content_parts, 
-                generation_config=generation_config
+                generation_config=generation_config,
+                stream=True,
             )
-            
-            if response and response.text:
-                # 最終檢查：移除可能殘留的 Markdown 代碼塊標籤
-                final_text = response.text.strip()
-                final_text = re.sub(r'^```markdown\s*|\s*```$', '', final_text, flags=re.MULTILINE)
-                return final_text
+            for chunk in response:
+                try:
+                    piece = chunk.text
+                except ValueError:
+                    # 安全過濾等原因造成的空 chunk
+                    continue
+                if piece:
+                    raw_text += piece
+                    yield clean_handout_text(raw_text, partial=True)
                 
         except Exception as e:
+            if raw_text:
+                # 已經輸出部分內容，不換 Key 重來 (避免內容重複)，保留已產生的部分
+                yield clean_handout_text(raw_text) + f"\n\n> ⚠️ AI 生成中斷：{e}"
+                return
             last_error = e
             print(f"⚠️ Key 嘗試失敗: {e}")
             continue
+
+        if raw_text:
+            # 最終檢查：移除可能殘留的 Markdown 代碼塊標籤
+            yield clean_handout_text(raw_text)
+            return
     
-    return f"AI 生成中斷。最後錯誤訊息: {str(last_error)}"
+    yield f"AI 生成中斷。最後錯誤訊息: {str(last_error)}"
+
+def handout_ai_generate(image, manual_input, instruction):
+    """非串流版本：等整份講義生成完畢後一次回傳"""
+    final_text = ""
+    for final_text in handout_ai_stream(image, manual_input, instruction):
+        pass
+    return final_text
 def generate_printable_html(title, text_content, img_b64, img_width_percent, auto_download=False):
     """
     專業講義渲染引擎 (Pro 版)：
@@ -1446,6 +1471,14 @@ def run_handout_app():
     if "trigger_download" not in st.session_state:
         st.session_state.trigger_download = False
 
+    # 上一輪串流生成被「停止」或其他操作中斷：保留已產生的部分內容
+    if "handout_partial" in st.session_state:
+        partial = st.session_state.pop("handout_partial")
+        if partial:
+            st.session_state.preview_editor = partial
+            st.toast("⏹ 已停止生成，保留目前已產生的內容", icon="✂️")
+    stream_request = None
+
     # 2. 頁面佈局 (左側控制，右側預覽)
     col_ctrl, col_prev = st.columns([1, 1.4], gap="large")
     
@@ -1504,21 +1537,9 @@ def run_handout_app():
                     user_instr = st.text_input("補充指令", placeholder="例如：加入練習題...")
 
                 if st.button("🚀 執行結構化生成", type="primary", use_container_width=True):
-                    with st.spinner("正在優化講義架構..."):
-                        final_instruction = f"{SAFE_STYLES[selected_style]}\n{user_instr}"
-                        # 呼叫優化後的 AI 生成函式
-                        generated_res = handout_ai_generate(image_obj, st.session_state.manual_input_content, final_instruction)
-                        
-                        # 更新編輯器內容
-                        st.session_state.preview_editor = generated_res
-                        
-                        # 自動提取第一行作為標題
-                        for line in generated_res.split('\n'):
-                            clean_t = line.replace('#', '').strip()
-                            if clean_t:
-                                st.session_state.final_handout_title = clean_t
-                                break
-                        st.rerun()
+                    final_instruction = f"{SAFE_STYLES[selected_style]}\n{user_instr}"
+                    # 實際生成在右側預覽區以串流方式進行 (邊生成邊顯示)
+                    stream_request = (image_obj, st.session_state.manual_input_content, final_instruction)
         else:
             st.info("💡 提示：您可以直接在右側（電腦）或下方（手機）編輯器中貼上內容進行排版。AI 自動排版功能目前僅開放給管理員。")
 
@@ -1544,6 +1565,41 @@ def run_handout_app():
         # 贊助小提示
         st.caption("💖 講義下載完全免費。若覺得好用，歡迎透過側邊欄贊助支持 AI 算力支出。")
 
+        # B-0. 串流生成：內容邊到邊顯示在編輯區與 A4 預覽，完成後才寫回可編輯的編輯器
+        if stream_request is not None:
+            stream_image, stream_material, stream_instruction = stream_request
+            st.button("⏹ 停止生成", use_container_width=True, key="stop_handout_stream")
+            editor_slot = st.empty()
+            preview_slot = st.empty()
+            editor_slot.info("🤖 AI 正在進行深度排版與邏輯優化...")
+            img_b64 = get_image_base64(stream_image) if stream_image else ""
+            generated_res = ""
+            last_preview = 0.0
+            for generated_res in handout_ai_stream(stream_image, stream_material, stream_instruction):
+                # 每段都先存進 session_state：按下停止會觸發 rerun 中斷本輪，下一輪從這裡取回部分內容
+                st.session_state.handout_partial = generated_res
+                editor_slot.code(generated_res, language="markdown")
+                # A4 預覽 (MathJax iframe) 重繪較重，節流為每秒一次
+                if time.time() - last_preview > 1.0:
+                    last_preview = time.time()
+                    with preview_slot.container(border=True):
+                        components.html(
+                            generate_printable_html(st.session_state.final_handout_title, generated_res, img_b64, img_width),
+                            height=850, scrolling=True,
+                        )
+            st.session_state.pop("handout_partial", None)
+
+            # 更新編輯器內容
+            st.session_state.preview_editor = generated_res
+            
+            # 自動提取第一行作為標題
+            for line in generated_res.split('\n'):
+                clean_t = line.replace('#', '').strip()
+                if clean_t:
+                    st.session_state.final_handout_title = clean_t
+                    break
+            st.rerun()
+
         # B. 內容修訂編輯器
         # 若編輯器為空但素材有內容，則自動同步 (初次載入)
         if not st.session_state.preview_editor and st.session_state.manual_input_content:
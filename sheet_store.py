@@ -0,0 +1,416 @@
+import bisect
+import json
+import time
+from datetime import datetime
+
+# ==========================================
+# Google Sheets 列級 (Row-level) 儲存層
+# ==========================================
+# 舊流程每次批量解碼都 conn.read 整張表、concat 之後再 conn.update 整張寫回，
+# 上傳量隨知識庫筆數線性成長。這裡改成只操作「本批次」相關的列：
+#   - 新單字：一次 append_rows 追加到表尾
+#   - 強制刷新：只刪除被覆蓋的舊列，再追加新版本
+# 後端介面刻意保持極小，讓 FakeSheetsBackend 可以在離線環境完整模擬。
+#
+# 增量讀取 (SheetDeltaReader)：
+#   SheetStore 寫入時在 updated_at 欄蓋上時間戳，讀取端只需下載主鍵欄與 updated_at 欄，
+#   與本地快照比對後，只抓「新增 / 時間戳變動」的列，並把表上已消失的主鍵視為刪除。
+#   直接在試算表介面手動修改的列不會更新時間戳，因此仍需定期做一次完整比對。
+
+
+def cell_value(value):
+    """把任意欄位值轉成可寫入試算表的字串 (列表/字典以 JSON 保存)"""
+    if value is None:
+        return "無"
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def normalize_key(value):
+    """主鍵正規化：去空白 + 小寫 (與舊版 str.lower().str.strip() 比對邏輯一致)"""
+    return str(value).strip().lower()
+
+
+def make_stamp():
+    """修改時間戳 (毫秒精度，同一秒內連續覆寫也能分辨)"""
+    return datetime.now().isoformat(timespec="milliseconds")
+
+
+class FakeSheetsBackend:
+    """
+    離線測試用的假試算表：
+    1. 以二維 list 保存資料 (第 1 列為表頭)，列號與 gspread 一樣從 1 起算。
+    2. 紀錄每次呼叫與讀寫的儲存格數，可用來驗證同步成本只跟批次大小有關。
+    """
+
+    def __init__(self, rows=None):
+        self.rows = [list(r) for r in (rows or [])]
+        self.calls = []
+        self.cells_read = 0
+        self.cells_written = 0
+
+    def _log(self, name, read=0, written=0):
+        self.calls.append(name)
+        self.cells_read += read
+        self.cells_written += written
+
+    def reset_stats(self):
+        self.calls = []
+        self.cells_read = 0
+        self.cells_written = 0
+
+    def get_header(self):
+        header = list(self.rows[0]) if self.rows else []
+        self._log("get_header", read=len(header))
+        return header
+
+    def set_header(self, columns):
+        if self.rows:
+            self.rows[0] = list(columns)
+        else:
+            self.rows.append(list(columns))
+        self._log("set_header", written=len(columns))
+
+    def col_values(self, col):
+        values = [r[col - 1] if len(r) >= col else "" for r in self.rows]
+        # 與 gspread 相同：尾端空白不回傳
+        while values and values[-1] == "":
+            values.pop()
+        self._log("col_values", read=len(values))
+        return values
+
+    def get_rows(self, row_numbers):
+        out = []
+        for n in row_numbers:
+            out.append(list(self.rows[n - 1]) if 0 < n <= len(self.rows) else [])
+        self._log("get_rows", read=sum(len(r) for r in out))
+        return out
+
+    def get_all_values(self):
+        self._log("get_all_values", read=sum(len(r) for r in self.rows))
+        return [list(r) for r in self.rows]
+
+    def append_rows(self, rows):
+        self.rows.extend(list(r) for r in rows)
+        self._log("append_rows", written=sum(len(r) for r in rows))
+
+    def delete_rows(self, start, end=None):
+        end = end or start
+        del self.rows[start - 1:end]
+        self._log("delete_rows")
+
+    def update_cells(self, cells):
+        for row, col, value in cells:
+            while len(self.rows) < row:
+                self.rows.append([])
+            target = self.rows[row - 1]
+            while len(target) < col:
+                target.append("")
+            target[col - 1] = value
+        self._log("update_cells", written=len(cells))
+
+
+class GSheetsBackend:
+    """
+    gspread 工作表的薄包裝 (與 iPad.py 相同使用 Service Account 登入)。
+    只暴露 SheetStore 需要的幾個列級操作。
+    """
+
+    def __init__(self, worksheet):
+        self.ws = worksheet
+
+    @classmethod
+    def from_service_account(cls, info, spreadsheet_url, worksheet=None):
+        import gspread
+
+        creds = {k: v for k, v in dict(info).items() if k not in ("spreadsheet", "worksheet")}
+        # 與 iPad.py 相同的 PEM 修復：Secrets 裡的 "\\n" 需還原為真正的換行
+        if "private_key" in creds:
+            creds["private_key"] = str(creds["private_key"]).replace("\\n", "\n")
+        sh = gspread.service_account_from_dict(creds).open_by_url(spreadsheet_url)
+        return cls(sh.worksheet(worksheet) if worksheet else sh.sheet1)
+
+    def get_header(self):
+        return self.ws.row_values(1)
+
+    def set_header(self, columns):
+        self.update_cells([(1, i + 1, c) for i, c in enumerate(columns)])
+
+    def col_values(self, col):
+        return self.ws.col_values(col)
+
+    def get_rows(self, row_numbers):
+        if not row_numbers:
+            return []
+        ranges = self.ws.batch_get([f"{n}:{n}" for n in row_numbers])
+        return [list(r[0]) if r else [] for r in ranges]
+
+    def get_all_values(self):
+        return self.ws.get_all_values()
+
+    def append_rows(self, rows):
+        if rows:
+            self.ws.append_rows(rows, value_input_option="RAW")
+
+    def delete_rows(self, start, end=None):
+        self.ws.delete_rows(start, end or start)
+
+    def update_cells(self, cells):
+        import gspread
+
+        if cells:
+            self.ws.update_cells([gspread.Cell(r, c, v) for r, c, v in cells], value_input_option="RAW")
+
+
+class SheetStore:
+    """
+    以主鍵 (預設 word) 索引的列級儲存：
+    1. 只讀取主鍵欄建立「主鍵 → 列號」索引，不下載整張表。
+    2. sync() 只追加新列、只刪除被強制刷新覆蓋的舊列。
+    3. 刪除前會回讀目標列確認主鍵未被他人改動，避免誤刪；不符時重建索引並重新分類整個批次。
+    """
+
+    def __init__(self, backend, columns, key="word", index_ttl=60, stamp_col=None):
+        self.backend = backend
+        self.columns = list(columns)
+        self.key = key
+        # stamp_col：寫入時自動填入修改時間 (供 SheetDeltaReader 做增量讀取)
+        self.stamp_col = stamp_col
+        if stamp_col and stamp_col not in self.columns:
+            self.columns.append(stamp_col)
+        self.index_ttl = index_ttl
+        self._header = None
+        self._rows_by_key = None
+        self._row_count = 0
+        self._loaded_at = 0
+
+    # --- 索引維護 ---
+    def refresh(self):
+        """重新讀取表頭與主鍵欄 (單欄讀取，成本遠低於整表)"""
+        header = self.backend.get_header()
+        if not header:
+            self.backend.set_header(self.columns)
+            header = list(self.columns)
+        elif any(c not in header for c in self.columns):
+            # 補上缺少的欄位到表頭尾端
+            missing = [c for c in self.columns if c not in header]
+            self.backend.update_cells([(1, len(header) + i + 1, c) for i, c in enumerate(missing)])
+            header = header + missing
+        self._header = header
+
+        keys = self.backend.col_values(header.index(self.key) + 1)
+        self._rows_by_key = {}
+        for row_no, value in enumerate(keys[1:], start=2):
+            if str(value).strip():
+                self._rows_by_key.setdefault(normalize_key(value), []).append(row_no)
+        self._row_count = max(len(keys), 1)
+        self._loaded_at = time.time()
+
+    def _ensure_index(self):
+        if self._rows_by_key is None or time.time() - self._loaded_at > self.index_ttl:
+            self.refresh()
+
+    def contains(self, key):
+        self._ensure_index()
+        return normalize_key(key) in self._rows_by_key
+
+    def __len__(self):
+        self._ensure_index()
+        return sum(len(v) for v in self._rows_by_key.values())
+
+    def get(self, key):
+        """只讀取該主鍵的最後一列 (同主鍵多列時以最後一列為準)；不存在回傳 None"""
+        self._ensure_index()
+        k = normalize_key(key)
+        for attempt in range(2):
+            rows = self._rows_by_key.get(k)
+            if not rows:
+                return None
+            row = self.backend.get_rows([rows[-1]])[0]
+            rec = {c: (row[i] if i < len(row) else "") for i, c in enumerate(self._header)}
+            if normalize_key(rec.get(self.key, "")) == k:
+                return rec
+            if attempt == 0:
+                # 列號已移動 (其他人動過表)，重建索引後再找一次
+                self.refresh()
+        return None
+
+    # --- 寫入 ---
+    def _to_row(self, record, stamp=None):
+        row = [cell_value(record.get(col, "無")) for col in self._header]
+        if self.stamp_col:
+            row[self._header.index(self.stamp_col)] = stamp or make_stamp()
+        return row
+
+    def _verify_rows(self, row_numbers, expected):
+        """回讀待刪列，確認主鍵仍是預期值"""
+        key_idx = self._header.index(self.key)
+        for row, exp in zip(self.backend.get_rows(row_numbers), expected):
+            current = row[key_idx] if len(row) > key_idx else ""
+            if normalize_key(current) != exp:
+                return False
+        return True
+
+    def _delete(self, row_numbers):
+        """由下往上刪除，並把連續列合併為單次 delete_rows 呼叫"""
+        runs = []
+        for n in sorted(row_numbers, reverse=True):
+            if runs and runs[-1][0] == n + 1:
+                runs[-1][0] = n
+            else:
+                runs.append([n, n])
+        for start, end in runs:
+            self.backend.delete_rows(start, end)
+
+        # 更新索引中的列號 (被刪列之後的列往上移)
+        removed = sorted(row_numbers)
+        shifted = {}
+        for k, rows in self._rows_by_key.items():
+            kept = [r - bisect.bisect_left(removed, r) for r in rows if r not in row_numbers]
+            if kept:
+                shifted[k] = kept
+        self._rows_by_key = shifted
+        self._row_count -= len(row_numbers)
+
+    def _plan(self, records, replace):
+        """依目前索引分類這個批次：回傳 (要追加的紀錄, 要刪除的 (列號, 主鍵), 略過筆數)"""
+        to_append, superseded, skipped = [], [], 0
+        seen = set()
+        for rec in records:
+            k = normalize_key(rec.get(self.key, ""))
+            if not k or k in seen:
+                continue
+            seen.add(k)
+            if k in self._rows_by_key:
+                if not replace:
+                    skipped += 1
+                    continue
+                superseded.extend((r, k) for r in self._rows_by_key[k])
+            to_append.append(rec)
+        return to_append, superseded, skipped
+
+    def sync(self, records, replace=False):
+        """
+        同步一個批次的紀錄：
+        1. 不存在的主鍵 → 追加。
+        2. 已存在且 replace=True → 刪除舊列後追加新版本；replace=False → 略過。
+        回傳 {'appended', 'deleted', 'skipped'} 計數。
+        """
+        records = list(records)
+        # 寫入前一律重讀主鍵欄 (單欄)：索引在 TTL 內也可能漏掉別人剛新增的主鍵，沿用會重複追加
+        self.refresh()
+        to_append, superseded, skipped = self._plan(records, replace)
+        if superseded and not self._verify_rows([r for r, _ in superseded], [k for _, k in superseded]):
+            # 索引已過期 (其他人動過表)：重建後整個批次重新分類，
+            # 期間被別人新增的主鍵才會改判為「已存在」，不會再追加一次
+            self.refresh()
+            to_append, superseded, skipped = self._plan(records, replace)
+
+        rows = {r for r, _ in superseded}
+        if rows:
+            self._delete(rows)
+
+        if to_append:
+            stamp = make_stamp()
+            self.backend.append_rows([self._to_row(rec, stamp) for rec in to_append])
+            for rec in to_append:
+                self._row_count += 1
+                self._rows_by_key.setdefault(normalize_key(rec[self.key]), []).append(self._row_count)
+
+        return {"appended": len(to_append), "deleted": len(rows), "skipped": skipped}
+
+
+class SheetDeltaReader:
+    """
+    以 updated_at 時間戳做增量讀取的知識庫讀取器：
+    1. full()：讀整張表，轉成 columns + [stamp_col] 的 DataFrame (主鍵重複時保留最後一列)。
+    2. pull(current)：只讀主鍵欄與時間戳欄，和 current 比對：
+       - 主鍵不在 current、或時間戳不同 → 用 get_rows 只抓這些列
+       - current 有但表上已消失 → 刪除
+       - 沒有任何變動時回傳 current 本身 (呼叫端據此判斷不必更新版本)
+    表頭缺少主鍵或時間戳欄時 pull() 回傳 None，由呼叫端改走 full()。
+    """
+
+    def __init__(self, backend, columns, key="word", stamp_col="updated_at", empty="無"):
+        self.backend = backend
+        self.columns = [c for c in columns if c != stamp_col]
+        self.key = key
+        self.stamp_col = stamp_col
+        self.empty = empty
+        self.last_stats = {}
+
+    @property
+    def out_columns(self):
+        return self.columns + [self.stamp_col]
+
+    def _record(self, header, row):
+        rec = {}
+        for col in self.out_columns:
+            idx = header.index(col) if col in header else -1
+            value = row[idx] if 0 <= idx < len(row) else ""
+            if col == self.stamp_col:
+                rec[col] = str(value).strip()
+            else:
+                rec[col] = value if str(value).strip() else self.empty
+        return rec
+
+    def _frame(self, records):
+        import pandas as pd
+
+        return pd.DataFrame(records, columns=self.out_columns).reset_index(drop=True)
+
+    def full(self):
+        values = self.backend.get_all_values()
+        if not values:
+            return self._frame([])
+        header = values[0]
+        by_key = {}
+        if self.key in header:
+            key_idx = header.index(self.key)
+            for row in values[1:]:
+                k = normalize_key(row[key_idx]) if len(row) > key_idx else ""
+                if k:
+                    # dict 保留第一次出現的位置，值以最後一列為準
+                    by_key[k] = self._record(header, row)
+        self.last_stats = {"mode": "full", "rows": len(by_key), "fetched": len(by_key), "deleted": 0}
+        return self._frame(list(by_key.values()))
+
+    def pull(self, current):
+        header = self.backend.get_header()
+        if self.key not in header or self.stamp_col not in header:
+            return None
+        keys = self.backend.col_values(header.index(self.key) + 1)[1:]
+        stamps = self.backend.col_values(header.index(self.stamp_col) + 1)[1:]
+
+        remote = {}  # 主鍵 → (列號, 時間戳)，同主鍵多列時以最後一列為準
+        for row_no, value in enumerate(keys, start=2):
+            k = normalize_key(value)
+            if k:
+                stamp = stamps[row_no - 2] if row_no - 2 < len(stamps) else ""
+                remote[k] = (row_no, str(stamp).strip())
+
+        local_keys = [normalize_key(v) for v in current[self.key]] if len(current) else []
+        local = dict(zip(local_keys, current[self.stamp_col])) if len(current) else {}
+        changed = [k for k, (_, stamp) in remote.items() if local.get(k) != stamp]
+        deleted = set(local) - set(remote)
+        self.last_stats = {"mode": "delta", "rows": len(remote), "fetched": len(changed), "deleted": len(deleted)}
+        if not changed and not deleted:
+            return current
+
+        fetched = {}
+        if changed:
+            rows = self.backend.get_rows([remote[k][0] for k in changed])
+            for k, row in zip(changed, rows):
+                fetched[k] = self._record(header, row)
+
+        # 依表上的列順序重組：未變動的列沿用本地資料，變動的列用剛抓到的版本
+        kept = {k: i for i, k in enumerate(local_keys) if k in remote and k not in fetched}
+        records = current.to_dict("records")
+        merged = []
+        for k, _ in sorted(remote.items(), key=lambda item: item[1][0]):
+            if k in fetched:
+                merged.append(fetched[k])
+            elif k in kept:
+                merged.append(records[kept[k]])
+        return self._frame(merged)
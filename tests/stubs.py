@@ -0,0 +1,45 @@
+import json
+import threading
+import time
+
+
+class StubModel:
+    """
+    離線測試用的假模型 (DecodePool 的 decode_fn)：
+    1. 延遲 delay 秒 (delays 可依主題個別指定) 後回傳固定 JSON (word 欄位帶入主題)。
+    2. fail_keys 中的 Key 一律回傳 None，可用來測試換 Key 重試。
+    3. calls 紀錄 (topic, key, 開始時間)，方便驗證分派與限速。
+    """
+
+    def __init__(self, payload=None, delay=0.1, delays=None, fail_keys=()):
+        self.payload = payload or {"definition": "stub", "meaning": "stub"}
+        self.delay = delay
+        self.delays = dict(delays or {})
+        self.fail_keys = set(fail_keys)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, topic, key):
+        with self._lock:
+            self.calls.append((topic, key, time.monotonic()))
+        time.sleep(self.delays.get(topic, self.delay))
+        if key in self.fail_keys:
+            return None
+        return json.dumps(dict(self.payload, word=topic), ensure_ascii=False)
+
+
+class StubSynthesizer:
+    """離線測試用合成器 (AudioStore 的 synthesizer)：回傳可辨識的假 MP3 位元組，並紀錄呼叫次數"""
+
+    def __init__(self, delay=0.0, fail_texts=()):
+        self.delay = delay
+        self.fail_texts = set(fail_texts)
+        self.calls = []
+
+    def __call__(self, text, lang="en"):
+        self.calls.append((text, lang))
+        if self.delay:
+            time.sleep(self.delay)
+        if text in self.fail_texts:
+            raise RuntimeError(f"stub TTS failure: {text}")
+        return b"ID3" + f"{lang}:{text}".encode("utf-8")
@@ -0,0 +1,36 @@
+import os
+
+from audio_cache import AudioStore, audio_key, normalize_tts_text
+from stubs import StubSynthesizer
+
+
+def test_normalize_and_key():
+    assert normalize_tts_text("  Entropy (熵)!  ") == "Entropy"
+    assert audio_key("Entropy") == audio_key("entropy ")
+
+
+def test_second_request_hits_disk(tmp_path):
+    synth = StubSynthesizer()
+    store = AudioStore(str(tmp_path), synthesizer=synth)
+    assert store.get_bytes("Gravity") == b"ID3en:Gravity"
+    assert store.get_bytes("gravity") == b"ID3en:Gravity"
+    assert synth.calls == [("Gravity", "en")]
+    # 重啟 (新的 AudioStore) 後仍然命中
+    assert AudioStore(str(tmp_path), synthesizer=synth).contains("gravity")
+
+
+def test_failure_and_empty_text_return_none(tmp_path):
+    store = AudioStore(str(tmp_path), synthesizer=StubSynthesizer(fail_texts={"boom"}))
+    assert store.get_bytes("boom") is None
+    assert store.get_bytes("熵") is None
+    assert store.audio_src("boom", base_url="/app/static/tts") is None
+
+
+def test_url_mode_and_eviction(tmp_path):
+    store = AudioStore(str(tmp_path), max_bytes=60, synthesizer=StubSynthesizer())
+    src = store.audio_src("alpha", base_url="/app/static/tts")
+    assert src == f"/app/static/tts/{audio_key('alpha')}.mp3"
+    for word in ("bravo", "charlie", "delta", "echo", "foxtrot"):
+        store.ensure(word)
+    total = sum(os.path.getsize(os.path.join(tmp_path, n)) for n in os.listdir(tmp_path))
+    assert total <= 60
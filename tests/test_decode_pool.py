@@ -0,0 +1,51 @@
+import json
+import time
+
+import pytest
+
+from decode_pool import DecodePool, RateLimiter
+from stubs import StubModel
+
+
+def test_requires_a_key():
+    with pytest.raises(ValueError):
+        DecodePool([], StubModel())
+
+
+def test_results_keep_input_order():
+    # 先送出的主題最慢完成：結果仍須依輸入順序排列
+    topics = ["a", "b", "c", "d"]
+    model = StubModel(delays={"a": 0.15, "b": 0.1, "c": 0.05, "d": 0.0})
+    progress = []
+    pool = DecodePool(["k1", "k2", "k3", "k4"], model, min_interval=0)
+    results = pool.run(topics, on_progress=lambda done, total, topic, result: progress.append(topic))
+    assert [json.loads(r)["word"] for r in results] == topics
+    assert progress[0] != "a" and sorted(progress) == topics
+
+
+def test_per_key_rate_limit():
+    model = StubModel(delay=0.0)
+    pool = DecodePool(["k1", "k2"], model, min_interval=0.1)
+    pool.run([f"t{i}" for i in range(6)])
+    for key in ("k1", "k2"):
+        started = sorted(t for _, k, t in model.calls if k == key)
+        assert len(started) == 3
+        # 同一把 Key 的相鄰請求至少相隔 min_interval (容許計時誤差)
+        assert all(b - a >= 0.09 for a, b in zip(started, started[1:]))
+
+
+def test_failed_key_is_retried_on_another_key():
+    model = StubModel(delay=0.0, fail_keys={"bad"})
+    pool = DecodePool(["bad", "good"], model, min_interval=0)
+    results = pool.run(["x", "y"])
+    assert [json.loads(r)["word"] for r in results] == ["x", "y"]
+    # 每個主題最後都落在 good，且同一主題不會重複嘗試同一把 Key
+    assert sorted(t for t, k, _ in model.calls if k == "good") == ["x", "y"]
+
+
+def test_rate_limiter_spacing():
+    limiter = RateLimiter(min_interval=0.05)
+    started = time.monotonic()
+    for _ in range(3):
+        limiter.wait()
+    assert time.monotonic() - started >= 0.09
@@ -0,0 +1,43 @@
+import pandas as pd
+
+from facets import FacetIndex, split_domains
+
+
+def _frame(rows):
+    return pd.DataFrame(rows, columns=["word", "category", "roots"])
+
+
+def test_split_composite_categories():
+    assert split_domains("物理科學 + 人工智慧") == ["物理科學", "人工智慧"]
+    assert split_domains("人工智慧＋歷史文明") == ["人工智慧", "歷史文明"]
+    assert split_domains("無") == []
+
+
+def test_domain_rows_and_intersection():
+    df = _frame([("a", "物理 + 化學", "x"), ("b", "物理", "y"), ("c", "化學", "x")])
+    facets = FacetIndex()
+    facets.sync(df)
+    assert facets.domains == ["化學", "物理"]
+    assert facets.rows("物理") == [0, 1]
+    assert facets.intersect(["物理", "化學"]) == [0]
+    assert facets.filter([2, 1, 0], ["化學"]) == [2, 0]
+    assert facets.nunique("roots") == 2
+
+
+def test_reordered_rows_rebuild_positions():
+    # 強制刷新會把覆蓋的列移到表尾：分類內容不變，但列位置變了
+    df = _frame([("a", "物理", "x"), ("b", "化學", "x")])
+    facets = FacetIndex()
+    facets.sync(df)
+    moved = df.iloc[[1, 0]].reset_index(drop=True)
+    facets.sync(moved)
+    assert moved.iloc[facets.rows("物理")]["word"].tolist() == ["a"]
+
+
+def test_identical_copy_keeps_signature():
+    df = _frame([("a", "物理", "x"), ("b", "化學", "y")])
+    facets = FacetIndex()
+    facets.sync(df)
+    signature = facets.signature
+    facets.sync(df.copy())
+    assert facets.signature == signature
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from bench_json_repair import build_corpus, load_corpus
+from json_repair import RepairError, closes_string, loads, repair_json
+
+
+def _restored(got, expected, truncated):
+    """完整的紀錄必須完全還原；截斷的紀錄保留下來的鍵都是原本的前綴 (最後一個鍵可能只收到一半)"""
+    if not truncated:
+        return got == expected
+    keys, want = list(got), list(expected)
+    return (
+        keys[:-1] == want[:len(keys) - 1]
+        and all(got[k] == expected[k] for k in keys[:-1])
+        and (not keys or want[len(keys) - 1].startswith(keys[-1]))
+    )
+
+
+@pytest.fixture(scope="module")
+def records():
+    return load_corpus()
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_corpus_round_trip(records, seed):
+    failures = []
+    for text, expected, truncated in build_corpus(records, seed=seed):
+        try:
+            got = loads(text)
+        except ValueError as e:
+            failures.append((expected.get("word"), str(e)))
+            continue
+        if not _restored(got, expected, truncated):
+            failures.append((expected.get("word"), [k for k in expected if got.get(k) != expected[k]][:3]))
+    assert not failures, failures[:5]
+
+
+def test_valid_json_is_unchanged():
+    text = json.dumps({"a": "x\ny", "b": [1, 2.5, None, True], "c": {"d": "é\"q\""}}, ensure_ascii=False)
+    assert loads(text) == json.loads(text)
+
+
+def test_latex_escapes_are_kept():
+    assert loads(r'{"roots": "$\frac{a}{b} + \beta + \nabla f + \alpha$"}') == {
+        "roots": r"$\frac{a}{b} + \beta + \nabla f + \alpha$"
+    }
+    # 合法逸出不受影響
+    assert loads(r'{"a": "x\ny\tz"}') == {"a": "x\ny\tz"}
+
+
+def test_unescaped_quotes_and_noise():
+    text = '好的：\n```json\n{"word": "他說"重力"是關鍵", "category": "物理",,}\n```\n以上'
+    assert loads(text) == {"word": '他說"重力"是關鍵', "category": "物理"}
+
+
+def test_truncated_output_is_closed():
+    assert loads('{"word": "entropy", "roots": ["en-", "tro') == {"word": "entropy", "roots": ["en-", "tro"]}
+
+
+def test_closes_string_lookahead():
+    text = '"a": "x", "b"'
+    assert closes_string(text, 7, False, "{") is True
+    assert closes_string('"x" y', 2, False, "{") is False
+    assert closes_string('"x", ', 2, False, "{", at_eof=False) is None
+
+
+def test_no_json_raises():
+    with pytest.raises(RepairError):
+        repair_json("沒有任何 JSON")
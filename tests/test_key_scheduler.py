@@ -0,0 +1,61 @@
+import pytest
+
+from key_scheduler import KeyScheduler, classify_error
+
+
+def test_classify_error():
+    assert classify_error(Exception("429 Resource has been exhausted")) == "quota"
+    assert classify_error(Exception("API key not valid")) == "invalid"
+    assert classify_error(Exception("boom")) == "error"
+
+
+def test_call_falls_through_failed_keys():
+    scheduler = KeyScheduler(["a", "b", "c"])
+    errors = []
+
+    def fn(key):
+        if key != "c":
+            raise RuntimeError(f"{key} down")
+        return "ok"
+
+    assert scheduler.call(fn, on_error=lambda key, e: errors.append(key)) == ("ok", None)
+    assert errors == ["a", "b"]
+    # 失敗的 Key 進入冷卻，下次排在最後
+    assert scheduler.candidates() == ["c"]
+
+
+def test_call_none_result_is_not_a_key_failure():
+    scheduler = KeyScheduler(["a", "b"])
+    assert scheduler.call(lambda key: None) == (None, None)
+    assert [h["failures"] for h in scheduler.snapshot()] == [0, 0]
+
+
+def test_call_tries_unregistered_key():
+    scheduler = KeyScheduler(["a"])
+    assert scheduler.call(lambda key: key, keys=["z"]) == ("z", None)
+
+
+def test_attempt_reports_success_and_failure():
+    scheduler = KeyScheduler(["a"])
+    with scheduler.attempt("a"):
+        pass
+    with pytest.raises(ValueError):
+        with scheduler.attempt("a"):
+            raise ValueError("bad")
+    health = scheduler.snapshot()[0]
+    assert (health["successes"], health["failures"]) == (1, 1)
+
+
+def test_attempt_treats_closed_generator_as_success():
+    scheduler = KeyScheduler(["a"])
+
+    def stream():
+        with scheduler.attempt("a"):
+            yield 1
+            yield 2
+
+    gen = stream()
+    next(gen)
+    gen.close()
+    health = scheduler.snapshot()[0]
+    assert (health["successes"], health["failures"]) == (1, 0)
@@ -0,0 +1,40 @@
+import random
+
+import pandas as pd
+
+from sampler import DrawHistory, _Bag, get_sampler
+
+
+def _frame(words, category="物理"):
+    return pd.DataFrame({"word": words, "category": [category] * len(words), "roots": ["x"] * len(words)})
+
+
+def test_bag_draws_every_position_once():
+    rng = random.Random(1)
+    bag = _Bag(10, exclude=[3, 7])
+    drawn = [bag.draw(rng) for _ in range(bag.remaining)]
+    assert sorted(drawn) == [0, 1, 2, 4, 5, 6, 8, 9]
+
+
+def test_history_does_not_repeat_within_a_round():
+    df = _frame(list("abcdef"))
+    history = DrawHistory()
+    sampler = get_sampler("test_round", df)
+    rng = random.Random(2)
+    seen = [p for _ in range(3) for p in sampler.draw(2, history=history, rng=rng)]
+    assert sorted(seen) == list(range(6))
+
+
+def test_reordered_rows_reset_history():
+    # 分類與字根都相同、只有列順序不同：舊洗牌袋的位置不能沿用
+    df = _frame(list("abcd"))
+    history = DrawHistory()
+    rng = random.Random(3)
+    get_sampler("test_reorder", df).draw(2, history=history, rng=rng)
+    signature = history.signature
+
+    moved = df.iloc[::-1].reset_index(drop=True)
+    sampler = get_sampler("test_reorder", moved)
+    sampler.draw(1, history=history, rng=rng)
+    assert sampler.signature != signature
+    assert history.signature == sampler.signature
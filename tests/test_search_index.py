@@ -0,0 +1,105 @@
+import threading
+
+import pandas as pd
+
+from search_index import FuzzyIndex, SearchIndex, edit_distance, tokenize
+
+
+def _frame(rows):
+    return pd.DataFrame(rows, columns=["word", "category", "definition", "roots"])
+
+
+DOCS = [
+    ("gravity", "物理科學", "重力場讓物體互相吸引", "grav- (重)"),
+    ("gravitation", "物理科學", "萬有引力", "grav- (重) + -ation"),
+    ("nation", "社會科學", "國家", "nat- (出生)"),
+]
+
+
+def test_tokenize_cjk_bigrams():
+    assert tokenize("重力場", query=True) == ["重力", "力場"]
+    assert "重" in tokenize("重力場")
+
+
+def test_search_prefix_and_ranking():
+    index = SearchIndex()
+    index.sync(_frame(DOCS))
+    assert index.search("gravity")[0] == 0
+    assert set(index.search("grav")) == {0, 1}
+    assert index.search("重力場") == [0]
+
+
+def test_search_sync_updates_changed_rows_only():
+    index = SearchIndex()
+    index.sync(_frame(DOCS))
+    changed = _frame(DOCS[:2] + [("nation", "社會科學", "民族", "nat- (出生)")])
+    assert index.sync(changed) == {"added": 0, "updated": 1, "removed": 0, "docs": 3}
+
+
+def test_fuzzy_suggest_and_copy_reuses_index():
+    df = _frame(DOCS)
+    index = FuzzyIndex(fields=("word", "roots"))
+    index.sync(df)
+    assert index.suggest("gravty", k=1)[0][:2] == (0, "gravity")
+    grams = index._grams
+    index.sync(df.copy())
+    assert index._grams is grams
+
+
+def test_fuzzy_reordered_rows_rebuild():
+    df = _frame(DOCS)
+    index = FuzzyIndex()
+    index.sync(df)
+    moved = df.iloc[::-1].reset_index(drop=True)
+    index.sync(moved)
+    pos = index.suggest("nation", k=1)[0][0]
+    assert moved.iloc[pos]["word"] == "nation"
+
+
+def test_edit_distance_limit():
+    assert edit_distance("kitten", "sitting") == 3
+    assert edit_distance("a", "abcdef", limit=2) == 3
+
+
+def test_search_substring_mode():
+    index = SearchIndex()
+    index.sync(_frame(DOCS))
+    assert index.search("tion") == []
+    assert set(index.search("tion", substring=True)) == {1, 2}
+    assert set(index.search("avit", substring=True)) == {0, 1}
+
+
+def test_duplicate_words_are_separate_documents():
+    df = _frame(DOCS + [("gravity", "天文", "黑洞附近的重力", "grav- (重)")])
+    index = SearchIndex()
+    assert index.sync(df)["docs"] == 4
+    assert sorted(index.search("gravity")) == [0, 3]
+    assert index.search("黑洞") == [3]
+    # 內容沒變的同名列不會每次同步都被重新索引
+    assert index.sync(df.copy()) == {"added": 0, "updated": 0, "removed": 0, "docs": 4}
+
+
+def test_search_during_concurrent_sync():
+    rows = [(f"grav{i}", "物理", f"定義 {i}", "grav-") for i in range(400)]
+    frames = [_frame(rows[k:] + rows[:k]) if k % 2 else _frame(rows[: 400 - k]) for k in range(14)]
+    index = SearchIndex()
+    index.sync(frames[0])
+    errors, done = [], threading.Event()
+
+    def reader():
+        while not done.is_set():
+            try:
+                index.search("grav")
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for df in frames[1:]:
+        index.sync(df)
+    done.set()
+    for t in threads:
+        t.join()
+    assert not errors
@@ -0,0 +1,64 @@
+from sheet_store import FakeSheetsBackend, SheetStore
+
+COLUMNS = ["word", "category", "definition"]
+
+
+def _store(*rows):
+    backend = FakeSheetsBackend([COLUMNS] + [list(r) for r in rows])
+    return backend, SheetStore(backend, COLUMNS)
+
+
+def _words(backend):
+    return [r[0] for r in backend.rows[1:]]
+
+
+def test_append_only_new_keys():
+    backend, store = _store(("gravity", "物理", "舊"))
+    result = store.sync([{"word": "Gravity", "definition": "新"}, {"word": "entropy"}, {"word": "entropy"}])
+    assert result == {"appended": 1, "deleted": 0, "skipped": 1}
+    assert _words(backend) == ["gravity", "entropy"]
+    assert backend.rows[2] == ["entropy", "無", "無"]
+    # 追加只寫新列，不會讀整張表
+    assert "get_all_values" not in backend.calls
+
+
+def test_replace_moves_new_version_to_the_end():
+    backend, store = _store(("gravity", "物理", "舊"), ("entropy", "物理", "熵"), ("nation", "社會", "國家"))
+    result = store.sync([{"word": "gravity", "category": "物理", "definition": "新"}], replace=True)
+    assert result == {"appended": 1, "deleted": 1, "skipped": 0}
+    assert _words(backend) == ["entropy", "nation", "gravity"]
+    assert backend.rows[-1][2] == "新"
+    assert store.get("gravity")["definition"] == "新"
+
+
+class RacingBackend(FakeSheetsBackend):
+    """第一次回讀待刪列之前，模擬另一個 Session 動過表 (刪掉第一列、新增 nation)"""
+
+    def get_rows(self, row_numbers):
+        if not getattr(self, "raced", False):
+            self.raced = True
+            del self.rows[1]
+            self.rows.append(["nation", "社會", "別人寫的"])
+        return super().get_rows(row_numbers)
+
+
+def test_concurrent_edit_replans_after_refresh():
+    backend = RacingBackend([COLUMNS, ["gravity", "物理", "舊"], ["entropy", "物理", "熵"]])
+    store = SheetStore(backend, COLUMNS)
+
+    # entropy 的列號在驗證前移動 → 重建索引後重新分類：nation 已被別人新增，不再當成新主鍵追加
+    result = store.sync([{"word": "entropy", "definition": "新"}, {"word": "nation", "definition": "新"}], replace=True)
+    assert result == {"appended": 2, "deleted": 2, "skipped": 0}
+    assert _words(backend) == ["entropy", "nation"]
+    assert [r[2] for r in backend.rows[1:]] == ["新", "新"]
+
+
+def test_concurrent_add_is_not_duplicated_without_replace():
+    backend, store = _store(("gravity", "物理", "舊"))
+    store.refresh()
+    # 索引建立後 (TTL 內) 別人新增了 nation
+    backend.rows.append(["nation", "社會", "別人寫的"])
+
+    result = store.sync([{"word": "nation"}, {"word": "entropy"}])
+    assert result == {"appended": 1, "deleted": 0, "skipped": 1}
+    assert _words(backend) == ["gravity", "nation", "entropy"]
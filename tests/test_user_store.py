@@ -0,0 +1,66 @@
+import pytest
+
+from sheet_store import FakeSheetsBackend
+from user_store import SheetUserStore, SQLiteUserStore, VersionConflict, update_with_retry
+
+
+class RacingBackend(FakeSheetsBackend):
+    """第一次寫入後，模擬另一個行程 (同樣讀到舊版本) 立刻覆寫同一列的同一個版本號"""
+
+    def __init__(self, rows=None):
+        super().__init__(rows)
+        self.raced = False
+
+    def update_cells(self, cells):
+        super().update_cells(cells)
+        if not self.raced and len(cells) > 1:
+            self.raced = True
+            header = self.rows[0]
+            other = []
+            for row, col, value in cells:
+                name = header[col - 1]
+                if name == "ai_usage":
+                    value = "7"
+                elif name == "write_token":
+                    value = "other-writer"
+                other.append((row, col, value))
+            super().update_cells(other)
+
+
+def _store(backend_cls=FakeSheetsBackend):
+    store = SheetUserStore(backend_cls())
+    assert store.create({"username": "amy", "password": "x", "ai_usage": 10})
+    return store
+
+
+def test_create_get_update():
+    store = _store()
+    assert not store.create({"username": "amy"})
+    rec = store.update("amy", {"ai_usage": 9}, expected_version=0)
+    assert (rec["ai_usage"], rec["version"]) == ("9", 1)
+    assert store.get("amy")["ai_usage"] == "9"
+    with pytest.raises(VersionConflict):
+        store.update("amy", {"ai_usage": 8}, expected_version=0)
+    assert store.update("nobody", {"ai_usage": 1}) is None
+
+
+def test_same_version_written_by_another_writer_is_detected():
+    # 兩個寫入者都從 v0 寫成 v1：只比對版本號會兩邊都通過，另一份的 ai_usage 就被默默蓋掉
+    store = _store(RacingBackend)
+    with pytest.raises(VersionConflict):
+        store.update("amy", {"ai_usage": 9}, expected_version=0)
+    assert store.get("amy")["ai_usage"] == "7"
+
+
+def test_retry_after_conflict():
+    store = _store(RacingBackend)
+    rec = update_with_retry(store, "amy", {"is_online": "TRUE"})
+    assert (rec["is_online"], rec["version"]) == ("TRUE", 2)
+
+
+def test_sqlite_store_version_check(tmp_path):
+    store = SQLiteUserStore(str(tmp_path / "users.sqlite3"))
+    assert store.create({"username": "amy", "ai_usage": 10})
+    assert store.update("amy", {"ai_usage": 9}, expected_version=0)["version"] == 1
+    with pytest.raises(VersionConflict):
+        store.update("amy", {"ai_usage": 8}, expected_version=0)
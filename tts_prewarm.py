@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from audio_cache import DEFAULT_AUDIO_DIR, get_audio_store, normalize_tts_text
+
+# ==========================================
+# TTS 預熱工作 (命令列)
+# ==========================================
+# 冷快取時，首頁卡片與百科頁會卡在 gTTS 請求上。
+# 這支工具把知識庫裡所有 word 預先合成到 audio_cache，之後頁面只讀磁碟：
+#   python tts_prewarm.py                 # 讀 master_db.json
+#   python tts_prewarm.py --sheet         # 讀 Google Sheet (Sheet2，使用 .streamlit/secrets.toml)
+#   python tts_prewarm.py --words a b c   # 只處理指定單字 (merge.py --prewarm 會用到)
+# 已存在於快取的單字直接略過，因此可以重複、增量執行。
+
+MASTER_DB_FILE = "master_db.json"
+SECRETS_FILE = os.path.join(".streamlit", "secrets.toml")
+
+
+def load_master_words(path=MASTER_DB_FILE):
+    """
+    讀取 master_db.json 的單字：
+    相容 merge.py 寫出的 {word: record} 與舊版的 [{word: record}] / [record, ...] 兩種格式。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    blocks = data if isinstance(data, list) else [data]
+    words = []
+    for block in blocks:
+        if not isinstance(block, dict):
+            continue
+        if "word" in block and not isinstance(block.get("word"), dict):
+            words.append(block["word"])
+            continue
+        for key, record in block.items():
+            words.append(record.get("word", key) if isinstance(record, dict) else key)
+    return words
+
+
+def load_sheet_words(secrets_path=SECRETS_FILE, worksheet="Sheet2"):
+    """透過 Service Account 只讀取 Sheet2 的 word 欄 (與 app.py get_sheet_store 同一組憑證)"""
+    import tomllib
+
+    from sheet_store import GSheetsBackend
+
+    with open(secrets_path, "rb") as f:
+        secrets = tomllib.load(f)
+    creds = secrets["connections"]["gsheets"]
+    backend = GSheetsBackend.from_service_account(creds, creds["spreadsheet"], worksheet=worksheet)
+    header = backend.get_header()
+    if "word" not in header:
+        return []
+    return backend.col_values(header.index("word") + 1)[1:]
+
+
+def prewarm(words, store=None, workers=4, retries=3, backoff=2.0, lang="en", verbose=True):
+    """
+    把 words 中尚未快取的單字合成進 audio_cache：
+    - workers：同時進行的 gTTS 請求數 (gTTS 無官方額度，保守一點避免被擋)。
+    - retries：單字失敗時的重試次數，每次等待 backoff * 2^n 秒。
+    回傳 {'total', 'cached', 'created', 'failed'}，failed 為失敗的單字列表。
+    """
+    store = store or get_audio_store()
+
+    # 去重 (以正規化後文字為準)，並排除已快取的單字
+    unique = {}
+    for w in words:
+        clean = normalize_tts_text(w)
+        if clean and clean.lower() not in unique:
+            unique[clean.lower()] = clean
+    todo = [w for w in unique.values() if not store.contains(w, lang)]
+    stats = {"total": len(unique), "cached": len(unique) - len(todo), "created": 0, "failed": []}
+    if verbose:
+        print(f"🔊 共 {stats['total']} 個單字，已快取 {stats['cached']}，待合成 {len(todo)}")
+    if not todo:
+        return stats
+
+    def work(word):
+        for attempt in range(retries + 1):
+            try:
+                store.ensure(word, lang)
+                return True
+            except Exception as e:
+                if attempt == retries:
+                    print(f"❌ {word}: {e}")
+                    return False
+                time.sleep(backoff * (2 ** attempt))
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(work, w): w for w in todo}
+        for done, fut in enumerate(as_completed(futures), start=1):
+            word = futures[fut]
+            if fut.result():
+                stats["created"] += 1
+            else:
+                stats["failed"].append(word)
+            if verbose and (done % 20 == 0 or done == len(todo)):
+                print(f"  [{done}/{len(todo)}] {word}  ({time.time() - started:.0f}s)")
+
+    if verbose:
+        print(f"✅ 新增 {stats['created']} 筆，失敗 {len(stats['failed'])} 筆")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="預先合成知識庫單字的 TTS 音檔")
+    parser.add_argument("--db", default=MASTER_DB_FILE, help="master_db.json 路徑")
+    parser.add_argument("--sheet", action="store_true", help="改從 Google Sheet (Sheet2) 讀取單字")
+    parser.add_argument("--words", nargs="*", help="只處理指定單字")
+    parser.add_argument("--audio-dir", default=DEFAULT_AUDIO_DIR, help="音訊快取目錄")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.words:
+        words = args.words
+    elif args.sheet:
+        words = load_sheet_words()
+    else:
+        words = load_master_words(args.db)
+
+    stats = prewarm(words, store=get_audio_store(args.audio_dir), workers=args.workers, retries=args.retries)
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from sheet_store import cell_value
+
+# ==========================================
+# 用戶資料庫 (列級操作 + 樂觀鎖)
+# ==========================================
+# app4 舊版的 load_user_db / save_user_to_db / update_user_status 每次都 conn.read 整張 users 表，
+# 改一格再 conn.update 整張寫回；班級人數一多登入就變慢，兩人同時登入還會互相蓋掉 is_online。
+# 這裡提供同一組介面的兩種實作：
+#   - SheetUserStore：記憶體內 username → 列號索引，只讀寫單一列
+#   - SQLiteUserStore：本地 SQLite，離線測試用
+# 每列帶 version 欄位：update() 可指定 expected_version，版本不符時拋出 VersionConflict。
+# 試算表沒有原子性的比較後寫入：兩個行程 (app4 / app5 共用同一張表) 可能同時讀到 v5、各自寫入 v6，
+# 只比對版本號兩邊都會通過。因此每次寫入另外帶一個隨機的 write_token，回讀時確認是自己寫的那一份。
+
+USER_COLUMNS = ['username', 'password', 'role', 'membership', 'ai_usage', 'is_online', 'last_seen', 'created_at', 'credit_batch', 'version', 'write_token']
+
+DEFAULTS = {"membership": "free", "ai_usage": 0, "version": 0, "write_token": ""}
+
+
+class VersionConflict(Exception):
+    """樂觀鎖衝突：這一列在讀取後已被其他 Session 修改"""
+
+
+def _version(record):
+    try:
+        return int(float(record.get("version") or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _with_defaults(record):
+    rec = {c: DEFAULTS.get(c, "無") for c in USER_COLUMNS}
+    rec.update({k: v for k, v in record.items() if v not in (None, "")})
+    rec["version"] = _version(rec)
+    return rec
+
+
+class SheetUserStore:
+    """
+    以 gspread 工作表 (或 FakeSheetsBackend) 為後端的用戶庫：
+    - get()：索引查列號 → 只讀那一列，並確認 username 未被移動 (否則重建索引再查一次)。
+    - create()：username 已存在回傳 False，否則 append 一列。
+    - update()：回讀目前列 → 檢查版本 → 只寫變動的格子、version+1 與本次的 write_token
+      → 回讀確認版本與 write_token 都是自己的 (沒有被同時覆寫)。
+    """
+
+    def __init__(self, backend, index_ttl=300):
+        self.backend = backend
+        self.index_ttl = index_ttl
+        self._lock = threading.Lock()
+        self._header = None
+        self._rows = None
+        self._row_count = 0
+        self._loaded_at = 0
+
+    # --- 索引 ---
+    def refresh(self):
+        header = self.backend.get_header()
+        if not header:
+            self.backend.set_header(USER_COLUMNS)
+            header = list(USER_COLUMNS)
+        elif any(c not in header for c in USER_COLUMNS):
+            missing = [c for c in USER_COLUMNS if c not in header]
+            self.backend.update_cells([(1, len(header) + i + 1, c) for i, c in enumerate(missing)])
+            header = header + missing
+        self._header = header
+        names = self.backend.col_values(header.index("username") + 1)
+        self._rows = {}
+        for row_no, name in enumerate(names[1:], start=2):
+            if name and name not in self._rows:
+                self._rows[name] = row_no
+        self._row_count = max(len(names), 1)
+        self._loaded_at = time.time()
+
+    def _ensure_index(self):
+        if self._rows is None or time.time() - self._loaded_at > self.index_ttl:
+            self.refresh()
+
+    def _read_row(self, username):
+        """回傳 (列號, 紀錄)；找不到回傳 (None, None)"""
+        for attempt in range(2):
+            row_no = self._rows.get(username)
+            if row_no is not None:
+                row = self.backend.get_rows([row_no])[0]
+                rec = {c: (row[i] if i < len(row) else "") for i, c in enumerate(self._header)}
+                if rec.get("username") == username:
+                    return row_no, _with_defaults(rec)
+            if attempt == 0:
+                # 索引過期 (有人新增或刪除了列)，重建後再找一次
+                self.refresh()
+        return None, None
+
+    # --- 介面 ---
+    def get(self, username):
+        if not username:
+            return None
+        with self._lock:
+            self._ensure_index()
+            return self._read_row(username)[1]
+
+    def create(self, record):
+        username = record.get("username")
+        if not username:
+            return False
+        with self._lock:
+            self.refresh()  # 註冊不常發生，用最新索引確認帳號沒有重複
+            if username in self._rows:
+                return False
+            rec = _with_defaults(dict({"created_at": time.strftime("%Y-%m-%d")}, **record))
+            self.backend.append_rows([[cell_value(rec.get(c, "")) for c in self._header]])
+            self._row_count += 1
+            self._rows[username] = self._row_count
+            return True
+
+    def update(self, username, changes, expected_version=None):
+        """更新指定欄位並回傳新紀錄；找不到用戶回傳 None，版本不符拋出 VersionConflict"""
+        with self._lock:
+            self._ensure_index()
+            row_no, current = self._read_row(username)
+            if current is None:
+                return None
+            if expected_version is not None and current["version"] != expected_version:
+                raise VersionConflict(f"{username}: expected v{expected_version}, found v{current['version']}")
+
+            new_version = current["version"] + 1
+            token = uuid.uuid4().hex[:12]
+            changes = dict(changes, version=new_version, write_token=token)
+            cells = []
+            for col, value in changes.items():
+                if col not in self._header:
+                    continue
+                cells.append((row_no, self._header.index(col) + 1, cell_value(value)))
+            self.backend.update_cells(cells)
+
+            # 試算表沒有原子性的比較後寫入；回讀確認版本與 write_token，
+            # 另一個寫入者同樣從 v{n} 寫成 v{n+1} 時 token 不同，這裡就會發現
+            _, written = self._read_row(username)
+            if written is None or written["version"] != new_version or written["write_token"] != token:
+                raise VersionConflict(f"{username}: concurrent write detected")
+            return written
+
+
+class SQLiteUserStore:
+    """本地 SQLite 實作 (離線測試 / 單機部署)；版本檢查以 UPDATE ... WHERE version = ? 原子完成"""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        cols = ", ".join(f"{c} TEXT" for c in USER_COLUMNS if c not in ("username", "version"))
+        with self._connect() as db:
+            db.execute(f"CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, {cols}, version INTEGER NOT NULL DEFAULT 0)")
+            # 舊版資料庫缺少的欄位自動補上
+            existing = {row["name"] for row in db.execute("PRAGMA table_info(users)")}
+            for c in USER_COLUMNS:
+                if c not in existing:
+                    db.execute(f"ALTER TABLE users ADD COLUMN {c} TEXT")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    def get(self, username):
+        if not username:
+            return None
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return _with_defaults(dict(row)) if row else None
+
+    def create(self, record):
+        if not record.get("username"):
+            return False
+        rec = _with_defaults(dict({"created_at": time.strftime("%Y-%m-%d")}, **record))
+        placeholders = ", ".join("?" for _ in USER_COLUMNS)
+        values = [rec.get(c) if c == "version" else cell_value(rec.get(c, "")) for c in USER_COLUMNS]
+        try:
+            with self._connect() as db:
+                db.execute(f"INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES ({placeholders})", values)
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def update(self, username, changes, expected_version=None):
+        cols = [c for c in changes if c in USER_COLUMNS and c not in ("username", "version")]
+        with self._connect() as db:
+            row = db.execute("SELECT version FROM users WHERE username = ?", (username,)).fetchone()
+            if row is None:
+                return None
+            version = row["version"] if expected_version is None else expected_version
+            assignments = "".join(f"{c} = ?, " for c in cols)
+            cur = db.execute(
+                f"UPDATE users SET {assignments}version = version + 1 WHERE username = ? AND version = ?",
+                [cell_value(changes[c]) for c in cols] + [username, version],
+            )
+            if cur.rowcount == 0:
+                raise VersionConflict(f"{username}: expected v{version}")
+        return self.get(username)
+
+
+def update_with_retry(store, username, changes, retries=3):
+    """
+    不需要比對舊值的更新 (例如 is_online / last_seen) 用這個：
+    遇到 VersionConflict 時重新讀取後再寫一次，最多 retries 次。
+    """
+    for attempt in range(retries):
+        try:
+            return store.update(username, changes)
+        except VersionConflict:
+            if attempt == retries - 1:
+                raise
+            time.sleep(0.2 * (attempt + 1))
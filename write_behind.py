@@ -0,0 +1,377 @@
+import atexit
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from sheet_store import cell_value, normalize_key
+
+# ==========================================
+# 計數器寫回緩衝 (Write-behind Metrics)
+# ==========================================
+# 舊版 log_user_intent 每次點擊都在使用者的請求中：
+#   conn.read(metrics, ttl=0) → 計數 +1 → conn.update 整張 metrics 寫回
+# 不但把 Sheets 延遲放在 UI 執行緒上，兩個 Session 同時點擊時後寫的會蓋掉先寫的 (lost update)。
+# 這裡改成：
+#   - incr() 只在記憶體累加並追加一行到本地 journal (重啟後可重放)，立即返回
+#   - 背景執行緒每 interval 秒把累積的「增量」一次送出
+#   - MetricsSheetSink 寫入前才讀取受影響的列，以「目前值 + 增量」只更新那幾格，
+#     不再整表覆寫；同一行程內所有 Session 共用一個緩衝，寫入天然序列化
+#
+# 報錯 / 建議回報 (ReportQueue) 也是同樣的問題：submit_report 每次都讀整本回報試算表再整本寫回。
+# 改成 SQLite 持久化佇列 + 背景批次 append_rows，同一單字在時間窗內重複回報只記一次，
+# 送出失敗依指數退避重試。
+
+DEFAULT_JOURNAL_DIR = ".cache"
+
+
+class MetricsBuffer:
+    """
+    記憶體計數緩衝：
+    - flush_fn(deltas) 接收 {label: {"count": n, "last_updated": ts}}，失敗時拋出例外 (增量會保留重試)。
+    - journal_path：未送出的增量以 JSON Lines 記錄，行程重啟時重放。
+    - interval：背景送出的間隔秒數。
+    """
+
+    def __init__(self, flush_fn, journal_path=None, interval=30.0):
+        self.flush_fn = flush_fn
+        self.journal_path = journal_path
+        self.interval = interval
+        self.flushed = 0
+        self.last_error = ""
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._atexit = False
+        if journal_path:
+            if os.path.dirname(journal_path):
+                os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+            self._replay()
+
+    # --- journal ---
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 寫到一半被中斷的最後一行
+                self._add(entry["label"], entry.get("n", 1), entry.get("ts", ""))
+
+    def _rewrite_journal(self):
+        """送出成功後，journal 只保留尚未送出的增量"""
+        if not self.journal_path:
+            return
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for label, d in self._pending.items():
+                f.write(json.dumps({"label": label, "n": d["count"], "ts": d["last_updated"]}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.journal_path)
+
+    # --- 累加 ---
+    def _add(self, label, n, ts):
+        d = self._pending.setdefault(label, {"count": 0, "last_updated": ts})
+        d["count"] += n
+        d["last_updated"] = max(d["last_updated"], ts)
+
+    def incr(self, label, n=1):
+        """累加計數 (非阻塞)；第一次呼叫時啟動背景送出執行緒"""
+        if not label:
+            return
+        ts = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self._add(label, n, ts)
+            if self.journal_path:
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"label": label, "n": n, "ts": ts}, ensure_ascii=False) + "\n")
+        self.start()
+
+    def pending(self):
+        with self._lock:
+            return {k: dict(v) for k, v in self._pending.items()}
+
+    # --- 送出 ---
+    def flush(self):
+        """把目前累積的增量送出；失敗時併回緩衝等下次重試。回傳送出的標籤數"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                self.flush_fn(batch)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"⚠️ Metrics flush failed ({len(batch)} labels): {e}")
+                with self._lock:
+                    for label, d in batch.items():
+                        self._add(label, d["count"], d["last_updated"])
+                return 0
+            with self._lock:
+                self._rewrite_journal()
+            self.flushed += len(batch)
+            self.last_error = ""
+            return len(batch)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="metrics-write-behind", daemon=True)
+            self._thread.start()
+            if not self._atexit:
+                # 行程正常結束時盡量把剩下的增量送出 (送不出去也還在 journal 裡)
+                atexit.register(self.flush)
+                self._atexit = True
+
+    def wake(self):
+        """要求背景執行緒立即送出 (不等待結果)"""
+        self._wake.set()
+
+
+class MetricsSheetSink:
+    """
+    把增量寫進 metrics 工作表 (label / count / last_updated)：
+    1. 只讀 label 欄找出受影響的列，再回讀這些列的目前 count。
+    2. 以 update_cells 寫入「目前值 + 增量」，新標籤以 append_rows 追加。
+    backend_factory 在第一次送出時才建立連線 (在背景執行緒，不占用 UI)。
+    """
+
+    COLUMNS = ["label", "count", "last_updated"]
+
+    def __init__(self, backend_factory):
+        self.backend_factory = backend_factory
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self.backend_factory()
+        return self._backend
+
+    def __call__(self, deltas):
+        backend = self.backend
+        header = backend.get_header()
+        if not header:
+            backend.set_header(self.COLUMNS)
+            header = list(self.COLUMNS)
+        elif any(c not in header for c in self.COLUMNS):
+            missing = [c for c in self.COLUMNS if c not in header]
+            backend.update_cells([(1, len(header) + i + 1, c) for i, c in enumerate(missing)])
+            header = header + missing
+        label_col = header.index("label") + 1
+        count_col = header.index("count") + 1
+        ts_col = header.index("last_updated") + 1
+
+        rows = {}
+        for row_no, value in enumerate(backend.col_values(label_col)[1:], start=2):
+            if value and value not in rows:
+                rows[value] = row_no
+
+        existing = [label for label in deltas if label in rows]
+        cells = []
+        if existing:
+            for label, row in zip(existing, backend.get_rows([rows[l] for l in existing])):
+                try:
+                    current = int(float(row[count_col - 1])) if len(row) >= count_col and row[count_col - 1] else 0
+                except ValueError:
+                    current = 0
+                cells.append((rows[label], count_col, current + deltas[label]["count"]))
+                cells.append((rows[label], ts_col, deltas[label]["last_updated"]))
+            backend.update_cells(cells)
+
+        new_rows = []
+        for label, d in deltas.items():
+            if label in rows:
+                continue
+            row = [""] * len(header)
+            row[label_col - 1], row[count_col - 1], row[ts_col - 1] = label, d["count"], d["last_updated"]
+            new_rows.append(row)
+        if new_rows:
+            backend.append_rows(new_rows)
+
+
+class RowAppendSink:
+    """
+    把一批 dict 追加到工作表尾端：表頭缺少的欄位自動補上，列表/字典欄位以 JSON 保存。
+    backend_factory 在第一次送出時才建立連線。
+    """
+
+    def __init__(self, backend_factory):
+        self.backend_factory = backend_factory
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self.backend_factory()
+        return self._backend
+
+    def __call__(self, records):
+        backend = self.backend
+        header = backend.get_header()
+        missing = list(dict.fromkeys(k for rec in records for k in rec if k not in header))
+        if missing:
+            if header:
+                backend.update_cells([(1, len(header) + i + 1, c) for i, c in enumerate(missing)])
+            else:
+                backend.set_header(missing)
+            header = header + missing
+        backend.append_rows([[cell_value(rec[c]) if c in rec else "" for c in header] for rec in records])
+
+
+class ReportQueue:
+    """
+    持久化回報佇列 (SQLite)：
+    - enqueue()：寫入本地佇列後立即返回；dedup_window 秒內同一 dedup_key 已回報過則略過並回傳 False。
+    - 背景執行緒每 interval 秒取出到期的回報，一次最多 batch_size 筆交給 sink(records) 追加。
+    - 送出失敗：attempts +1，下次嘗試時間依 base_backoff * 2^attempts 退避 (上限 max_backoff)。
+    - 已送出的紀錄保留到去重時間窗結束後才清除。
+    """
+
+    def __init__(self, sink, path, interval=10.0, dedup_window=600.0, batch_size=50,
+                 base_backoff=5.0, max_backoff=600.0):
+        self.sink = sink
+        self.path = path
+        self.interval = interval
+        self.dedup_window = dedup_window
+        self.batch_size = batch_size
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.last_error = ""
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS reports ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, dedup_key TEXT NOT NULL, payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL, sent_at REAL, attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt_at REAL NOT NULL DEFAULT 0)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_reports_dedup ON reports(dedup_key, created_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    def enqueue(self, record, dedup_key=None):
+        """加入佇列；時間窗內重複回報回傳 False"""
+        key = normalize_key(dedup_key if dedup_key is not None else record.get("word", ""))
+        now = time.time()
+        with self._lock, self._connect() as db:
+            dup = db.execute(
+                "SELECT 1 FROM reports WHERE dedup_key = ? AND created_at > ? LIMIT 1",
+                (key, now - self.dedup_window),
+            ).fetchone()
+            if dup:
+                return False
+            db.execute(
+                "INSERT INTO reports (dedup_key, payload, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(record, ensure_ascii=False, default=str), now),
+            )
+        self.start()
+        self._wake.set()  # 有新回報時盡快送出 (仍是背景執行)
+        return True
+
+    def pending_count(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM reports WHERE sent_at IS NULL").fetchone()[0]
+
+    def flush(self):
+        """送出一批到期的回報，回傳送出筆數"""
+        now = time.time()
+        with self._lock, self._connect() as db:
+            rows = db.execute(
+                "SELECT id, payload, attempts FROM reports WHERE sent_at IS NULL AND next_attempt_at <= ?"
+                " ORDER BY id LIMIT ?",
+                (now, self.batch_size),
+            ).fetchall()
+            # 清掉已送出且超過去重時間窗的紀錄
+            db.execute("DELETE FROM reports WHERE sent_at IS NOT NULL AND created_at < ?", (now - self.dedup_window,))
+        if not rows:
+            return 0
+
+        try:
+            self.sink([json.loads(payload) for _, payload, _ in rows])
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"⚠️ Report flush failed ({len(rows)} reports): {e}")
+            with self._lock, self._connect() as db:
+                for rid, _, attempts in rows:
+                    delay = min(self.base_backoff * (2 ** attempts), self.max_backoff)
+                    db.execute(
+                        "UPDATE reports SET attempts = ?, next_attempt_at = ? WHERE id = ?",
+                        (attempts + 1, now + delay, rid),
+                    )
+            return 0
+
+        with self._lock, self._connect() as db:
+            db.executemany("UPDATE reports SET sent_at = ? WHERE id = ?", [(now, rid) for rid, _, _ in rows])
+        self.last_error = ""
+        return len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            # 一次把所有到期的批次送完
+            while self.flush() >= self.batch_size:
+                pass
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="report-queue", daemon=True)
+                self._thread.start()
+
+
+_BUFFERS = {}
+_BUFFERS_LOCK = threading.Lock()
+
+
+def get_metrics_buffer(name, flush_fn, interval=30.0, journal_dir=DEFAULT_JOURNAL_DIR):
+    """取得行程內共用的計數緩衝 (每個 App 一份 journal，避免多個 App 重放同一份檔案)"""
+    with _BUFFERS_LOCK:
+        buf = _BUFFERS.get(name)
+        if buf is None:
+            journal = os.path.join(journal_dir, f"metrics_{name}.jsonl")
+            buf = _BUFFERS[name] = MetricsBuffer(flush_fn, journal_path=journal, interval=interval)
+            if buf.pending():
+                buf.start()  # 有上次沒送出的增量，立即啟動背景送出
+        return buf
+
+
+def get_report_queue(name, sink, journal_dir=DEFAULT_JOURNAL_DIR, **kwargs):
+    """取得行程內共用的回報佇列；佇列裡還有上次沒送出的回報時立即啟動背景送出"""
+    with _BUFFERS_LOCK:
+        queue = _BUFFERS.get(("reports", name))
+        if queue is None:
+            path = os.path.join(journal_dir, f"reports_{name}.sqlite3")
+            queue = _BUFFERS[("reports", name)] = ReportQueue(sink, path, **kwargs)
+            if queue.pending_count():
+                queue.start()
+        return queue